@@ -0,0 +1,151 @@
+# Imports
+import importlib
+import threading
+metrics = importlib.import_module('metrics')
+
+# Global variables / settings
+defaultSpeakerLimit = {'rate': 5.0, 'burst': 10}   # messages per second, and the most that may arrive at once
+defaultGlobalLimit = {'rate': 200.0, 'burst': 400}
+defaultMaxInFlight = 256  # messages admitted and not yet answered (queued or being processed)
+defaultMaxSpeakers = 10000 # speakers whose buckets are kept before full (idle) buckets are dropped
+inFlightRetryAfter = 1.0  # seconds a client is asked to wait when too many messages are in flight
+
+
+# *** TokenBucket
+# Allows `rate` messages per second on average, and bursts of up to `burst` messages
+class TokenBucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'updatedAt')
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updatedAt = now
+
+
+    # *** refill()
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updatedAt) * self.rate)
+        self.updatedAt = now
+
+
+    # *** wait()
+    # Seconds until a token is available (0 if one is available now)
+    def wait(self, now):
+        self.refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+
+# *** AdmissionControl
+# Decides whether /receiveMessage takes on a message, so that a chatty buyer or a flood of messages cannot hold up
+# the other buyers of a round: a token bucket per speaker (environment UUID and speaker), one for all messages, and
+# a bound on the messages in flight. Admitted messages must be finished with finish(). It also remembers the messages
+# of each speaker that are in flight, in the order they were admitted, so that an offer that a newer offer from the same
+# buyer supersedes need not be priced (see superseded()).
+class AdmissionControl:
+
+    def __init__(self, settings, clock):
+        speakerLimit = dict(defaultSpeakerLimit, **settings.get('perSpeaker', {}))
+        globalLimit = dict(defaultGlobalLimit, **settings.get('global', {}))
+        self.speakerRate = float(speakerLimit['rate'])
+        self.speakerBurst = float(speakerLimit['burst'])
+        self.maxInFlight = settings.get('maxInFlight', defaultMaxInFlight)
+        self.maxSpeakers = settings.get('maxSpeakers', defaultMaxSpeakers)
+        self.coalesce = settings.get('coalesce', True)
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.globalBucket = TokenBucket(float(globalLimit['rate']), float(globalLimit['burst']), clock())
+        self.buckets = {} # speaker key -> TokenBucket
+        self.pending = {} # speaker key -> messages admitted and still in flight, oldest first
+        self.inFlight = 0
+        self.stats = {'admitted': 0, 'coalesced': 0}
+        self.deferred = {'speakerRate': 0, 'globalRate': 0, 'inFlight': 0}
+
+
+    # *** admit()
+    # Take on a message from the speaker `key`, or say why not: None if the message is admitted, and otherwise
+    # (reason, seconds after which to retry)
+    def admit(self, key, message):
+        now = self.clock()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                if len(self.buckets) >= self.maxSpeakers:
+                    self.prune(now)
+                bucket = self.buckets[key] = TokenBucket(self.speakerRate, self.speakerBurst, now)
+            deferral = None
+            if self.inFlight >= self.maxInFlight:
+                deferral = ('inFlight', 'too many messages in flight', inFlightRetryAfter)
+            else:
+                wait = bucket.wait(now)
+                if wait:
+                    deferral = ('speakerRate', 'too many messages from ' + str(key[1]), wait)
+                else:
+                    wait = self.globalBucket.wait(now)
+                    if wait:
+                        deferral = ('globalRate', 'too many messages', wait)
+            if deferral:
+                self.deferred[deferral[0]] += 1
+            else:
+                bucket.tokens -= 1
+                self.globalBucket.tokens -= 1
+                self.inFlight += 1
+                self.pending.setdefault(key, []).append(message)
+                self.stats['admitted'] += 1
+        outcome = deferral[0] if deferral else 'admitted'
+        metrics.counter('agent_admission_total', 'Messages admitted or deferred by admission control', outcome=outcome).inc()
+        return deferral[1:] if deferral else None
+
+
+    # *** finish()
+    # A message admitted from the speaker `key` has been answered (or dropped)
+    def finish(self, key, message):
+        with self.lock:
+            self.inFlight -= 1
+            messages = self.pending.get(key, [])
+            for i, pending in enumerate(messages):
+                if pending is message:
+                    del messages[i]
+                    break
+            if not messages:
+                self.pending.pop(key, None)
+
+
+    # *** superseded()
+    # Whether a message from the speaker `key` that supersedes `message` (as decided by supersedes(newer), e.g. a newer
+    # offer to the same seller) has been admitted since. Messages that were not admitted here (e.g. replayed ones) are
+    # never superseded.
+    def superseded(self, key, message, supersedes):
+        if not self.coalesce:
+            return False
+        with self.lock:
+            messages = list(self.pending.get(key, ()))
+        for i, pending in enumerate(messages):
+            if pending is message:
+                return any(supersedes(newer) for newer in messages[i + 1:])
+        return False
+
+
+    # *** coalesced()
+    # Count an offer that was not priced because a newer message superseded it
+    def coalesced(self):
+        with self.lock:
+            self.stats['coalesced'] += 1
+        metrics.counter('agent_offers_coalesced_total', 'Offers not priced because the buyer had sent a newer message').inc()
+
+
+    # *** prune()
+    # Drop the buckets of speakers that have been quiet long enough for their bucket to be full again.
+    # Call with the lock held.
+    def prune(self, now):
+        for key in [key for key, bucket in self.buckets.items()
+                    if key not in self.pending and bucket.wait(now) == 0 and bucket.tokens >= bucket.burst]:
+            del self.buckets[key]
+
+
+    # *** report()
+    # Counters of admitted and deferred messages, for the /admissionStats API
+    def report(self):
+        with self.lock:
+            return dict(self.stats, deferred=dict(self.deferred), inFlight=self.inFlight, maxInFlight=self.maxInFlight,
+                        speakers=len(self.buckets))
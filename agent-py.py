@@ -1,427 +1,866 @@
 # Imports
 from flask import Flask
+from flask import Response
 from flask import request
+from flask import stream_with_context
 from functools import reduce
-import requests
+from functools import wraps
+import atexit
 import importlib
+import itertools
 import json
+import logging
 import sys
+import threading
 import time
 import math
+import os
 import random
-app = Flask(__name__)
+import signal
 
 conversation = importlib.import_module('conversation')
 extract_bid = importlib.import_module('extract-bid')
+reply_pipeline = importlib.import_module('reply-pipeline')
+transport = importlib.import_module('transport')
+negotiation_store = importlib.import_module('negotiation-store')
+utility_engine = importlib.import_module('utility-engine')
+metrics = importlib.import_module('metrics')
+message_templates = importlib.import_module('message-templates')
+concession_strategy = importlib.import_module('concession-strategy')
+deal_stealing = importlib.import_module('deal-stealing')
+transcript_log = importlib.import_module('transcript-log')
+speculation = importlib.import_module('speculation')
+admission_control = importlib.import_module('admission-control')
+buyer_history = importlib.import_module('buyer-history')
+round_scheduler = importlib.import_module('round-scheduler')
+profiler = importlib.import_module('profiler')
+negotiation_random = importlib.import_module('negotiation-random')
 
 # Global variables / settings
-appSettings = None
-with open('./appSettings.json') as f:
-    appSettings = json.load(f)
-myPort = appSettings['defaultPort']
-agentName = appSettings['name'] or "Agent007"
+# Nothing is read or built when this module is imported: createAgents() builds agents from the settings it is given
+# (see main() and wsgi.py), and the Watson SDK is only loaded when a message is first sent to Watson.
 defaultRole = 'buyer'
 defaultSpeaker = 'Jeff'
 defaultEnvironmentUUID = 'abcdefg'
-defaultAddressee = agentName
 defaultRoundDuration = 600
 
-# fetch the port number
-for i in range(len(sys.argv)):
-    if sys.argv[i] == "--port":
-        myPort = sys.argv[i + 1]
-
-# predefined responses
-rejectionMessages = [
-  "No thanks. Your offer is much too low for me to consider.",
-  "Forget it. That's not a serious offer.",
-  "Sorry. You're going to have to do a lot better than that!"
-]
-acceptanceMessages = [
-  "You've got a deal! I'll sell you",
-  "You've got it! I'll let you have",
-  "I accept your offer. Just to confirm, I'll give you"
-]
-confirmAcceptanceMessages = [
-  "I confirm that I'm selling you ",
-  "I'm so glad! This is to confirm that I'll give you ",
-  "Perfect! Just to confirm, I'm giving you "
-]
-negotiationState = {
-  "active": False,
-  "startTime": None,
-  "roundDuration": defaultRoundDuration
-}
-
-utilityInfo = None
-bidHistory = {}
-
-# ************************************************************************************************************ #
-# REQUIRED APIs
-# ************************************************************************************************************ #
-
-# API route that receives utility information from the environment orchestrator. This also
-# triggers the start of a round and the associated timer.
-@app.route('/setUtility', methods=['POST'])
-def setUtility():
-    if request.json:
-        global utilityInfo
-        utilityInfo = request.json
-        global agentName
-        agentName = utilityInfo['name'] or agentName
+logger = logging.getLogger('agent-py')
+
+
+# *** route()
+# Mark a NegotiationAgent method as the handler of an API route; createApp() registers it with the agent's Flask app
+def route(rule, methods):
+    def decorate(f):
+        f.routes = getattr(f, 'routes', []) + [(rule, methods)]
+        return f
+    return decorate
+
+
+# *** NegotiationAgent
+# One seller agent: its settings, negotiation state, reply workers, outbound connections and Flask app. Several agents
+# (with different names, on different ports or under different path prefixes) can be hosted in one process, sharing
+# one Conversation (classifier and classification cache).
+class NegotiationAgent:
+
+    def __init__(self, appSettings, conversation):
+        self.appSettings = appSettings
+        self.conversation = conversation
+        self.name = appSettings.get('name') or "Agent007"
+        self.port = appSettings.get('defaultPort')
+        self.defaultAddressee = self.name
+
+        # Phrasings of offers, acceptances and rejections, compiled once; the phrase set (persona or locale) is chosen
+        # in the `messages` block of appSettings.json
+        self.phraseSet = message_templates.loadPhraseSet(appSettings.get('messages', {}))
+
+        # Utility, name and round state per environment, and bid history per environment and buyer. Each negotiation
+        # session has its own lock, so that messages from many buyers in many environments can be handled concurrently.
+        self.negotiationStore = negotiation_store.NegotiationStore(self.name, defaultRoundDuration)
+
+        # With counterOfferMode 'search', the agent looks for alternative bundles: upselling a larger bundle when the buyer
+        # names no price, and offering a smaller bundle for the buyer's price when that price is too low for what they asked.
+        self.engineSettings = appSettings.get('utilityEngine', {})
+        self.counterOfferMode = self.engineSettings.get('counterOfferMode', 'off')
+
+        # How the API is served (see serve()), and how long to wait for queued replies to be sent at /endRound and at
+        # shutdown. The agent is ready (see /ready) until it starts shutting down.
+        self.servingSettings = appSettings.get('serving', {})
+        self.drainTimeout = self.servingSettings.get('drainTimeout', 5.0)
+        self.ready = True
+
+        # The concession strategy prices counteroffers (see concession-strategy.py). It is prepared for each round at
+        # /startRound, and can be changed at runtime through /setStrategy.
+        self.strategySettings = appSettings.get('strategy', {'name': 'linear'})
+        self.defaultStrategy = concession_strategy.createStrategy(self.strategySettings, defaultRoundDuration)
+
+        # When transcripts are enabled, every round is recorded in an append-only log (see transcript-log.py) that replay.py
+        # can feed back through processMessage(). The random seed of each round is recorded with it, and the agent reads
+        # the time through clock() and draws random numbers from the generator of each negotiation, seeded from the
+        # round's seed and number, the environment and the buyer (see negotiation-random.py), so that a replay can
+        # reproduce the bids that were made.
+        self.transcriptSettings = appSettings.get('transcripts', {})
+        self.clock = time.time
+        self.randomSettings = appSettings.get('random', {})
+        self.randomSource = negotiation_random.RandomSource(self.randomSettings)
+
+        # With deal stealing enabled, the agent learns from the offers of other sellers that it overhears, and answers
+        # offers that were not addressed to it when the policy allows, undercutting the competition.
+        self.stealPolicy = deal_stealing.StealPolicy(appSettings.get('dealStealing', {}))
+
+        # With speculation enabled, the agent precomputes its bids for likely counters right after sending an offer, and
+        # recognizes accepts, rejects and counters to that offer without the classifier (see speculation.py).
+        # Speculative bids read the negotiation's next random numbers ahead, and use them up only if they are sent.
+        speculationSettings = appSettings.get('speculation', {})
+        self.speculator = None
+        if speculationSettings.get('enabled'):
+            self.speculator = speculation.Speculator(speculationSettings, conversation.skillFile)
+
+        # With admission control enabled, /receiveMessage defers (with status 429) messages beyond the rate allowed per
+        # speaker and overall, or beyond the bound on messages in flight, and an offer that the buyer has superseded
+        # with a newer message before it was priced is not answered.
+        admissionSettings = appSettings.get('admission', {})
+        self.admission = None
+        if admissionSettings.get('enabled'):
+            self.admission = admission_control.AdmissionControl(admissionSettings, time.monotonic)
+
+        # With buyerHistory enabled, what the agent learns about each buyer (how much markup they concede from one offer to
+        # the next, and the markups at which they make deals) is kept across rounds and restarts (see buyer-history.py),
+        # and counteroffers ask at least what that history says the buyer is likely to pay.
+        historySettings = appSettings.get('buyerHistory', {})
+        self.buyerHistory = None
+        if historySettings.get('enabled'):
+            self.buyerHistory = buyer_history.BuyerHistory(historySettings)
+
+        # The round scheduler owns the timers of each round: its start (when /startRound names a later startTime), a
+        # warning `warnings` seconds before its end, and its end, which stops the round and cancels the work still queued
+        # for it, as /endRound does. In the last priorityWindow seconds of a round, queued replies to near-deals are
+        # handled first (see replyPriority()).
+        self.schedulerSettings = appSettings.get('scheduler', {})
+        self.roundWarnings = self.schedulerSettings.get('warnings', [60, 10])
+        self.priorityWindow = self.schedulerSettings.get('priorityWindow', 60.0)
+        self.maxPriorityBoost = self.schedulerSettings.get('maxPriorityBoost', 5.0)
+        self.scheduler = round_scheduler.RoundScheduler(lambda: self.clock())
+
+        # With profiling enabled (in the settings for every round, or through /setProfiling for the rounds of one
+        # environment), a sampling profiler records where the API handlers, message processing and outbound posts spend
+        # their time during a round, and writes a flame graph and a summary of it at /endRound (see profiler.py).
+        self.profilingSettings = appSettings.get('profiling', {})
+        self.profiler = profiler.RoundProfiler(
+            self.profilingSettings,
+            [member for member in vars(NegotiationAgent).values() if getattr(member, 'routes', None)] +
+            [NegotiationAgent.handleMessage, NegotiationAgent.processMessage, transport.Transport.postNow,
+             transport.Batcher.flush],
+            hidden=[metrics.__file__])
+
+        # Persistent, pooled connections to the services in the serviceMap
+        self.outboundTransport = transport.Transport(
+            {serviceType: options2URL(options) for serviceType, options in appSettings['serviceMap'].items() if options},
+            appSettings.get('transport', {}))
+
+        # When asynchronous replies are enabled, /receiveMessage only queues the message and acknowledges it;
+        # classification, bidding and relaying the reply happen on a pool of worker threads.
+        asyncSettings = appSettings.get('asyncReplies', {})
+        self.replyPipeline = None
+        if asyncSettings.get('enabled'):
+            self.replyPipeline = reply_pipeline.ReplyPipeline(self.handleMessage, asyncSettings.get('workers', 4),
+                                                              self.replyPriority)
+
+        self.app = self.createApp()
+        metrics.addCollector(self.agentMetrics)
+        atexit.register(self.shutdown)
+
+
+    # *** createApp()
+    # Flask app serving the API routes of this agent
+    def createApp(self):
+        app = Flask(__name__)
+        for name, member in vars(NegotiationAgent).items():
+            for rule, methods in getattr(member, 'routes', []):
+                app.add_url_rule(rule, name, self.profiledHandler(getattr(self, name)), methods=methods)
+        return app
+
+
+    # *** profiledHandler()
+    # A route handler that, while a round is being profiled, lets the profiler count its samples in the round of the
+    # environment named in the request
+    def profiledHandler(self, handler):
+        @wraps(handler)
+        def attributed(*args, **kwargs):
+            if not self.profiler.rounds:
+                return handler(*args, **kwargs)
+            body = request.get_json(silent=True)
+            environmentUUID = body.get('environmentUUID') if isinstance(body, dict) else request.args.get('environmentUUID')
+            with self.profiler.serving(self.negotiationStore.environment(environmentUUID)):
+                return handler(*args, **kwargs)
+        return attributed
+
+
+    # ************************************************************************************************************ #
+    # REQUIRED APIs
+    # ************************************************************************************************************ #
+
+    # API route that receives utility information from the environment orchestrator. This also
+    # triggers the start of a round and the associated timer.
+    @route('/setUtility', methods=['POST'])
+    def setUtility(self):
+        if request.json:
+            utilityInfo = request.json
+            try:
+                utilityEngine = utility_engine.compileUtility(utilityInfo) # Validate and precompile once, rather than on every bid
+            except ValueError as e:
+                msg = {
+                    'status': "Failed; invalid utility: " + str(e),
+                    'utility': None
+                }
+                return msg
+            environment = self.negotiationStore.registerEnvironment(utilityInfo.get('environmentUUID'))
+            with environment.lock:
+                environment.utilityInfo = utilityInfo
+                environment.utilityEngine = utilityEngine
+                environment.agentName = utilityInfo['name'] or environment.agentName
+            msg = {
+                'status': 'Acknowledged',
+                'utility': utilityInfo
+            }
+            return msg
+        else:
+            msg = {
+                'status': "Failed; no message body",
+                'utility': None
+            }
+            return msg
+
+
+    # API route that tells the agent that the round has started.
+    @route('/startRound', methods=['POST'])
+    def startRound(self):
+        try: # Checked before anything changes, so that a bad request leaves the round as it was
+            startTime = optionalNumber(request.json or {}, 'startTime')
+            roundDuration = optionalNumber(request.json or {}, 'roundDuration')
+            if roundDuration is not None and roundDuration <= 0:
+                raise ValueError("roundDuration must be positive")
+        except ValueError as e:
+            return {'status': "Failed; " + str(e)}
+        environment = self.negotiationStore.registerEnvironment(request.json.get('environmentUUID') if request.json else None)
+        self.negotiationStore.clearSessions(environment)
+        environment.competitors.newRound()
+        # Recorded with the transcript, so that the round can be replayed
+        seed = (request.json or {}).get('seed') or self.randomSettings.get('seed') or random.SystemRandom().getrandbits(32)
+        if self.speculator:
+            self.speculator.forget(environment.environmentUUID)
+        if self.buyerHistory:
+            self.buyerHistory.startRound()
+        self.scheduler.cancel(environment.environmentUUID) # Timers left over from the previous round
+        with environment.lock:
+            negotiationState = environment.ownNegotiationState # Not the default environment's, even before it starts
+            if request.json:
+                negotiationState['roundDuration'] = roundDuration or negotiationState['roundDuration']
+                negotiationState['roundNumber'] = request.json.get('roundNumber') or negotiationState.get('roundNumber', 1)
+            negotiationState['seed'] = seed
+            now = self.clock() * 1000
+            negotiationState['startTime'] = max(now, startTime or now)
+            negotiationState['stopTime'] = negotiationState['startTime'] + (1000 * negotiationState['roundDuration'])
+            negotiationState['active'] = negotiationState['startTime'] <= now
+            environment.strategy = concession_strategy.createStrategy(self.strategySettings, negotiationState['roundDuration'])
+            if self.transcriptSettings.get('enabled'):
+                self.openTranscript(environment, seed)
+            self.scheduleRound(environment)
+        self.profiler.stop(environment) # A round that never got its /endRound; written without the environment lock held
+        if self.profilingSettings.get('enabled') if environment.profile is None else environment.profile:
+            self.startProfile(environment)
         msg = {
-            'status': 'Acknowledged',
-            'utility': utilityInfo
+            'status': 'Acknowledged'
         }
         return msg
-    else:
+
+
+    # API route that tells the agent that the round has ended.
+    @route('/endRound', methods=['POST'])
+    def endRound(self):
+        environment = self.negotiationStore.environment(request.json.get('environmentUUID') if request.json else None)
+        with environment.lock:
+            environment.negotiationState['active'] = False
+            environment.negotiationState['endTime'] = (self.clock() * 1000)
+        self.scheduler.cancel(environment.environmentUUID)
+        self.cancelPendingWork(environment)
+        self.drainReplies(self.drainTimeout, environment.environmentUUID) # Send the replies being worked on when the round ended
+        with environment.lock:
+            if environment.transcript:
+                environment.transcript.record('endRound', {'endTime': environment.negotiationState['endTime']})
+                environment.transcript.close()
+                environment.transcript = None
+        if self.conversation.classificationCache:
+            self.conversation.classificationCache.save()
+        if self.buyerHistory:
+            self.buyerHistory.flush()
+        self.stopProfile(environment)
         msg = {
-            'status': "Failed; no message body",
-            'utility': None
+            'status': 'Acknowledged'
         }
         return msg
 
 
-# API route that tells the agent that the round has started.
-@app.route('/startRound', methods=['POST'])
-def startRound():
-    bidHistory = {}
-    if request.json:
-        negotiationState['roundDuration'] = request.json['roundDuration'] or negotiationState['roundDuration']
-        negotiationState['roundNumber'] = request.json['roundNumber'] or negotiationState['roundNumber']
-    negotiationState['active'] = True
-    negotiationState['startTime'] = (time.time() * 1000)
-    negotiationState['stopTime'] = negotiationState['startTime'] + (1000 * negotiationState['roundDuration'])
-    msg = {
-        'status': 'Acknowledged'
-    }
-    return msg
-
-
-# API route that tells the agent that the round has ended.
-@app.route('/endRound', methods=['POST'])
-def endRound():
-    negotiationState['active'] = False
-    negotiationState['endTime'] = (time.time() * 1000)
-    msg = {
-        'status': 'Acknowledged'
-    }
-    return msg
-
-
-# POST API that receives a message, interprets it, decides how to respond (e.g. Accept, Reject, or counteroffer),
-# and if it desires sends a separate message to the /receiveMessage route of the environment orchestrator
-@app.route('/receiveMessage', methods=['POST'])
-def receiveMessage():
-    timeRemaining = (negotiationState['stopTime'] - (time.time() * 1000)) / 1000
-    if timeRemaining <= 0:
-        negotiationState['active'] = False
-    
-    response = None
-    if not request.json:
-        response = {
-            'status': "Failed; no message body"
-        }
-    elif negotiationState['active']: # We received a message and time remains in the round.
-        message = request.json
-        message['speaker'] = message['speaker'] or defaultSpeaker
-        message['addressee'] = message['addressee']
-        message['role'] = message['role'] or message['defaultRole']
-        message['environmentUUID'] = message['environmentUUID'] or defaultEnvironmentUUID
-        response = { # Acknowledge receipt of message from the environment orchestrator
-            'status': "Acknowledged",
-            'interpretation': message
-        }
-        if message['speaker'] == agentName:
-            print("This message is from me!")
-        else:
-            bidMessage = processMessage(message)
-            if bidMessage: # If warranted, proactively send a new negotiation message to the environment orchestrator
-                sendMessage(bidMessage)
-    else: # Either there's no body or the round is over.
-        response = {
-            'status': "Failed; round not active"
-        }
-    return response
-
-
-# POST API that receives a rejection message, and decides how to respond to it. If the rejection is based upon
-# insufficient funds on the part of the buyer, generate an informational message to send back to the human, as a courtesy
-# (or rather to explain why we are not able to confirm acceptance of an offer).
-@app.route('/receiveRejection', methods=['POST'])
-def receiveRejection():
-    timeRemaining = (negotiationState['stopTime'] - (time.time() * 1000)) / 1000
-    if timeRemaining <= 0:
-        negotiationState['active'] = False
-    
-    response = None
-    if not request.json:
-        response = {
-            'status': 'Failed; no message body'
-        }
-    elif negotiationState['active']: # We received a message and time remains in the round.
-        message = request.json
-        response = { # Acknowledge receipt of message from the environment orchestrator
-            'status': 'Acknowledged',
-            'message': message
-        }
-        if (message['ratiolan']
-            and message['rational'] == 'Insufficient budget'
-            and message['bid']
-            and message['bid']['type'] == "Accept"): # We tried to respond with an accept, but were rejected.
-                                                     # So that the buyer will not interpret our apparent silence as rudeness, 
-                                                     # explain to the Human that he/she were rejected due to insufficient budget.
-            msg2 = json.loads(json.dumps(message))
-            del msg2['rational']
-            del msg2['bid']
-            msg2['timestamp'] = (time.time() * 1000)
-            msg2['text'] = "I'm sorry, " + msg2['addressee'] + ". I wasready to make a deal, but apparently you don't have enough money left."
-            sendMessage(msg2)
-    else: # Either there's no body or the round is over.
-        response = {
-            'status': "Failed; round not active"
-        }
+    # POST API that receives a message, interprets it, decides how to respond (e.g. Accept, Reject, or counteroffer),
+    # and if it desires sends a separate message to the /receiveMessage route of the environment orchestrator
+    @route('/receiveMessage', methods=['POST'])
+    def receiveMessage(self):
+        environment = self.negotiationStore.environment(request.json.get('environmentUUID') if request.json else None)
+        negotiationState = environment.negotiationState # The round scheduler makes the round inactive when it ends
+
+        response = None
+        if not request.json:
+            response = {
+                'status': "Failed; no message body"
+            }
+        elif negotiationState['active']: # We received a message and time remains in the round.
+            message = request.json
+            message['speaker'] = message['speaker'] or defaultSpeaker
+            message['addressee'] = message['addressee']
+            message['role'] = message['role'] or message['defaultRole']
+            message['environmentUUID'] = message['environmentUUID'] or defaultEnvironmentUUID
+            if environment.utilityEngine is None and message['speaker'] != environment.agentName:
+                return {'status': "Failed; no utility function"}
+            if self.admission and message['speaker'] != environment.agentName:
+                deferral = self.admission.admit((message['environmentUUID'], message['speaker']), message)
+                if deferral: # Not taken on; the orchestrator may send it again later
+                    reason, retryAfter = deferral
+                    return ({'status': "Deferred; " + reason, 'retryAfter': retryAfter}, 429,
+                            {'Retry-After': str(math.ceil(retryAfter))})
+            self.recordEvent(environment, 'inbound', message)
+            response = { # Acknowledge receipt of message from the environment orchestrator
+                'status': "Acknowledged",
+                'interpretation': message
+            }
+            if message['speaker'] == environment.agentName:
+                logger.debug("This message is from me!")
+            elif self.replyPipeline: # Reply from a worker thread, after messages already queued for this buyer
+                self.replyPipeline.submit((message['environmentUUID'], message['speaker']), message)
+            else:
+                self.handleMessage(message)
+        else: # Either there's no body or the round is over.
+            response = {
+                'status': "Failed; round not active"
+            }
+        return response
 
-    return response
 
-# ************************************************************************************************************ #
-# Non-required APIs (useful for unit testing)
-# ************************************************************************************************************ #
+    # POST API that receives a rejection message, and decides how to respond to it. If the rejection is based upon
+    # insufficient funds on the part of the buyer, generate an informational message to send back to the human, as a courtesy
+    # (or rather to explain why we are not able to confirm acceptance of an offer).
+    @route('/receiveRejection', methods=['POST'])
+    def receiveRejection(self):
+        environment = self.negotiationStore.environment(request.json.get('environmentUUID') if request.json else None)
+        negotiationState = environment.negotiationState # The round scheduler makes the round inactive when it ends
 
-# GET API route that simply calls Watson Assistant on the supplied text message to obtain intent and entities
-@app.route('/classifyMessage', methods=['GET'])
-def classifyMessageGet():
+        response = None
+        if not request.json:
+            response = {
+                'status': 'Failed; no message body'
+            }
+        elif negotiationState['active']: # We received a message and time remains in the round.
+            message = request.json
+            response = { # Acknowledge receipt of message from the environment orchestrator
+                'status': 'Acknowledged',
+                'message': message
+            }
+            if (message['ratiolan']
+                and message['rational'] == 'Insufficient budget'
+                and message['bid']
+                and message['bid']['type'] == "Accept"): # We tried to respond with an accept, but were rejected.
+                                                         # So that the buyer will not interpret our apparent silence as rudeness,
+                                                         # explain to the Human that he/she were rejected due to insufficient budget.
+                msg2 = json.loads(json.dumps(message))
+                del msg2['rational']
+                del msg2['bid']
+                msg2['timestamp'] = (self.clock() * 1000)
+                msg2['text'] = "I'm sorry, " + msg2['addressee'] + ". I wasready to make a deal, but apparently you don't have enough money left."
+                self.sendMessage(msg2)
+        else: # Either there's no body or the round is over.
+            response = {
+                'status': "Failed; round not active"
+            }
 
-    data = request.json
+        return response
 
-    if data['text']:
-        text = data['text']
-        message = { # Hard-code the speaker, role and envUUID
-            'text': text,
-            'speaker': defaultSpeaker,
-            'addressee': defaultAddressee,
-            'role': defaultRole,
-            'environmentUUID': defaultEnvironmentUUID
-        }
-        waResponse = conversation.classifyMessage(message)
-        return waResponse
-
-
-# POST API route that simply calls Watson Assistant on the supplied text message to obtain intents and entities
-@app.route('/classifyMessage', methods=['POST'])
-def classifyMessagePost():
-    if request.json:
-        message = request.json
-        message['speaker'] = message['speaker'] or defaultSpeaker
-        message['addressee'] = message['addressee'] or None
-        message['role'] = message['role'] or message['defaultRole']
-        message['environmentUUID'] = message['environmentUUID'] or defaultEnvironmentUUID
-        waResponse = conversation.classifyMessage(message, message['environmentUUID'])
-        if waResponse:
+    # ************************************************************************************************************ #
+    # Non-required APIs (useful for unit testing)
+    # ************************************************************************************************************ #
+
+    # GET API route that simply calls Watson Assistant on the supplied text message to obtain intent and entities
+    @route('/classifyMessage', methods=['GET'])
+    def classifyMessageGet(self):
+
+        data = request.json
+
+        if data['text']:
+            text = data['text']
+            message = { # Hard-code the speaker, role and envUUID
+                'text': text,
+                'speaker': defaultSpeaker,
+                'addressee': self.defaultAddressee,
+                'role': defaultRole,
+                'environmentUUID': defaultEnvironmentUUID
+            }
+            waResponse = self.conversation.classifyMessage(message)
             return waResponse
-        return "error classifying post"
 
 
-# POST API route that is similar to /classify Message, but takes the further
-# step of determining the type and parameters of the message (if it is a negotiation act),
-# and formatting this information in the form of a structured bid.
-@app.route('/extractBid', methods=['POST'])
-def extractBid():
+    # POST API route that simply calls Watson Assistant on the supplied text message to obtain intents and entities
+    @route('/classifyMessage', methods=['POST'])
+    def classifyMessagePost(self):
+        if request.json:
+            message = request.json
+            message['speaker'] = message['speaker'] or defaultSpeaker
+            message['addressee'] = message['addressee'] or None
+            message['role'] = message['role'] or message['defaultRole']
+            message['environmentUUID'] = message['environmentUUID'] or defaultEnvironmentUUID
+            waResponse = self.conversation.classifyMessage(message)
+            if waResponse:
+                return waResponse
+            return "error classifying post"
+
+
+    # POST API route that is similar to /classify Message, but takes the further
+    # step of determining the type and parameters of the message (if it is a negotiation act),
+    # and formatting this information in the form of a structured bid.
+    @route('/extractBid', methods=['POST'])
+    def extractBid(self):
+
+        if request.json:
+            message = request.json
+            message['speaker'] = message['speaker'] or defaultSpeaker
+            message['addressee'] = message['addressee'] or None
+            message['role'] = message['role'] or message['defaultRole']
+            message['environmentUUID'] = message['environmentUUID'] or defaultEnvironmentUUID
+            extractedBid = extract_bid.extractBidFromMessage(message, self.conversation)
+            if extractedBid:
+                return extractedBid
+            return "error extracting bid"
+
+
+    # POST API route that extracts bids from many messages at once, for bulk offline interpretation (e.g. replaying
+    # transcripts). The body is one JSON message per line, read as it arrives, or a JSON array of messages (which is read
+    # whole). Messages are classified with bounded concurrency (query parameter `concurrency`), identical texts are
+    # classified once, and the results are streamed back as JSON lines, in the same order as the messages. A line that
+    # is not a JSON message gets an error result.
+    @route('/extractBids', methods=['POST'])
+    def extractBids(self):
+        defaults = {'speaker': defaultSpeaker, 'addressee': None, 'role': defaultRole, 'environmentUUID': defaultEnvironmentUUID}
+        concurrency = min(max(request.args.get('concurrency', 8, type=int), 1), 64)
+        stream = request.stream
+
+        def readMessages():
+            first = stream.readline()
+            while first and not first.strip():
+                first = stream.readline()
+            if first.lstrip().startswith(b'['):
+                try:
+                    messages = json.loads(first + stream.read())
+                except ValueError as e:
+                    yield extract_bid.MalformedMessage(first.decode('utf-8', errors='replace').strip(), "invalid JSON: " + str(e))
+                    return
+                for message in messages:
+                    if isinstance(message, dict):
+                        yield extract_bid.withDefaults(message, defaults)
+                    else:
+                        yield extract_bid.MalformedMessage(json.dumps(message), "not a JSON object")
+                return
+            yield from extract_bid.readMessageLines(itertools.chain([first], iter(stream.readline, b'')), defaults)
+
+        def generate():
+            for message, bid, error in extract_bid.extractBidsFromMessages(readMessages(), self.conversation, concurrency):
+                result = {'message': message, 'error': error} if error else {'message': message, 'bid': bid}
+                yield json.dumps(result) + '\n'
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+    # POST API route that changes the concession strategy, e.g. {"name": "boulware", "params": {"beta": 0.1}}. The new
+    # strategy is used from the next message on, in every environment, and for later rounds.
+    @route('/setStrategy', methods=['POST'])
+    def setStrategy(self):
+        settings = request.json or {}
+        try:
+            defaultStrategy = concession_strategy.createStrategy(settings, defaultRoundDuration)
+        except ValueError as e:
+            return {'status': "Failed; " + str(e), 'strategy': None}
+        self.defaultStrategy = defaultStrategy
+        self.strategySettings = {'name': defaultStrategy.name, 'params': settings.get('params') or {}}
+        for environment in list(self.negotiationStore.environments.values()) + [self.negotiationStore.defaultEnvironment]:
+            with environment.lock:
+                if environment.strategy:
+                    environment.strategy = concession_strategy.createStrategy(
+                        self.strategySettings, environment.negotiationState['roundDuration'])
+        return {'status': 'Acknowledged', 'strategy': defaultStrategy.describe()}
+
+
+    # API route that reports the concession strategy in use.
+    @route('/strategy', methods=['GET'])
+    def strategyReport(self):
+        environment = self.negotiationStore.environment(request.args.get('environmentUUID'))
+        return (environment.strategy or self.defaultStrategy).describe()
+
+
+    # POST API route that turns profiling on or off for the rounds of an environment, e.g. {"environmentUUID": "abcdefg",
+    # "enabled": true}. Turning it on during a round profiles the rest of that round; turning it off writes the
+    # profile of the current round.
+    @route('/setProfiling', methods=['POST'])
+    def setProfiling(self):
+        settings = request.json or {}
+        environment = self.negotiationStore.environment(settings.get('environmentUUID'))
+        environment.profile = bool(settings.get('enabled'))
+        written = None
+        if environment.profile:
+            with environment.lock:
+                if environment.negotiationState['active']:
+                    self.startProfile(environment)
+        else: # Writes the profile, without the environment lock held
+            written = self.stopProfile(environment)
+        return {'status': 'Acknowledged', 'profiling': environment.profile, 'written': written}
+
+
+    # API route that reports the rounds being profiled and the profiles written last.
+    @route('/profiling', methods=['GET'])
+    def profilingReport(self):
+        return self.profiler.report()
+
+
+    # API route that reports the current utility information.
+    @route('/reportUtility', methods=['GET'])
+    def reportUtility(self):
+        utilityInfo = self.negotiationStore.environment(request.args.get('environmentUUID')).utilityInfo
+        if utilityInfo:
+            return utilityInfo
+        else:
+            return {'error': 'utilityInfo not initialized'}
+
+
+    # API route for liveness checks: answers as long as the process serves requests.
+    @route('/health', methods=['GET'])
+    def health(self):
+        return {'status': 'ok'}
+
+
+    # API route for readiness checks: answers with status 503 while the agent is shutting down, or if its reply workers
+    # or batchers have died, so that a load balancer or orchestrator stops sending it messages.
+    @route('/ready', methods=['GET'])
+    def readiness(self):
+        problems = []
+        if not self.ready:
+            problems.append('shutting down')
+        if self.replyPipeline and not all(thread.is_alive() for thread in self.replyPipeline.threads):
+            problems.append('reply workers stopped')
+        if not all(batcher.thread.is_alive() for batcher in self.outboundTransport.batchers.values()):
+            problems.append('batcher stopped')
+        if problems:
+            return {'status': 'not ready', 'problems': problems}, 503
+        return {'status': 'ready'}
+
+
+    # API route that reports timing histograms of the hot path, and other counters, in the Prometheus text format.
+    # The histograms cover every agent hosted in the process.
+    @route('/metrics', methods=['GET'])
+    def metricsReport(self):
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+    # API route that reports what the agent has learned about competing sellers in an environment, and its attempts
+    # to steal deals from them.
+    @route('/competitorStats', methods=['GET'])
+    def competitorStats(self):
+        return self.negotiationStore.environment(request.args.get('environmentUUID')).competitors.report()
+
+
+    # API route that reports what the agent has learned about the buyers named by the `buyer` query parameters
+    # (which may be repeated), and how much of its buyer history it has loaded.
+    @route('/buyerStats', methods=['GET'])
+    def buyerStats(self):
+        if self.buyerHistory:
+            return self.buyerHistory.report(request.args.getlist('buyer'))
+        else:
+            return {'error': 'buyer history disabled'}
 
-    if request.json:
-        message = request.json
-        message['speaker'] = message['speaker'] or defaultSpeaker
-        message['addressee'] = message['addressee'] or None
-        message['role'] = message['role'] or message['defaultRole']
-        message['environmentUUID'] = message['environmentUUID'] or defaultEnvironmentUUID
-        extractedBid = extract_bid.extractBidFromMessage(message)
-        if extractedBid:
-            return extractedBid
-        return "error extracting bid"
 
+    # API route that reports the pending timers of the round scheduler.
+    @route('/schedulerStats', methods=['GET'])
+    def schedulerStats(self):
+        return self.scheduler.report()
 
-# API route that reports the current utility information.
-@app.route('/reportUtility', methods=['GET'])
-def reportUtility():
-    if utilityInfo:
-        return utilityInfo
-    else:
-        return {'error': 'utilityInfo not initialized'}
 
+    # API route that reports how many environments and negotiation sessions the agent is holding.
+    @route('/sessionStats', methods=['GET'])
+    def sessionStats(self):
+        return self.negotiationStore.report()
 
-# ******************************************************************************************************* #
-# ******************************************************************************************************* #
-#                                               Functions
-# ******************************************************************************************************* #
-# ******************************************************************************************************* #
 
+    # API route that reports the queue depth and end-to-end latency of the asynchronous reply pipeline.
+    @route('/pipelineStats', methods=['GET'])
+    def pipelineStats(self):
+        if self.replyPipeline:
+            return self.replyPipeline.report()
+        else:
+            return {'error': 'asynchronous replies disabled'}
 
-# ******************************************************************************************************* #
-#                                         Bidding Algorithm Functions                                     #
-# ******************************************************************************************************* #
 
-# *** mayIRespond()                 
-# Choose not to respond to certain messages, either because the received offer has the wrong role
-# or because a different agent is being addressed. Note that this self-censoring is stricter than that required
-# by competition rules, i.e. this agent is not trying to steal a deal despite this being permitted under the
-# right circumstances. You can do better than this!
-def mayIRespond(interpretation):
-    return (interpretation and
-            interpretation['metadata']['role'] and
-            (interpretation['metadata']['addressee'] == agentName or
-            not interpretation['metadata']['addressee']))
+    # API route that reports how many messages admission control has admitted, deferred and coalesced.
+    @route('/admissionStats', methods=['GET'])
+    def admissionStats(self):
+        if self.admission:
+            return self.admission.report()
+        else:
+            return {'error': 'admission control disabled'}
 
 
-# *** calculateUtilitySeller() 
-# Calculate utility for a given bundle of goods and price, given the utility function
-def calculateUtilityAgent(utilityInfo, bundle):
-    utilityParams = utilityInfo['utility']
-    util = 0
-    price = bundle['price']['value'] or 0
-
-    if bundle['quantity']:
-        util = price
-        unit = bundle['price']['value'] or None
-        if not unit: # Check units -- not really used, but a good practice in case we want
-                     # to support currency conversion some day
-            print("no currency units provided")
-        elif unit == utilityInfo['currencyUnit']:
-            print("Currency units match")
+    # API route that reports how many speculations about buyers' replies are held.
+    @route('/speculationStats', methods=['GET'])
+    def speculationStats(self):
+        if self.speculator:
+            return self.speculator.report()
         else:
-            print("Currency units do not match")
-    
-    for good in bundle['quantity'].keys():
-        util -= utilityParams[good]['parameters']['unitcost'] * bundle['quantity'][good]
-    
-    return util
+            return {'error': 'speculation disabled'}
 
 
-# *** generateBid()
-# Given a received offer and some very recent prior bidding history, generate a bid
-# including the type (Accept, Reject, and the terms (bundle and price).
-def generateBid(offer):
-    minDicker = 0.10
-    buyerName = offer['metadata']['speaker']
-    
-    myRecentOffers = [bidBlock for bidBlock in bidHistory[buyerName] if bidBlock['type'] == "SellOffer"]
-    myLastPrice = None
-    if len(myRecentOffers):
-        myLastPrice = myRecentOffers[len(myRecentOffers) - 1]['price']['value']
-    
-    timeRemaining = (negotiationState['stopTime'] - (time.time() * 1000)) / 1000
-    utility = calculateUtilityAgent(utilityInfo, offer)
-
-    # Note that we are making no effort to upsell the buyer on a different package of goods than what they requested.
-    # It would be legal to do so, and perhaps profitable in some situations -- consider doing that!
-
-    bid = {
-        'quantity': offer['quantity']
-    }
-
-    if offer['price'] and offer['price']['value']: # The buyer included a proposed price, which we must take into account
-        bundleCost = offer['price']['value'] - utility
-        markupRatio = utility / bundleCost
-
-        if (markupRatio > 2.0
-            or (myLastPrice != None
-            and abs(offer['price']['value'] - myLastPrice) < minDicker)): # If our markup is large, accept the offer
-
-            bid['type'] = 'Accept'
-            bid['price'] = offer['price']
-
-        elif markupRatio < -0.5: # If buyer's offer is substantially below our cost, reject their offer
-            bid['type'] = 'Reject'
-            bid['price'] = None
-        else: # If buyer's offer is in a range where an agreement seems possible, generate a counteroffer
-            bid['type'] = 'SellOffer'
-            bid['price'] = generateSellPrice(bundleCost, offer['price'], myLastPrice, timeRemaining)
-            if bid['price']['value'] < offer['price']['value'] + minDicker:
+    # API route that reports how many messages the offer fast path parsed without the classifier.
+    @route('/fastPathStats', methods=['GET'])
+    def fastPathStats(self):
+        if self.conversation.offerParser:
+            return self.conversation.offerParser.report()
+        else:
+            return {'error': 'offer fast path disabled'}
+
+
+    # API route that reports the hit/miss/eviction counters of the classification cache.
+    @route('/classificationCacheStats', methods=['GET'])
+    def classificationCacheStats(self):
+        if self.conversation.classificationCache:
+            return self.conversation.classificationCache.report()
+        else:
+            return {'error': 'classification cache disabled'}
+
+
+    # ******************************************************************************************************* #
+    #                                         Bidding Algorithm Functions                                     #
+    # ******************************************************************************************************* #
+
+    # *** generateBid()
+    # Given a received offer and some very recent prior bidding history, generate a bid
+    # including the type (Accept, Reject, and the terms (bundle and price).
+    # Random draws come from rng (by default, the negotiation's generator). Returns None if the agent has not been
+    # given a utility function.
+    # Call with the lock of the negotiation session held.
+    @metrics.timed('generateBid')
+    def generateBid(self, offer, environment, session, rng=None):
+        return self.decideBid(offer, environment, session, rng)
+
+
+    # *** speculativeBid()
+    # generateBid() for a counter that a buyer may make (see speculate()), timed under its own label, so that the
+    # generateBid histogram only measures the bidding decisions made while a buyer waits for a reply
+    @metrics.timed('speculativeBid')
+    def speculativeBid(self, offer, environment, session, rng):
+        return self.decideBid(offer, environment, session, rng)
+
+
+    # *** decideBid()
+    # The bidding decision of generateBid() and speculativeBid()
+    def decideBid(self, offer, environment, session, rng=None):
+        minDicker = 0.10
+        utilityEngine = environment.utilityEngine
+        if utilityEngine is None:
+            logger.warning("No utility function for environment %s; not bidding", environment.environmentUUID)
+            return None
+        negotiationState = environment.negotiationState
+        strategy = environment.strategy or self.defaultStrategy
+        engineSettings = self.engineSettings
+        rng = rng or self.negotiationRandom(environment, session)
+
+        myLastOffer = session.ledger.lastOwnOffer
+        myLastPrice = None
+        if myLastOffer:
+            myLastPrice = myLastOffer.price
+
+        timeRemaining = (negotiationState['stopTime'] - (self.clock() * 1000)) / 1000
+        utility = calculateUtilityAgent(utilityEngine, offer)
+
+        # Unless counterOfferMode is 'search', we are making no effort to upsell the buyer on a different package of goods
+        # than what they requested.
+
+        bid = {
+            'quantity': offer['quantity']
+        }
+
+        if offer.get('price') and offer['price']['value']: # The buyer included a proposed price, which we must take into account
+            bundleCost = offer['price']['value'] - utility
+            markupRatio = utility / bundleCost
+
+            if (markupRatio > 2.0
+                or (myLastPrice != None
+                and abs(offer['price']['value'] - myLastPrice) < minDicker)): # If our markup is large, accept the offer
+
                 bid['type'] = 'Accept'
                 bid['price'] = offer['price']
-    else: # The buyer didn't include a proposed price, leaving us free to consider how much to charge.
-    # Set markup between 2 and 3 times the cost of the bundle and generate price accordingly.
-        markupRatio = 2.0 + random.random()
-        bid['type'] = 'SellOffer'
-        bid['price'] = {
-            'unit': utilityInfo['currencyUnit'],
-            'value': quantize((1.0 - markupRatio) * utility, 2)
+
+            elif markupRatio < -0.5: # If buyer's offer is substantially below our cost, reject their offer
+                bid['type'] = 'Reject'
+                bid['price'] = None
+            else: # If buyer's offer is in a range where an agreement seems possible, generate a counteroffer
+                bid['type'] = 'SellOffer'
+                buyerStats = self.buyerHistory.lookup(session.buyer) if self.buyerHistory else None
+                bid['price'] = self.generateSellPrice(bundleCost, offer['price'], myLastPrice, session.ledger.lastBuyerOffer,
+                                                      timeRemaining, strategy, utilityEngine, rng, buyerStats)
+                if bid['price']['value'] < offer['price']['value'] + minDicker:
+                    bid['type'] = 'Accept'
+                    bid['price'] = offer['price']
+                elif self.counterOfferMode == 'search': # Offer a smaller bundle for the buyer's price, if one is worth it
+                    alternative = utilityEngine.searchCounterOffer(
+                        offer['quantity'], offer['price']['value'], engineSettings.get('minCounterMarkupRatio', 0.2))
+                    if alternative:
+                        bid['quantity'] = alternative
+                        bid['price'] = offer['price']
+        else: # The buyer didn't include a proposed price, leaving us free to consider how much to charge.
+        # Let the strategy set the markup (by default, between 2 and 3 times the cost of the bundle) and generate price accordingly.
+            markupRatio = strategy.openingMarkup(timeRemaining, rng)
+            bid['type'] = 'SellOffer'
+            bid['price'] = {
+                'unit': utilityEngine.currencyUnit,
+                'value': quantize((1.0 - markupRatio) * utility, 2)
+            }
+            if self.counterOfferMode == 'search': # Suggest a larger bundle at the same markup
+                quantity, price = utilityEngine.searchUpsell(
+                    offer['quantity'], markupRatio - 2.0,
+                    engineSettings.get('maxExtraUnits', 2), engineSettings.get('maxUpsellPriceRatio', 1.5))
+                bid['quantity'] = quantity
+                bid['price']['value'] = quantize(price, 2)
+        return bid
+
+
+    # *** generateSellPrice()
+    # Generate a bid price that is sensitive to cost, negotiation history with this buyer, and time remaining in round,
+    # as decided by the concession strategy (by default, the most markup decreases linearly to just 0.5 at the end of the round).
+    # With the buyer's history (buyerStats), the price is at least what that history says they are likely to pay, though
+    # never more than my last price.
+    def generateSellPrice(self, bundleCost, offerPrice, myLastPrice, lastBuyerOffer, timeRemaining, strategy, utilityEngine, rng,
+                          buyerStats=None):
+        price = {
+            'unit': utilityEngine.currencyUnit,
+            'value': strategy.sellPrice(bundleCost, offerPrice['value'], myLastPrice, lastBuyerOffer, timeRemaining, rng)
         }
-    return bid
-
-
-# *** generateSellPrice()
-# Generate a bid price that is sensitive to cost, negotiation history with this buyer, and time remaining in round
-def generateSellPrice(bundleCost, offerPrice, myLastPrice, timeRemaining):
-    minMarkupRatio = 0
-    maxMarkupRatio = 0
-    markupRatio = offerPrice['value']/bundleCost - 1.0
-    if myLastPrice != None:
-        maxMarkupRatio = myLastPrice/bundleCost - 1.0
-    else:
-        maxMarkupRatio = 2.0 - 1.5 * (1.0 - timeRemaining/negotiationState['roundDuration']) # Linearly decrease max markup ratio towards 
-                                                                                             # just 0.5 at the conclusion of the round
-    minMarkupRatio = max(markupRatio, 0.20)
-    
-    minProposedMarkup = max(minMarkupRatio, markupRatio)
-    newMarkupRatio = minProposedMarkup + random.random() * (maxMarkupRatio - minProposedMarkup)
-    
-    price = {
-        'unit': offerPrice['unit'],
-        'value': (1.0 + newMarkupRatio) * bundleCost
-    }
-
-    price['value'] = quantize(price['value'], 2)
-
-    return price
-
-
-# *** processMessage() 
-# Orchestrate a sequence of
-# * classifying the message to obtain and intent and entities
-# * interpreting the intents and entities into a structured representation of the message
-# * determining (through self-policing) whether rules permit a response to the message
-# * generating a bid (or other negotiation act) in response to the offer
-def processMessage(message):
-    classification = conversation.classifyMessage(message)
-
-    classification['environmentUUID'] = message['environmentUUID']
-    interpretation = extract_bid.interpretMessage(classification)
-
-    speaker = interpretation['metadata']['speaker']
-    addressee = interpretation['metadata']['addressee']
-    role = interpretation['metadata']['role']
-
-    if speaker == agentName: # The message was from me; this means that the system allowed it to go through.
-        # If the message from me was an accept or reject, wipe out the bidHistory with this particular negotiation partner
-        # Otherwise, add the message to the bid history with this negotiation partner
-        if interpretation['type'] == 'AcceptOffer' or interpretation['type'] == 'RejectOffer':
-            bidHistory[addressee] = None
+
+        if buyerStats is not None:
+            floor = self.buyerHistory.floorMarkup(buyerStats, offerPrice['value'] / bundleCost - 1.0)
+            if floor is not None:
+                floorPrice = (1.0 + floor) * bundleCost
+                if myLastPrice is not None:
+                    floorPrice = min(floorPrice, myLastPrice)
+                price['value'] = max(price['value'], floorPrice)
+
+        price['value'] = quantize(price['value'], 2)
+
+        return price
+
+
+    # *** processMessage()
+    # Orchestrate a sequence of
+    # * classifying the message to obtain and intent and entities (unless it is a follow-up that was speculated on)
+    # * interpreting the intents and entities into a structured representation of the message
+    # * determining (through self-policing) whether rules permit a response to the message
+    # * generating a bid (or other negotiation act) in response to the offer
+    def processMessage(self, message):
+        environment = self.negotiationStore.environment(message['environmentUUID'])
+        prediction = self.speculator.match(message, self.clock()) if self.speculator else None
+        if prediction:
+            classification = prediction.classification(message)
         else:
-            if bidHistory[addressee]:
-                bidHistory[addressee].append(interpretation)
-    elif addressee == agentName and role == 'buyer': # Message was addressed to me by a buyer; continue to process
+            classification = self.conversation.classifyMessage(message)
+        self.recordEvent(environment, 'classification', classification)
+
+        classification['environmentUUID'] = message['environmentUUID']
+        interpretation = extract_bid.interpretMessage(classification)
+        self.recordEvent(environment, 'interpretation', interpretation)
+
+        speaker = interpretation['metadata']['speaker']
+        addressee = interpretation['metadata']['addressee']
+        role = interpretation['metadata']['role']
+        agentName = environment.agentName
+
+        if speaker == agentName: # The message was from me; this means that the system allowed it to go through.
+            # If the message from me was an accept or reject, wipe out the bid history with this particular negotiation partner
+            # Otherwise, add the message to the bid history with this negotiation partner
+            session = self.negotiationStore.session(message['environmentUUID'], addressee)
+            with session.lock:
+                if interpretation['type'] == 'AcceptOffer' or interpretation['type'] == 'RejectOffer':
+                    session.ledger.clear()
+                else:
+                    session.ledger.addInterpretation(interpretation)
+        elif addressee == agentName and role == 'buyer': # Message was addressed to me by a buyer; continue to process
+            # Whether the buyer has sent me a newer offer since, decided before taking the session lock, since it may
+            # classify the newer messages
+            superseded = (interpretation['type'] in ('BuyOffer', 'BuyRequest') and self.admission
+                          and self.admission.superseded((message['environmentUUID'], message['speaker']), message,
+                                                        lambda newer: self.isOfferTo(newer, agentName)))
+            session = self.negotiationStore.session(message['environmentUUID'], speaker)
+            with session.lock: # Decide on one message from this buyer at a time
+                if superseded: # Only the latest offer is priced
+                    session.ledger.addInterpretation(interpretation)
+                    self.admission.coalesced()
+                    return None
+                return self.respondToBuyer(interpretation, environment, session, prediction)
+        elif role == 'buyer' and addressee != agentName:  # Message was not addressed to me, but is a buyer.
+                                                          # Try to steal the deal, if the policy allows.
+            if self.stealPolicy.enabled:
+                return self.stealDeal(interpretation, environment)
+            return None
+        elif role == 'seller': # Message was from another seller. Learn from their offer, and undercut it if the policy allows.
+            if self.stealPolicy.enabled:
+                return self.stealDeal(interpretation, environment)
+            return None
+        return None
+
+
+    # *** isOfferTo()
+    # Whether a buyer's message is an offer or request addressed to the seller `agentName`. The message is classified
+    # ahead of its turn; the classification cache (if enabled) then answers for it when its turn comes.
+    # Do not call with the lock of a negotiation session held: classifying may wait for the classifier service.
+    def isOfferTo(self, message, agentName):
+        classification = self.conversation.classifyMessage(dict(message))
+        if not classification or not classification.get('intents'):
+            return False
+        classification['environmentUUID'] = message['environmentUUID']
+        interpretation = extract_bid.interpretMessage(classification)
+        metadata = interpretation['metadata']
+        return (interpretation['type'] in ('BuyOffer', 'BuyRequest') and metadata['addressee'] == agentName
+                and metadata['role'] == 'buyer')
+
+
+    # *** respondToBuyer()
+    # Decide how to respond to a message addressed to me by a buyer, given the state of our negotiation, using the
+    # bid precomputed for a speculated counter (prediction) when there is one.
+    # Call with the lock of the negotiation session held.
+    def respondToBuyer(self, interpretation, environment, session, prediction=None):
+        agentName = environment.agentName
+        speaker = session.buyer
         messageResponse = {
             'text': "",
             'speaker': agentName,
             'role': "seller",
             'addressee': speaker,
             'environmentUUID': interpretation['metadata']['environmentUUID'],
-            'timestamp': (time.time() * 1000)
+            'timestamp': (self.clock() * 1000)
         }
         if interpretation['type'] == 'AcceptOffer': # Buyer accepted my offer! Deal with it.
-            if bidHistory[speaker] and len(bidHistory[speaker]): # I actually did make an offer to this buyer;
-                                                                 # fetch details and confirm acceptance
-                bidHistoryIndividual = [bid for bid in bidHistory[speaker] if bid['metadata']['speaker'] == agentName and bid['type'] == "SellOffer"]
-                if len(bidHistoryIndividual):
-                    acceptedBid = bidHistoryIndividual[-1]
+            if len(session.ledger): # I actually did make an offer to this buyer;
+                                    # fetch details and confirm acceptance
+                acceptedBid = session.ledger.lastOwnOffer
+                if acceptedBid:
+                    if self.buyerHistory:
+                        self.learnDeal(environment, speaker, acceptedBid.quantityDict(), acceptedBid.price)
                     bid = {
-                        'price': acceptedBid['price'],
-                        'quantity': acceptedBid['quantity'],
+                        'price': acceptedBid.priceDict(),
+                        'quantity': acceptedBid.quantityDict(),
                         'type': "Accept"
                     }
-                    messageResponse['text'] = translateBid(bid, True)
+                    messageResponse['text'] = self.translateBid(bid, True, self.negotiationRandom(environment, session))
                     messageResponse['bid'] = bid
-                    bidHistory[speaker] = None
+                    session.ledger.clear()
                 else: # Didn't have any outstanding offers with this buyer
                     messageResponse['text'] = "I'm sorry, but I'm not aware of any outstanding offers."
             else: # Didn't have any outstanding offers with this buyer
@@ -429,11 +868,10 @@ def processMessage(message):
 
             return messageResponse
         elif interpretation['type'] == 'RejectOffer': # The buyer claims to be rejecting an offer I made; deal with it
-            if bidHistory[speaker] and len(bidHistory[speaker]): # Check whether I made an offer to this buyer
-                bidHistoryIndividual = [bid for bid in bidHistory[speaker] if bid['metadata']['speaker'] == agentName and bid['type'] == "SellOffer"]
-                if len(bidHistoryIndividual):
+            if len(session.ledger): # Check whether I made an offer to this buyer
+                if session.ledger.lastOwnOffer:
                     messageResponse['text'] = "I'm sorry you rejected my bid. I hope we can do business in the near future."
-                    bidHistory[speaker] = None
+                    session.ledger.clear()
                 else:
                     messageResponse['text'] = "There must be some confusion; I'm not aware of any outstanding offers."
             else:
@@ -446,7 +884,7 @@ def processMessage(message):
                 'role': "seller",
                 'addressee': speaker,
                 'evnironmentUUID': interpretation['metadata']['environmentUUID'],
-                'timestamp': (time.time() * 1000)
+                'timestamp': (self.clock() * 1000)
             }
             return messageResponse
         elif interpretation['type'] == 'NotUnderstood': # The buyer said something, but we can't figure out what
@@ -454,38 +892,493 @@ def processMessage(message):
             return None
         elif ((interpretation['type'] == 'BuyOffer'
                 or interpretation['type'] == 'BuyRequest')
-                and mayIRespond(interpretation)): #The buyer evidently is making an offer or request; if permitted, generate a bid response
-            if 'speaker' not in bidHistory:
-                bidHistory[speaker] = []
-            bidHistory[speaker].append(interpretation)
-
-            bid = generateBid(interpretation) # Generate bid based on message interpretation, utility,
-                                              # and the current state of negotiation with the buyer
+                and mayIRespond(interpretation, agentName)): #The buyer evidently is making an offer or request; if permitted, generate a bid response
+            bid = prediction and self.speculator.bid(prediction, session.ledger, self.negotiationRandom(environment, session))
+            if not bid:
+                bid = self.generateBid(interpretation, environment, session) # Generate bid based on message interpretation, utility,
+                                                                             # and the current state of negotiation with the buyer
+            if not bid: # No utility function to price it with
+                return None
+            self.recordEvent(environment, 'bid', {'buyer': speaker, 'bid': bid})
+            if self.buyerHistory:
+                self.learnOffer(interpretation, environment, session)
+                if bid['type'] == 'Accept':
+                    self.learnDeal(environment, speaker, bid['quantity'], bid['price']['value'])
+            session.ledger.addInterpretation(interpretation)
+            if bid['type'] == 'SellOffer': # Remember my offer, so that an acceptance can be confirmed
+                session.ledger.add(bid['type'], agentName, bid['quantity'], bid['price'], self.clock())
             bidResponse = {
-                'text': translateBid(bid, False), # Translate the bid into English
+                'text': self.translateBid(bid, False, self.negotiationRandom(environment, session)), # Translate the bid into English
                 'speaker': agentName,
                 'role': "seller",
                 'addressee': speaker,
                 'environmentUUID': interpretation['metadata']['environmentUUID'],
-                'timestamp': (time.time() * 1000),
+                'timestamp': (self.clock() * 1000),
                 'bid': bid
             }
 
             return bidResponse
         else:
             return None
-    elif role == 'buyer' and addressee != agentName:  # Message was not addressed to me, but is a buyer.
-                                                      # A more clever agent might try to steal the deal.
+
+
+    # *** learnOffer()
+    # Add a buyer's priced offer to their history, with the markup they conceded since their previous offer on the same
+    # bundle. Call before the offer is added to the bid ledger.
+    def learnOffer(self, interpretation, environment, session):
+        price = (interpretation.get('price') or {}).get('value')
+        cost = bundleCostSafe(environment.utilityEngine, interpretation.get('quantity'))
+        if price is None or not cost:
+            return
+        previous = session.ledger.lastBuyerOffer
+        previousMarkup = None
+        if previous and previous.price is not None and previous.quantityDict() == interpretation['quantity']:
+            previousMarkup = previous.price / cost - 1.0
+        self.buyerHistory.observeOffer(session.buyer, price / cost - 1.0, previousMarkup)
+
+
+    # *** learnDeal()
+    # Add a deal with a buyer for the given bundle and price to their history
+    def learnDeal(self, environment, buyer, quantity, price):
+        cost = bundleCostSafe(environment.utilityEngine, quantity)
+        if price is not None and cost:
+            self.buyerHistory.observeDeal(buyer, price / cost - 1.0)
+
+
+    # *** stealDeal()
+    # Fast path for overheard offers, since in a round with several sellers the first to respond wins. Learns from offers
+    # made by other sellers, and answers with an offer that undercuts them, with an offer to sell at the price that a
+    # buyer offered another seller, or (for a request without a price) with an offer below what that seller is expected
+    # to ask. Only the cost of the bundle is computed; there is no search and no history lookup.
+    @metrics.timed('stealDeal')
+    def stealDeal(self, interpretation, environment):
+        metadata = interpretation['metadata']
+        utilityEngine = environment.utilityEngine
+        stealPolicy = self.stealPolicy
+        price = (interpretation.get('price') or {}).get('value')
+        if not utilityEngine or not interpretation.get('quantity') or interpretation['type'] not in ('SellOffer', 'BuyOffer', 'BuyRequest'):
+            return None
+        try:
+            cost = utilityEngine.bundleCost(interpretation['quantity'])
+        except KeyError: # Goods that I don't sell
+            return None
+        now = self.clock()
+
+        if metadata['role'] == 'seller': # Another seller offered a buyer a bundle
+            buyer = metadata['addressee']
+            environment.competitors.observe(metadata['speaker'], cost, price, now)
+            if not stealPolicy.sellerOffers or not buyer or buyer == environment.agentName:
+                return None
+            stealPrice = stealPolicy.price(cost, price)
+        elif price: # A buyer offered another seller a price for a bundle
+            buyer = metadata['speaker']
+            if not stealPolicy.buyerOffers:
+                return None
+            stealPrice = price if price >= (1.0 + stealPolicy.minMarkupRatio) * cost else None
+        else: # A buyer asked another seller for a bundle
+            buyer = metadata['speaker']
+            markup = environment.competitors.expectedMarkup(metadata['addressee'])
+            if markup is None:
+                markup = environment.competitors.expectedMarkup()
+            if not stealPolicy.buyerOffers or markup is None:
+                return None
+            stealPrice = stealPolicy.price(cost, (1.0 + markup) * cost)
+
+        messageTime = metadata.get('timestamp')
+        if stealPrice is None or not stealPolicy.admit(environment.competitors, buyer, now,
+                                                       messageTime / 1000 if messageTime else None):
+            metrics.counter('agent_deal_steals_total', 'Attempts to steal deals from other sellers', outcome='declined').inc()
+            return None
+        metrics.counter('agent_deal_steals_total', 'Attempts to steal deals from other sellers', outcome='sent').inc()
+
+        bid = {
+            'type': 'SellOffer',
+            'quantity': interpretation['quantity'],
+            'price': {'unit': utilityEngine.currencyUnit, 'value': quantize(stealPrice, 2)}
+        }
+        self.recordEvent(environment, 'bid', {'buyer': buyer, 'replyTo': metadata['speaker'], 'bid': bid})
+        session = self.negotiationStore.session(metadata['environmentUUID'], buyer)
+        with session.lock: # Remember my offer, so that an acceptance can be confirmed
+            session.ledger.add(bid['type'], environment.agentName, bid['quantity'], bid['price'], now)
+            text = self.translateBid(bid, False, self.negotiationRandom(environment, session))
+        return {
+            'text': text,
+            'speaker': environment.agentName,
+            'role': "seller",
+            'addressee': buyer,
+            'environmentUUID': metadata['environmentUUID'],
+            'timestamp': (now * 1000),
+            'bid': bid
+        }
+
+
+    # *** handleMessage()
+    # Reply to a message taken on by /receiveMessage, and let admission control know when it is done
+    def handleMessage(self, message):
+        try:
+            with self.profiler.serving(self.negotiationStore.environment(message['environmentUUID'])):
+                self.replyToMessage(message)
+        finally:
+            if self.admission:
+                self.admission.finish((message['environmentUUID'], message['speaker']), message)
+
+
+    # *** replyToMessage()
+    # Process a received message and, if warranted, proactively send a new negotiation message to the environment orchestrator
+    def replyToMessage(self, message):
+        bidMessage = self.processMessage(message)
+        if bidMessage:
+            # Speculate on the buyer's answer to an offer on the speculator's thread, queued before the offer is sent
+            if self.speculator and (bidMessage.get('bid') or {}).get('type') == 'SellOffer':
+                self.speculator.submit((bidMessage['environmentUUID'], bidMessage['addressee']),
+                                       lambda: self.speculate(message, bidMessage))
+            self.sendMessage(bidMessage)
+            self.prefillRandom(bidMessage)
+
+
+    # *** prefillRandom()
+    # Once a reply is sent, draw the next random numbers of its negotiation ahead, so that the next bidding decision
+    # does not have to
+    def prefillRandom(self, reply):
+        session = self.negotiationStore.findSession(reply.get('environmentUUID'), reply.get('addressee'))
+        if session and session.rng:
+            with session.lock:
+                session.rng.prefill()
+
+
+    # *** speculate()
+    # After sending an offer to a buyer, precompute my bids for the counter-prices the buyer is likely to come back
+    # with, so that a matching reply can be answered without classification or a bidding decision. Runs on the
+    # speculator's worker thread, after the reply has been sent; nothing is speculated if the negotiation has moved on
+    # from the offer in the meantime.
+    @metrics.timed('speculate')
+    def speculate(self, message, offer):
+        environment = self.negotiationStore.environment(offer['environmentUUID'])
+        if not environment.utilityEngine:
+            return
+        session = self.negotiationStore.session(offer['environmentUUID'], offer['addressee'])
+        with session.lock:
+            lastOwnOffer = session.ledger.lastOwnOffer
+            if not lastOwnOffer or lastOwnOffer.price != offer['bid']['price']['value']:
+                return
+            lastBuyerOffer = session.ledger.lastBuyerOffer
+            if not lastBuyerOffer or lastBuyerOffer.price is None:
+                return
+            unit = offer['bid']['price']['unit']
+            rng = self.negotiationRandom(environment, session)
+            bids = {}
+            for price in self.speculator.counterPrices(lastBuyerOffer.price, offer['bid']['price']['value']):
+                counter = {'quantity': offer['bid']['quantity'], 'price': {'value': price, 'unit': unit}}
+                lookahead = rng.lookahead()
+                bids[price] = (self.speculativeBid(counter, environment, session, lookahead), lookahead.draws)
+            self.speculator.store(offer['environmentUUID'], message, offer, lastBuyerOffer, bids, rng.position,
+                                  self.clock())
+
+
+    # ******************************************************************************************************* #
+    #                                                    Messaging                                            #
+    # ******************************************************************************************************* #
+
+    # *** translateBid()
+    # Translate structured bid to text, with some randomization (a phrasing picked at random from the phrase set,
+    # with a draw from rng)
+    @metrics.timed('translateBid')
+    def translateBid(self, bid, confirm, rng):
+        return self.phraseSet.render(bid, confirm, rng)
+
+
+    # *** negotiationRandom()
+    # The random generator of a negotiation, created on first use from the seed and number of the round, the environment
+    # and the buyer; its seed is recorded in the transcript. Call with the lock of the negotiation session held.
+    def negotiationRandom(self, environment, session):
+        if session.rng is None:
+            negotiationState = environment.negotiationState
+            session.rng = self.randomSource.forNegotiation(negotiationState.get('seed'), negotiationState.get('roundNumber'),
+                                                           session.environmentUUID, session.buyer)
+            self.recordEvent(environment, 'rng', {'buyer': session.buyer, 'seed': session.rng.seed})
+        return session.rng
+
+
+    # *** sendMessage()
+    # Send specified message to the /receiveMessage route of the environment orchestrator
+    @metrics.timed('sendMessage')
+    def sendMessage(self, message):
+        self.recordEvent(self.negotiationStore.environment(message.get('environmentUUID')), 'outbound', message)
+        return self.postDataToServiceType(message, 'environment-orchestrator', '/relayMessage')
+
+
+    # *** postDataToServiceType()
+    # POST a given json to a service type; mappings to host:port are externalized in the appSettings.json file
+    # and resolved to base URLs once, when the outbound transport is created
+    def postDataToServiceType(self, json, serviceType, path):
+        return self.outboundTransport.post(serviceType, path, json)
+
+
+    # ******************************************************************************************************* #
+    #                                                 Round lifecycle                                         #
+    # ******************************************************************************************************* #
+
+    # *** scheduleRound()
+    # Set the timers of a round that /startRound has just set up: its start (if it starts later), its warnings and
+    # its end. Call with the environment lock held.
+    def scheduleRound(self, environment):
+        negotiationState = environment.negotiationState
+        environmentUUID = environment.environmentUUID
+        if not negotiationState['active']:
+            self.scheduler.schedule(environmentUUID, 'start', negotiationState['startTime'] / 1000,
+                                    self.roundStarted, environment, negotiationState['startTime'])
+        for secondsLeft in self.roundWarnings:
+            if secondsLeft < negotiationState['roundDuration']:
+                self.scheduler.schedule(environmentUUID, 'warning', negotiationState['stopTime'] / 1000 - secondsLeft,
+                                        self.roundWarning, environment, secondsLeft)
+        self.scheduler.schedule(environmentUUID, 'end', negotiationState['stopTime'] / 1000,
+                                self.roundExpired, environment, negotiationState['stopTime'])
+
+
+    # *** roundStarted()
+    # Timer: a round scheduled to start later has started
+    def roundStarted(self, environment, startTime):
+        with environment.lock:
+            if environment.negotiationState['startTime'] == startTime:
+                environment.negotiationState['active'] = True
+
+
+    # *** roundWarning()
+    # Timer: the round ends in secondsLeft seconds
+    def roundWarning(self, environment, secondsLeft):
+        logger.info("Round %s of %s ends in %s seconds", environment.negotiationState.get('roundNumber'),
+                    environment.environmentUUID, secondsLeft)
+        self.recordEvent(environment, 'roundWarning', {'secondsLeft': secondsLeft})
+        metrics.counter('agent_round_warnings_total', 'Warnings that a round is about to end').inc()
+
+
+    # *** roundExpired()
+    # Timer: the round's time is up. Stop taking messages, and drop the replies still queued for it, which would come
+    # too late; /endRound, when it comes, closes the round.
+    def roundExpired(self, environment, stopTime):
+        with environment.lock:
+            negotiationState = environment.negotiationState
+            if negotiationState['stopTime'] != stopTime or not negotiationState['active']:
+                return
+            negotiationState['active'] = False
+            negotiationState['endTime'] = stopTime
+        self.recordEvent(environment, 'roundExpired', {'stopTime': stopTime})
+        self.cancelPendingWork(environment)
+
+
+    # *** cancelPendingWork()
+    # Drop the queued replies and the speculations of an environment whose round has ended
+    def cancelPendingWork(self, environment):
+        if self.replyPipeline:
+            cancelled = self.replyPipeline.cancel(lambda key: self.negotiationStore.environment(key[0]) is environment)
+            for message in cancelled:
+                if self.admission:
+                    self.admission.finish((message['environmentUUID'], message['speaker']), message)
+            if cancelled:
+                logger.info("Cancelled %d queued replies in %s at the end of the round", len(cancelled),
+                            environment.environmentUUID)
+        if self.speculator:
+            self.speculator.forget(environment.environmentUUID)
+
+
+    # *** replyPriority()
+    # Seconds by which a queued message may go ahead of earlier ones (see reply-pipeline.py). Until the last
+    # priorityWindow seconds of the round, none, so replies go out in order. After that, a buyer whose last offer is
+    # close to mine (a near-deal, which latency can lose) gets up to maxPriorityBoost seconds, the more the closer the
+    # offers and the closer the deadline. Computed when the message becomes the buyer's oldest queued message, from the
+    # round's clock and the buyer's offers at that time.
+    def replyPriority(self, message):
+        negotiationState = self.negotiationStore.environment(message['environmentUUID']).negotiationState
+        if not negotiationState.get('stopTime'):
+            return 0.0
+        timeRemaining = negotiationState['stopTime'] / 1000 - self.clock()
+        if timeRemaining >= self.priorityWindow:
+            return 0.0
+        session = self.negotiationStore.findSession(message['environmentUUID'], message['speaker'])
+        own = session and session.ledger.lastOwnOffer
+        buyer = session and session.ledger.lastBuyerOffer
+        if not own or not buyer or not own.price or buyer.price is None:
+            return 0.0
+        closeness = max(0.0, 1.0 - (own.price - buyer.price) / own.price)
+        return closeness * self.maxPriorityBoost * (1.0 - max(0.0, timeRemaining) / self.priorityWindow)
+
+
+    # *** startProfile()
+    # Profile the current round of an environment, naming the profile like its transcript
+    def startProfile(self, environment):
+        negotiationState = environment.negotiationState
+        self.profiler.start(environment, transcript_log.roundLogPath(
+            '', environment.environmentUUID, negotiationState.get('roundNumber'), negotiationState['startTime']))
+
+
+    # *** stopProfile()
+    # Write the profile of an environment's round, if it was profiled; returns the paths written
+    def stopProfile(self, environment):
+        written = self.profiler.stop(environment)
+        if written:
+            logger.info("Profile of round %s of %s written to %s", environment.negotiationState.get('roundNumber'),
+                        environment.environmentUUID, written['summary'])
+        return written
+
+
+    # ******************************************************************************************************* #
+    #                                                   Transcripts                                           #
+    # ******************************************************************************************************* #
+
+    # *** openTranscript()
+    # Start the transcript log of a round, beginning with everything needed to replay it.
+    # Call with the environment lock held.
+    def openTranscript(self, environment, seed):
+        if environment.transcript:
+            environment.transcript.close()
+        negotiationState = environment.negotiationState
+        transcriptSettings = self.transcriptSettings
+        directory = transcriptSettings.get('directory', 'transcripts')
+        os.makedirs(directory, exist_ok=True)
+        path = transcript_log.roundLogPath(directory, environment.environmentUUID, negotiationState.get('roundNumber'),
+                                           negotiationState['startTime'])
+        environment.transcript = transcript_log.TranscriptLog(
+            path, transcriptSettings.get('bufferSize', transcript_log.defaultBufferSize),
+            transcriptSettings.get('flushInterval', transcript_log.defaultFlushInterval), lambda: self.clock())
+        environment.transcript.record('round', {
+            'environmentUUID': environment.environmentUUID,
+            'agentName': environment.agentName,
+            'seed': seed,
+            'negotiationState': negotiationState,
+            'utilityInfo': environment.utilityInfo,
+            'utilityEngineSettings': dict(self.engineSettings, counterOfferMode=self.counterOfferMode),
+            'dealStealing': self.appSettings.get('dealStealing', {}),
+            'strategy': self.strategySettings,
+            'messages': self.appSettings.get('messages', {})
+        })
+
+
+    # *** closeTranscripts()
+    # Write out and close the transcripts of rounds that have not ended, when the agent exits
+    def closeTranscripts(self):
+        for environment in list(self.negotiationStore.environments.values()) + [self.negotiationStore.defaultEnvironment]:
+            if environment.ownTranscript:
+                environment.ownTranscript.close()
+
+
+    # *** recordEvent()
+    # Record an event in the transcript of the environment's current round, if one is being kept
+    def recordEvent(self, environment, kind, data):
+        transcript = environment.transcript
+        if transcript:
+            transcript.record(kind, data)
+
+
+    # ******************************************************************************************************* #
+    #                                                   Lifecycle                                             #
+    # ******************************************************************************************************* #
+
+    # *** drainReplies()
+    # Wait (up to timeout seconds) for queued messages to be answered, then send any batched replies. With an
+    # environmentUUID (at the end of its round), only the messages of that environment are waited for; at shutdown, all.
+    # Returns False if messages were still queued when the timeout expired.
+    def drainReplies(self, timeout, environmentUUID=None):
+        drained = self.replyPipeline.drain(timeout, environmentUUID) if self.replyPipeline else True
+        if not drained:
+            logger.warning("Replies still queued for %s after %s seconds", environmentUUID or self.name, timeout)
+        self.outboundTransport.flush()
+        return drained
+
+
+    # *** shutdown()
+    # Stop reporting ready, send the replies still in flight, close the outbound connections and write out the
+    # transcripts of unfinished rounds. Runs at exit.
+    def shutdown(self):
+        self.ready = False
+        self.drainReplies(self.drainTimeout)
+        self.scheduler.close()
+        self.outboundTransport.close()
+        self.closeTranscripts()
+        for environment in list(self.negotiationStore.environments.values()) + [self.negotiationStore.defaultEnvironment]:
+            self.stopProfile(environment)
+        if self.buyerHistory:
+            self.buyerHistory.close()
+
+
+    # *** agentMetrics()
+    # Counters of the reply pipeline and negotiation store, labelled with the agent's name, reported by /metrics
+    def agentMetrics(self):
+        labels = {'agent': self.name}
+        samples = []
+        sessions = self.negotiationStore.report()
+        samples.append(('agent_negotiation_sessions', 'gauge', 'Negotiation sessions held', labels, sessions['sessions']))
+        if self.admission:
+            samples.append(('agent_messages_in_flight', 'gauge', 'Messages admitted and not yet answered', labels,
+                            self.admission.report()['inFlight']))
+        if self.replyPipeline:
+            pipeline = self.replyPipeline.report()
+            samples.append(('agent_reply_queue_depth', 'gauge', 'Messages waiting for a reply worker', labels, pipeline['queueDepth']))
+            samples.append(('agent_replies_processed_total', 'counter', 'Messages processed by reply workers', labels, pipeline['processed']))
+        return samples
+
+
+# ******************************************************************************************************* #
+#                                         Bidding Algorithm Functions                                     #
+# ******************************************************************************************************* #
+
+# *** mayIRespond()
+# Choose not to respond to certain messages, either because the received offer has the wrong role
+# or because a different agent is being addressed. Note that this self-censoring is stricter than that required
+# by competition rules; messages addressed to other agents are left to stealDeal(), which has its own policy.
+def mayIRespond(interpretation, agentName):
+    return (interpretation and
+            interpretation['metadata']['role'] and
+            (interpretation['metadata']['addressee'] == agentName or
+            not interpretation['metadata']['addressee']))
+
+
+# *** calculateUtilitySeller()
+# Calculate utility for a given bundle of goods and price, given the compiled utility function.
+# (The currency unit is normalized once, when the utility function is compiled; there is no currency conversion.)
+def calculateUtilityAgent(utilityEngine, bundle):
+    util = 0
+    price = bundle.get('price')
+
+    if bundle['quantity'] and price:
+        util = price['value'] or 0
+
+    util -= utilityEngine.bundleCost(bundle['quantity'])
+
+    return util
+
+
+# *** bundleCostSafe()
+# My cost of a bundle, or None if there is no utility function yet, no bundle, or the bundle has goods that I don't sell
+def bundleCostSafe(utilityEngine, quantity):
+    if not utilityEngine or not quantity:
         return None
-    elif role == 'seller': # Message was from another seller. A more clever agent might be able to exploit this info somehow!
+    try:
+        return utilityEngine.bundleCost(quantity)
+    except KeyError:
         return None
-    return None
 
 
 # ******************************************************************************************************* #
 #                                                     Simple Utilities                                    #
 # ******************************************************************************************************* #
 
+# *** optionalNumber()
+# The number under `key` in a request body, or None if it is missing or null. A numeric string is converted; anything
+# else raises ValueError.
+def optionalNumber(body, key):
+    value = body.get(key)
+    if value is None:
+        return None
+    if not isinstance(value, bool):
+        try:
+            number = float(value)
+            if math.isfinite(number):
+                return value if isinstance(value, (int, float)) else number
+        except (TypeError, ValueError):
+            pass
+    raise ValueError(key + " must be a number, not " + json.dumps(value))
+
+
 # *** quantize()
 # Quantize numeric quantity to desired number of decimal digits
 # Useful for making sure that bid prices don't get more fine-grained than cents
@@ -495,7 +1388,7 @@ def quantize(quantity, decimals):
     return round(q) / multiplicator
 
 
-# *** getSafe() 
+# *** getSafe()
 # Utility that retrieves a specified piece of a JSON structure safely.
 # o: the JSON structure from which a piece needs to be extracted, e.g. bundle
 # p: list specifying the desired part of the JSON structure, e.g.['price', 'value'] to retrieve bundle.price.value
@@ -503,72 +1396,118 @@ def quantize(quantity, decimals):
 def getSafe(p, o, d):
     return reduce((lambda xs, x: xs[x] if (xs and xs[x] != None) else d), p)
 
-# ******************************************************************************************************* #
-#                                                    Messaging                                            #
-# ******************************************************************************************************* #
-
-# *** translateBid()
-# Translate structured bid to text, with some randomization
-def translateBid(bid, confirm):
-    text = ""
-    if bid['type'] == 'SellOffer':
-        text = "How about if I sell you"
-        for good in bid['quantity'].keys():
-            text += " " + str(bid['quantity'][good]) + " " + good
-        text += " for " + str(bid['price']['value']) + " " + str(bid['price']['unit']) + "."
-    elif bid['type'] == 'Reject':
-        text = selectMessage(rejectionMessages)
-    elif bid['type'] == 'Accept':
-        if confirm:
-            text = selectMessage(confirmAcceptanceMessages)
-        else:
-            text = selectMessage(acceptanceMessages)
-        for good in bid['quantity'].keys():
-            text += " " + str(bid['quantity'][good]) + " " + good
-        text += " for " + str(bid['price']['value']) + " " + str(bid['price']['unit']) + "."
-    
-    return text
-
-
-# *** selectMessage()
-# Randomly select a message or phrase from a specified set
-def selectMessage(messageSet):
-    msgSetSize = len(messageSet)
-    indx = int(random.random() * msgSetSize)
-    return messageSet[indx]
-
-
-# *** sendMessage()
-# Send specified message to the /receiveMessage route of the environment orchestrator
-def sendMessage(message):
-    return postDataToServiceType(message, 'environment-orchestrator', '/relayMessage')
-
-
-# *** postDataToServiceType()
-# POST a given json to a service type; mappings to host:port are externalized in the appSettings.json file
-def postDataToServiceType(json, serviceType, path):
-    serviceMap = appSettings['serviceMap']
-    if serviceMap[serviceType]:
-        options = serviceMap[serviceType]
-        options['path'] = path
-        url = options2URL(options)
-        
-        response = requests.post(url, json=json)
-        return response
 
-
-# *** options2URL() 
+# *** options2URL()
 # Convert host, port, path to URL
 def options2URL(options):
-    protocol = options['protocol'] or 'http'
+    protocol = options.get('protocol') or 'http'
     url = protocol + '://' + options['host']
-    if options['port']:
+    if options.get('port'):
         url += ':' + str(options['port'])
-    if options['path']:
+    if options.get('path'):
         url += options['path']
     return url
 
 
+# ******************************************************************************************************* #
+#                                                 App factory                                             #
+# ******************************************************************************************************* #
+
+# *** loadSettings()
+# Read appSettings.json and assistantParams.json from the working directory
+def loadSettings():
+    with open('./appSettings.json') as f:
+        appSettings = json.load(f)
+    return appSettings, conversation.loadAssistantParams('./assistantParams.json')
+
+
+# *** configureProcess()
+# Process-wide settings: logging and metrics. Logging replaces the print statements on the hot path; at the
+# default level, debug messages cost next to nothing.
+def configureProcess(appSettings):
+    logging.basicConfig(level=appSettings.get('logLevel', 'WARNING'), format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    metrics.enabled = appSettings.get('metrics', {}).get('enabled', True)
+
+
+# *** agentSettings()
+# The settings of each agent to host. An `agents` list in appSettings hosts several agents in one process; each
+# entry overrides the top-level settings for one agent, and needs at least its own `name`.
+def agentSettings(appSettings):
+    base = {key: value for key, value in appSettings.items() if key != 'agents'}
+    return [dict(base, **overrides) for overrides in appSettings.get('agents') or [{}]]
+
+
+# *** createAgents()
+# Build the agents described by appSettings, sharing one Conversation built from assistantParams (or the one given)
+def createAgents(appSettings, assistantParams=None, sharedConversation=None):
+    settings = agentSettings(appSettings)
+    names = [agent.get('name') or "Agent007" for agent in settings]
+    if len(set(names)) < len(names):
+        raise ValueError("agents hosted in one process need distinct names: " + ', '.join(names))
+    if sharedConversation is None:
+        sharedConversation = conversation.Conversation(assistantParams, names)
+    return [NegotiationAgent(agent, sharedConversation) for agent in settings]
+
+
+# *** createApp()
+# WSGI app of the agents that listen on one port: the agent's own app if there is one, and otherwise the apps of all of
+# them, each under the path prefix /<name> (e.g. /Agent007/receiveMessage)
+def createApp(agents):
+    if len(agents) == 1:
+        return agents[0].app
+    from werkzeug.exceptions import NotFound
+    from werkzeug.middleware.dispatcher import DispatcherMiddleware
+    return DispatcherMiddleware(NotFound(), {'/' + agent.name: agent.app for agent in agents})
+
+
+# *** serve()
+# Serve the agents, grouped by port, with the server named in the `serving` settings: the production WSGI server
+# waitress (the default, with `threads` worker threads), or Flask's development server. Each port gets its own server;
+# all but the last run on background threads. SIGTERM shuts the agents down gracefully. The agents listen on the loopback
+# interface unless the `host` setting names another address (such as 0.0.0.0 for every interface).
+# To serve with gunicorn instead, use gunicorn.conf.py and wsgi.py.
+def serve(agents, servingSettings):
+    serverName = servingSettings.get('server', 'waitress')
+    host = servingSettings.get('host', '127.0.0.1')
+    if host not in ('127.0.0.1', 'localhost', '::1'):
+        logger.info("Serving on %s, reachable from other hosts", host)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0)) # Exit through atexit, so that replies are drained
+    if serverName == 'waitress':
+        try:
+            import waitress
+        except ImportError:
+            logger.warning("waitress is not installed (pip install waitress); using the development server")
+            serverName = 'flask'
+    ports = {}
+    for agent in agents:
+        ports.setdefault(int(agent.port), []).append(agent)
+    servers = []
+    for port, hosted in ports.items():
+        app = createApp(hosted)
+        if serverName == 'waitress':
+            server = waitress.create_server(app, host=host, port=port, threads=servingSettings.get('threads', 8),
+                                            connection_limit=servingSettings.get('connectionLimit', 100), ident='agent-py')
+            servers.append(server.run)
+        else:
+            from werkzeug.serving import make_server
+            servers.append(make_server(host, port, app, threaded=True).serve_forever)
+    for run in servers[:-1]:
+        threading.Thread(target=run, daemon=True).start()
+    servers[-1]()
+
+
+# *** main()
+# Host the agents described by appSettings.json in the working directory. `--port` overrides the port of a single agent.
+def main(argv):
+    appSettings, assistantParams = loadSettings()
+    for i in range(len(argv)):
+        if argv[i] == "--port":
+            appSettings['defaultPort'] = argv[i + 1]
+    configureProcess(appSettings)
+    agents = createAgents(appSettings, assistantParams)
+    serve(agents, appSettings.get('serving', {}))
+
+
 # Start the API
 if __name__ == "__main__":
-    app.run(host='http://localhost', port=myPort)
+    main(sys.argv)
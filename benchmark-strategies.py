@@ -0,0 +1,117 @@
+# Benchmark of the concession strategies.
+#
+# Plays the same simulated buyers (see simulate.py) against the agent once per strategy, calling processMessage()
+# directly on a virtual clock that spreads the negotiations over the round, and reports, per strategy, the latency of
+# the bidding decision (generateBid) and the agent's utility: deals made, total and mean profit over cost.
+#
+#   python benchmark-strategies.py
+#   python benchmark-strategies.py --negotiations 500 --strategies linear boulware --json
+
+# Imports
+import argparse
+import importlib
+import json
+import random
+import time
+
+simulate = importlib.import_module('simulate')
+concession_strategy = importlib.import_module('concession-strategy')
+
+# Global variables / settings
+roundDuration = 600
+secondsPerMessage = 5 # virtual time between the messages of a negotiation
+
+
+# *** benchmarkStrategy()
+# Play `negotiations` negotiations against the agent with the given strategy
+def benchmarkStrategy(agent, stub, utility, name, args):
+    rng = random.Random(args.seed)
+    environment = agent.negotiationStore.defaultEnvironment
+    agent.negotiationStore.clearSessions(environment)
+    with environment.lock:
+        environment.negotiationState.update({'active': True, 'startTime': 0, 'stopTime': 1000 * roundDuration,
+                                             'roundDuration': roundDuration, 'seed': args.seed})
+        environment.strategy = concession_strategy.createStrategy({'name': name}, roundDuration)
+
+    now = [0.0]
+    agent.clock = lambda: now[0]
+    decisions = []
+    generateBid = agent.generateBid
+    def timedGenerateBid(*args):
+        startedAt = time.perf_counter()
+        try:
+            return generateBid(*args)
+        finally:
+            decisions.append(1000 * (time.perf_counter() - startedAt))
+    agent.generateBid = timedGenerateBid
+
+    deals = 0
+    profit = 0.0
+    try:
+        for i in range(args.negotiations):
+            now[0] = roundDuration * i / args.negotiations
+            buyer = simulate.Buyer('Buyer' + str(i), random.Random(rng.random()), utility, False)
+            script = buyer.negotiate(stub)
+            message = next(script)
+            while message is not None:
+                reply = agent.processMessage(message)
+                now[0] = min(now[0] + secondsPerMessage, roundDuration)
+                bid = (reply or {}).get('bid') or {}
+                if bid.get('type') == 'Accept':
+                    deals += 1
+                    profit += bid['price']['value'] - environment.utilityEngine.bundleCost(bid['quantity'])
+                try:
+                    message = script.send(reply)
+                except StopIteration:
+                    message = None
+    finally:
+        agent.generateBid = generateBid
+        agent.clock = time.time
+
+    decisions.sort()
+    return {
+        'strategy': name,
+        'negotiations': args.negotiations,
+        'deals': deals,
+        'profit': round(profit, 2),
+        'profitPerDeal': round(profit / deals, 4) if deals else None,
+        'decisions': len(decisions),
+        'decisionLatencyUs': {'p50': 1000 * simulate.percentile(decisions, 0.50),
+                              'p99': 1000 * simulate.percentile(decisions, 0.99)} if decisions else None
+    }
+
+
+# *** benchmark()
+def benchmark(args):
+    agent = simulate.loadAgent(9, 'stub', False)
+    stub = simulate.StubClassifier()
+    agent.conversation.classifyMessage = stub.classifyMessage
+    utility = simulate.randomUtility(random.Random(args.seed))
+    client = agent.app.test_client()
+    client.post('/setUtility', json={'currencyUnit': 'USD', 'utility': utility, 'name': simulate.agentName})
+    return [benchmarkStrategy(agent, stub, utility, name, args) for name in args.strategies]
+
+
+# *** printReport()
+def printReport(results):
+    print("%-14s %6s %10s %10s %14s %14s" % ('strategy', 'deals', 'profit', 'per deal', 'p50 decision', 'p99 decision'))
+    for result in results:
+        latency = result['decisionLatencyUs'] or {'p50': 0, 'p99': 0}
+        print("%-14s %6d %10.2f %10.4f %11.1f us %11.1f us" % (
+            result['strategy'], result['deals'], result['profit'], result['profitPerDeal'] or 0,
+            latency['p50'], latency['p99']))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare decision latency and simulated utility across concession strategies.')
+    parser.add_argument('--negotiations', type=int, default=200, help='negotiations per strategy')
+    parser.add_argument('--strategies', nargs='+', default=list(concession_strategy.strategies),
+                        choices=list(concession_strategy.strategies), help='strategies to compare')
+    parser.add_argument('--seed', type=int, default=1, help='random seed')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+    results = benchmark(args)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        printReport(results)
@@ -0,0 +1,86 @@
+# Imports
+from collections import deque
+
+# Global variables / settings
+maxLedgerRecords = 32 # Older records are dropped; decisions only ever look at the latest offers
+
+
+# *** BidRecord
+# One negotiation act, stripped down to what bidding decisions need. The interpretation it was made from
+# (with its Watson classification and message metadata) is not kept.
+class BidRecord:
+    __slots__ = ('type', 'speaker', 'quantity', 'price', 'unit', 'timestamp')
+
+    def __init__(self, type_, speaker, quantity, price, unit, timestamp):
+        self.type = type_
+        self.speaker = speaker
+        self.quantity = quantity   # tuple of (good, amount) pairs
+        self.price = price         # None if no price was named
+        self.unit = unit
+        self.timestamp = timestamp
+
+
+    # *** quantityDict()
+    # The bundle in the {good: amount} form used by bids
+    def quantityDict(self):
+        return dict(self.quantity)
+
+
+    # *** priceDict()
+    # The price in the {'value', 'unit'} form used by bids
+    def priceDict(self):
+        if self.price is None:
+            return None
+        return {'value': self.price, 'unit': self.unit}
+
+
+# *** BidLedger
+# The recent bids exchanged with one buyer, with the latest offer of each side indexed for O(1) lookup
+class BidLedger:
+    __slots__ = ('records', 'lastOwnOffer', 'lastBuyerOffer')
+
+    def __init__(self):
+        self.records = deque(maxlen=maxLedgerRecords)
+        self.lastOwnOffer = None    # my latest SellOffer
+        self.lastBuyerOffer = None  # the buyer's latest BuyOffer or BuyRequest
+
+
+    def __len__(self):
+        return len(self.records)
+
+
+    # *** add()
+    # Record a negotiation act given its type, speaker, bundle ({good: amount}) and price ({'value', 'unit'} or None)
+    def add(self, type_, speaker, quantity, price, timestamp):
+        record = BidRecord(
+            type_,
+            speaker,
+            tuple((quantity or {}).items()),
+            price['value'] if price else None,
+            price['unit'] if price else None,
+            timestamp)
+        self.records.append(record)
+        if type_ == 'SellOffer':
+            self.lastOwnOffer = record
+        elif type_ == 'BuyOffer' or type_ == 'BuyRequest':
+            self.lastBuyerOffer = record
+        return record
+
+
+    # *** addInterpretation()
+    # Record an interpreted message (as produced by extract-bid.interpretMessage)
+    def addInterpretation(self, interpretation):
+        return self.add(
+            interpretation['type'],
+            interpretation['metadata']['speaker'],
+            interpretation.get('quantity'),
+            interpretation.get('price'),
+            interpretation['metadata'].get('timeStamp'))
+
+
+    # *** clear()
+    # Forget the negotiation, e.g. after an offer has been accepted or rejected
+    def clear(self):
+        self.records.clear()
+        self.lastOwnOffer = None
+        self.lastBuyerOffer = None
@@ -0,0 +1,261 @@
+# Imports
+from array import array
+import sqlite3
+import threading
+
+# Global variables / settings
+defaultHistoryFile = 'buyer-history.sqlite3'
+defaultMinDeals = 3          # deals (or concessions) a buyer must have made before their history moves my prices
+defaultFloorQuantile = 0.1   # counter with at least the markup below which only this fraction of a buyer's deals were made
+markupBinWidth = 0.05        # accepted markups are counted in bins of this width,
+minBinnedMarkup = -0.5       # from this markup (lower markups fall in the first bin)
+markupBins = 70              # up to 3.0 (higher markups fall in the last bin)
+
+schema = '''
+CREATE TABLE IF NOT EXISTS buyers (
+    buyer TEXT PRIMARY KEY,
+    offers INTEGER NOT NULL,           -- priced offers seen
+    concessions INTEGER NOT NULL,      -- offers that followed an earlier offer on the same bundle
+    concessionSum REAL NOT NULL,       -- total markup conceded in those offers
+    deals INTEGER NOT NULL,
+    acceptedMarkups BLOB NOT NULL,     -- markupBins counts of the markups at which deals were made
+    version INTEGER NOT NULL           -- bumped on every write, so that other processes can load what changed
+);
+CREATE INDEX IF NOT EXISTS buyersByVersion ON buyers (version);
+'''
+
+
+# *** BuyerStats
+# What the agent has learned about one buyer across rounds: how much markup they concede from one offer to the next,
+# and the markups (over the agent's cost of the bundle) at which they made deals, as a histogram
+class BuyerStats:
+    __slots__ = ('offers', 'concessions', 'concessionSum', 'deals', 'acceptedMarkups', 'quantiles')
+
+    def __init__(self, offers=0, concessions=0, concessionSum=0.0, deals=0, acceptedMarkups=None):
+        self.offers = offers
+        self.concessions = concessions
+        self.concessionSum = concessionSum
+        self.deals = deals
+        self.acceptedMarkups = acceptedMarkups or array('I', [0]) * markupBins
+        self.quantiles = {} # quantile -> markup, until the next deal
+
+
+    # *** observeOffer()
+    def observeOffer(self, concession):
+        self.offers += 1
+        if concession is not None:
+            self.concessions += 1
+            self.concessionSum += concession
+
+
+    # *** observeDeal()
+    def observeDeal(self, markup):
+        self.deals += 1
+        self.acceptedMarkups[markupBin(markup)] += 1
+        self.quantiles = {}
+
+
+    # *** add()
+    # Add the counts of another BuyerStats
+    def add(self, other):
+        self.offers += other.offers
+        self.concessions += other.concessions
+        self.concessionSum += other.concessionSum
+        self.deals += other.deals
+        for i, count in enumerate(other.acceptedMarkups):
+            self.acceptedMarkups[i] += count
+        self.quantiles = {}
+
+
+    # *** meanConcession()
+    # Average markup conceded from one offer to the next, or None before any concession
+    def meanConcession(self):
+        return self.concessionSum / self.concessions if self.concessions else None
+
+
+    # *** acceptedMarkup()
+    # The markup below which the given fraction of this buyer's deals were made (the upper edge of its bin), or None
+    # before any deal
+    def acceptedMarkup(self, quantile):
+        markup = self.quantiles.get(quantile)
+        if markup is None and self.deals:
+            needed = quantile * self.deals
+            cumulative = 0
+            for i, count in enumerate(self.acceptedMarkups):
+                cumulative += count
+                if cumulative >= needed and cumulative:
+                    break
+            markup = self.quantiles[quantile] = minBinnedMarkup + (i + 1) * markupBinWidth
+        return markup
+
+
+    # *** describe()
+    def describe(self):
+        return {'offers': self.offers, 'deals': self.deals, 'meanConcession': self.meanConcession(),
+                'medianAcceptedMarkup': self.acceptedMarkup(0.5)}
+
+
+# *** BuyerHistory
+# Per-buyer statistics that survive rounds and restarts, in a SQLite file that several agents (and processes) may
+# share. The rows are loaded into memory when the agent starts, so that pricing an offer never waits for the file:
+# lookups are O(1) dictionary reads, and a buyer who is not in the file starts with no history. What the agent learns
+# is counted in memory and added to the file (as increments, so that concurrent writers do not overwrite each other)
+# by flush(), at /startRound, /endRound and shutdown; /startRound then loads the rows written since the last load (by
+# their version), e.g. by other agents.
+class BuyerHistory:
+
+    def __init__(self, settings):
+        self.path = settings.get('file', defaultHistoryFile)
+        self.minDeals = settings.get('minDeals', defaultMinDeals)
+        self.floorQuantile = settings.get('floorQuantile', defaultFloorQuantile)
+        self.lock = threading.Lock()
+        self.connection = None  # opened on first use
+        self.buyers = {}        # buyer -> BuyerStats, the stored counts plus what was learned since
+        self.pending = {}       # buyer -> BuyerStats learned since the last flush
+        self.version = 0        # highest version loaded
+        self.stats = {'loads': 0, 'reloads': 0, 'flushes': 0}
+        self.load()
+
+
+    # *** connect()
+    # Call with the lock held
+    def connect(self):
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self.connection.executescript(schema)
+        return self.connection
+
+
+    # *** load()
+    # Load the rows written since the last load (all of them the first time), keeping what was learned since the last
+    # flush on top of them
+    def load(self):
+        with self.lock:
+            rows = self.connect().execute(
+                'SELECT buyer, offers, concessions, concessionSum, deals, acceptedMarkups, version FROM buyers '
+                'WHERE version > ?', (self.version,)).fetchall()
+            for row in rows:
+                self.version = max(self.version, row[6])
+                stats = fromRow(row[1:6])
+                if row[0] in self.pending:
+                    stats.add(self.pending[row[0]])
+                self.stats['reloads' if row[0] in self.buyers else 'loads'] += 1
+                self.buyers[row[0]] = stats
+
+
+    # *** lookup()
+    # What is known about a buyer; a buyer who was not in the file when it was last loaded starts with no history
+    def lookup(self, buyer):
+        stats = self.buyers.get(buyer)
+        if stats is not None:
+            return stats
+        with self.lock:
+            return self.buyers.setdefault(buyer, BuyerStats())
+
+
+    # *** observeOffer()
+    # Learn from a priced offer by a buyer, at the given markup over my cost of the bundle, and their previous markup for
+    # the same bundle (or None)
+    def observeOffer(self, buyer, markup, previousMarkup):
+        concession = markup - previousMarkup if previousMarkup is not None else None
+        stats = self.lookup(buyer)
+        with self.lock:
+            stats.observeOffer(concession)
+            self.pendingStats(buyer).observeOffer(concession)
+
+
+    # *** observeDeal()
+    # Learn from a deal made with a buyer at the given markup over my cost of the bundle
+    def observeDeal(self, buyer, markup):
+        stats = self.lookup(buyer)
+        with self.lock:
+            stats.observeDeal(markup)
+            self.pendingStats(buyer).observeDeal(markup)
+
+
+    # *** pendingStats()
+    # Call with the lock held
+    def pendingStats(self, buyer):
+        stats = self.pending.get(buyer)
+        if stats is None:
+            stats = self.pending[buyer] = BuyerStats()
+        return stats
+
+
+    # *** floorMarkup()
+    # The least markup worth asking of a buyer whose offer is at offerMarkup, from their history: the markup of their
+    # cheapest deals (at floorQuantile), and their offer plus the markup that they usually concede next.
+    # None when there is not enough history.
+    def floorMarkup(self, stats, offerMarkup):
+        floor = None
+        if stats.deals >= self.minDeals:
+            floor = stats.acceptedMarkup(self.floorQuantile)
+        if stats.concessions >= self.minDeals and stats.meanConcession() > 0:
+            floor = max(floor if floor is not None else offerMarkup, offerMarkup + stats.meanConcession())
+        return floor
+
+
+    # *** flush()
+    # Add what was learned since the last flush to the file, in one transaction
+    def flush(self):
+        with self.lock:
+            if not self.pending:
+                return
+            connection = self.connect()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                version = connection.execute('SELECT COALESCE(MAX(version), 0) FROM buyers').fetchone()[0] + 1
+                for buyer, stats in self.pending.items():
+                    row = connection.execute('SELECT acceptedMarkups FROM buyers WHERE buyer = ?', (buyer,)).fetchone()
+                    acceptedMarkups = array('I', stats.acceptedMarkups)
+                    if row:
+                        for i, count in enumerate(array('I', row[0])):
+                            acceptedMarkups[i] += count
+                    connection.execute(
+                        'INSERT INTO buyers VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (buyer) DO UPDATE SET '
+                        'offers = offers + excluded.offers, concessions = concessions + excluded.concessions, '
+                        'concessionSum = concessionSum + excluded.concessionSum, deals = deals + excluded.deals, '
+                        'acceptedMarkups = excluded.acceptedMarkups, version = excluded.version',
+                        (buyer, stats.offers, stats.concessions, stats.concessionSum, stats.deals,
+                         acceptedMarkups.tobytes(), version))
+                connection.execute('COMMIT')
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+            self.pending = {}
+            self.stats['flushes'] += 1
+
+
+    # *** startRound()
+    # Write out what was learned, then load the rows that changed since the last load (e.g. written by other agents)
+    def startRound(self):
+        self.flush()
+        self.load()
+
+
+    # *** close()
+    def close(self):
+        self.flush()
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+
+    # *** report()
+    # Counters, and what is known about the given buyers, for the /buyerStats API
+    def report(self, buyers=()):
+        described = {buyer: self.lookup(buyer).describe() for buyer in buyers}
+        with self.lock:
+            return dict(self.stats, buyersLoaded=len(self.buyers), buyersPending=len(self.pending), buyers=described)
+
+
+# *** fromRow()
+# BuyerStats from (offers, concessions, concessionSum, deals, acceptedMarkups)
+def fromRow(row):
+    return BuyerStats(row[0], row[1], row[2], row[3], array('I', row[4]))
+
+
+# *** markupBin()
+def markupBin(markup):
+    return min(markupBins - 1, max(0, int((markup - minBinnedMarkup) / markupBinWidth)))
@@ -0,0 +1,207 @@
+# Imports
+from bisect import bisect_left
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+# Global variables / settings
+wordPattern = re.compile(r'\S+')
+namePlaceholder = '@name'
+
+
+# *** ClassificationCache
+# Bounded LRU cache of classification results with a time-to-live, keyed on normalized message text.
+# Entries hold the translated Watson output without the per-message fields (input, speaker, addressee)
+# and without avatarName entities, since names are normalized out of the key; both are re-attached on a hit.
+# Entity locations are stored as offsets into the key ('keyLocation'), and turned back into offsets into the text
+# of the message at hand on a hit, since names of different lengths move the entities that follow them.
+class ClassificationCache:
+
+    def __init__(self, maxSize=1000, ttl=3600, persistFile=None, names=None):
+        self.maxSize = maxSize
+        self.ttl = ttl
+        self.persistFile = persistFile
+        self.entries = OrderedDict() # key -> (storedAt, output)
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0}
+        self.names = {n.lower(): n for n in names or []}
+        self.nameMatcher = None
+        if names:
+            self.nameMatcher = re.compile(
+                r'\b(?:' + '|'.join(sorted((re.escape(n) for n in names), key=len, reverse=True)) + r')\b',
+                re.IGNORECASE)
+        if persistFile:
+            self.load()
+
+
+    # *** normalize()
+    # Build the cache key for a message: collapse whitespace, lowercase, and replace the names of the
+    # known avatars and of this message's speaker and addressee with a placeholder.
+    # Returns the key, the offset in the message text of each character of the key, and the (name, location)
+    # pairs that were replaced.
+    def normalize(self, input_):
+        text = input_['text'] or ""
+        key, origins = collapseWhitespace(text)
+        found = []
+        if self.nameMatcher:
+            found = [(self.names[m.group(0).lower()], [origins[m.start()], origins[m.end() - 1] + 1])
+                     for m in self.nameMatcher.finditer(key)]
+        key, origins = lowercase(key, origins)
+        for name in (input_.get('speaker'), input_.get('addressee')):
+            if name:
+                key, origins = substitute(re.compile(r'\b' + re.escape(name.lower()) + r'\b'), key, origins)
+        if self.nameMatcher:
+            key, origins = substitute(self.nameMatcher, key, origins)
+        return key, origins, found
+
+
+    # *** get()
+    # Return a fresh copy of the cached output for this message, with avatarName entities for the
+    # names found in this particular text and entity locations in this text, or None on a miss.
+    def get(self, input_):
+        key, origins, found = self.normalize(input_)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and time.time() - entry[0] > self.ttl:
+                del self.entries[key]
+                self.stats['expirations'] += 1
+                entry = None
+            if not entry:
+                self.stats['misses'] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats['hits'] += 1
+            output = entry[1]
+
+        textLength = len(input_['text'] or "")
+        entities = [{
+            'entity': 'avatarName',
+            'location': location,
+            'value': name,
+            'confidence': 1
+        } for name, location in found]
+        for stored in output['entities']:
+            entity = {k: v for k, v in stored.items() if k != 'keyLocation'}
+            if 'keyLocation' in stored: # Entries persisted before locations were rebased have none
+                start, end = stored['keyLocation']
+                entity['location'] = [origins[start] if start < len(origins) else textLength,
+                                      origins[end - 1] + 1 if end > 0 else 0]
+            entities.append(entity)
+        entities.sort(key=lambda e: e['location'][0] if 'location' in e else textLength)
+        result = dict(output)
+        result['intents'] = list(output['intents'])
+        result['entities'] = entities
+        return result
+
+
+    # *** put()
+    # Store the output of a classification (as returned by translateWatsonResponse)
+    def put(self, input_, output):
+        key, origins, _ = self.normalize(input_)
+        stored = {k: v for k, v in output.items() if k not in ('input', 'speaker', 'addressee', 'environmentUUID')}
+        stored['intents'] = output.get('intents') or []
+        stored['entities'] = []
+        for entity in output.get('entities') or []:
+            if entity['entity'] == 'avatarName':
+                continue
+            location = entity.get('location')
+            entity = {k: v for k, v in entity.items() if k != 'location'}
+            if location:
+                entity['keyLocation'] = [bisect_left(origins, location[0]), bisect_left(origins, location[1])]
+            stored['entities'].append(entity)
+        with self.lock:
+            self.entries[key] = (time.time(), stored)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxSize:
+                self.entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+
+    # *** report()
+    # Counters and current size, for the /classificationCacheStats API
+    def report(self):
+        with self.lock:
+            report = dict(self.stats)
+            report['size'] = len(self.entries)
+        report['maxSize'] = self.maxSize
+        report['ttl'] = self.ttl
+        lookups = report['hits'] + report['misses']
+        report['hitRate'] = report['hits'] / lookups if lookups else 0.0
+        return report
+
+
+    # *** save()
+    # Write the unexpired entries to the persist file, so that a restarted agent starts warm
+    def save(self):
+        if not self.persistFile:
+            return
+        with self.lock:
+            entries = [[key, storedAt, output] for key, (storedAt, output) in self.entries.items()]
+        tmpFile = self.persistFile + '.tmp'
+        with open(tmpFile, 'w') as f:
+            json.dump(entries, f)
+        os.replace(tmpFile, self.persistFile)
+
+
+    # *** load()
+    # Read entries written by save(), skipping those that have expired in the meantime
+    def load(self):
+        try:
+            with open(self.persistFile) as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        with self.lock:
+            for key, storedAt, output in entries[-self.maxSize:]:
+                if now - storedAt <= self.ttl:
+                    self.entries[key] = (storedAt, output)
+
+
+
+# *** collapseWhitespace()
+# The text with runs of whitespace collapsed to one space and stripped, and the offset in the text of each character
+def collapseWhitespace(text):
+    chars = []
+    origins = []
+    for word in wordPattern.finditer(text):
+        if chars:
+            chars.append(' ')
+            origins.append(word.start() - 1)
+        chars.append(word.group(0))
+        origins.extend(range(word.start(), word.end()))
+    return ''.join(chars), origins
+
+
+# *** lowercase()
+# The text in lower case, and the offsets of its characters (a few characters have a longer lower case)
+def lowercase(text, origins):
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        return lowered, origins
+    loweredOrigins = []
+    for char, origin in zip(text, origins):
+        loweredOrigins.extend([origin] * len(char.lower()))
+    return lowered, loweredOrigins
+
+
+# *** substitute()
+# The text with the matches of pattern replaced with the name placeholder, and the offsets of its characters
+def substitute(pattern, text, origins):
+    chars = []
+    substitutedOrigins = []
+    start = 0
+    for m in pattern.finditer(text):
+        chars.append(text[start:m.start()])
+        substitutedOrigins.extend(origins[start:m.start()])
+        chars.append(namePlaceholder)
+        substitutedOrigins.extend([origins[m.start()]] * len(namePlaceholder))
+        start = m.end()
+    if not chars:
+        return text, origins
+    chars.append(text[start:])
+    substitutedOrigins.extend(origins[start:])
+    return ''.join(chars), substitutedOrigins
@@ -0,0 +1,195 @@
+# Imports
+import math
+
+# Global variables / settings
+curveSteps = 1001 # points at which a concession curve is precomputed, evenly spread over the round
+
+
+# *** ConcessionStrategy
+# How the agent prices its counteroffers over the course of a round. Each strategy has a concession curve: the most
+# markup (over the cost of the bundle) that it asks at each point of the round. The curve is computed once per round,
+# by prepare() at /startRound, so that pricing a counteroffer only looks up (and interpolates) a precomputed value.
+# Subclasses define markupAt() and may override openingMarkup() and sellPrice().
+# Random draws come from the rng passed in (anything with a random() method, such as the random module).
+# Parameters are checked when the strategy is created: each must be a finite number within the range given in `limits`.
+class ConcessionStrategy:
+    name = None
+    defaults = {
+        'startMarkup': 2.0,     # markup asked at the start of the round
+        'endMarkup': 0.5,       # markup asked at the end of the round
+        'minMarkup': 0.2,       # never counter with less markup than this
+        'jitter': 0.1,          # fraction of the room above the floor that is randomly given up
+        'openingSpread': 0.25   # random extra markup on offers to requests without a price
+    }
+    limits = { # parameter -> (test of a value, description of the allowed values)
+        'startMarkup': (lambda value: value >= 0, "at least 0"),
+        'endMarkup': (lambda value: value >= 0, "at least 0"),
+        'minMarkup': (lambda value: value >= 0, "at least 0"),
+        'jitter': (lambda value: 0 <= value <= 1, "between 0 and 1"),
+        'openingSpread': (lambda value: value >= 0, "at least 0")
+    }
+
+    def __init__(self, params=None):
+        self.params = dict(self.defaults)
+        for key, value in (params or {}).items():
+            if key not in self.defaults:
+                raise ValueError("unknown parameter " + key + " for strategy " + self.name)
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                raise ValueError("parameter " + key + " of strategy " + self.name + " must be a number, not " + repr(value))
+            allowed, description = self.limits[key]
+            if not math.isfinite(value) or not allowed(value):
+                raise ValueError("parameter " + key + " of strategy " + self.name + " must be " + description + ", not " +
+                                 repr(value))
+            self.params[key] = value
+        self.roundDuration = None
+        self.curve = None
+
+
+    # *** prepare()
+    # Precompute the concession curve for a round of the given duration (in seconds)
+    def prepare(self, roundDuration):
+        self.roundDuration = roundDuration
+        self.curve = [self.markupAt(i / (curveSteps - 1)) for i in range(curveSteps)]
+        return self
+
+
+    # *** markupAt()
+    # Markup asked when the given fraction (0 to 1) of the round has elapsed
+    def markupAt(self, elapsed):
+        raise NotImplementedError
+
+
+    # *** ceiling()
+    # Markup asked with timeRemaining seconds left in the round, interpolated from the precomputed curve
+    def ceiling(self, timeRemaining):
+        position = (1.0 - timeRemaining / self.roundDuration) * (curveSteps - 1)
+        if position <= 0:
+            return self.curve[0]
+        if position >= curveSteps - 1:
+            return self.curve[-1]
+        i = int(position)
+        return self.curve[i] + (position - i) * (self.curve[i + 1] - self.curve[i])
+
+
+    # *** openingMarkup()
+    # Markup for a request that names no price
+    def openingMarkup(self, timeRemaining, rng):
+        return self.ceiling(timeRemaining) + rng.random() * self.params['openingSpread']
+
+
+    # *** sellPrice()
+    # Price of a counteroffer to an offer of offerPrice for a bundle costing bundleCost, given my last price to this
+    # buyer (or None) and the buyer's previous offer (a bid-ledger BidRecord, or None)
+    def sellPrice(self, bundleCost, offerPrice, myLastPrice, lastBuyerOffer, timeRemaining, rng):
+        floor = max(offerPrice / bundleCost - 1.0, self.params['minMarkup'])
+        target = self.ceiling(timeRemaining)
+        if myLastPrice is not None: # Never ask more than last time
+            target = min(target, myLastPrice / bundleCost - 1.0)
+        target = max(target, floor)
+        target -= rng.random() * self.params['jitter'] * (target - floor)
+        return (1.0 + target) * bundleCost
+
+
+    # *** describe()
+    def describe(self):
+        return {'name': self.name, 'params': self.params, 'roundDuration': self.roundDuration}
+
+
+# *** TimeDependentStrategy
+# The classic family of time-dependent tactics: the markup falls from startMarkup to endMarkup as
+# 1 - elapsed^(1/beta). With beta < 1 (Boulware) the agent holds out until late in the round; with
+# beta > 1 (conceder) it concedes early; beta = 1 concedes linearly.
+class TimeDependentStrategy(ConcessionStrategy):
+    defaults = dict(ConcessionStrategy.defaults, beta=1.0)
+    limits = dict(ConcessionStrategy.limits, beta=(lambda value: value > 0, "greater than 0"))
+
+    def markupAt(self, elapsed):
+        start, end = self.params['startMarkup'], self.params['endMarkup']
+        return end + (start - end) * (1.0 - math.pow(elapsed, 1.0 / self.params['beta']))
+
+
+# *** LinearStrategy
+# The agent's original pricing: the most markup falls linearly from 2.0 to 0.5 over the round, an opening offer
+# asks a random markup between 2 and 3, and a counteroffer asks a random markup between the buyer's (at least
+# minMarkup) and either the ceiling or, after my first offer, the markup of my last offer.
+class LinearStrategy(TimeDependentStrategy):
+    name = 'linear'
+    defaults = dict(TimeDependentStrategy.defaults, jitter=1.0, openingSpread=1.0)
+
+    def openingMarkup(self, timeRemaining, rng):
+        return self.params['startMarkup'] + rng.random() * self.params['openingSpread']
+
+
+    def sellPrice(self, bundleCost, offerPrice, myLastPrice, lastBuyerOffer, timeRemaining, rng):
+        markupRatio = offerPrice / bundleCost - 1.0
+        if myLastPrice is not None:
+            maxMarkupRatio = myLastPrice / bundleCost - 1.0
+        else:
+            maxMarkupRatio = self.ceiling(timeRemaining)
+        minProposedMarkup = max(markupRatio, self.params['minMarkup'])
+        newMarkupRatio = minProposedMarkup + rng.random() * self.params['jitter'] * (maxMarkupRatio - minProposedMarkup)
+        return (1.0 + newMarkupRatio) * bundleCost
+
+
+# *** BoulwareStrategy
+class BoulwareStrategy(TimeDependentStrategy):
+    name = 'boulware'
+    defaults = dict(TimeDependentStrategy.defaults, beta=0.2)
+
+
+# *** ConcederStrategy
+class ConcederStrategy(TimeDependentStrategy):
+    name = 'conceder'
+    defaults = dict(TimeDependentStrategy.defaults, beta=5.0)
+
+
+# *** TitForTatStrategy
+# Mirrors the buyer: each counteroffer comes down by `reciprocity` times what the buyer went up since their previous
+# offer (and not at all if they did not move). The first counteroffer follows the linear curve.
+class TitForTatStrategy(TimeDependentStrategy):
+    name = 'titForTat'
+    defaults = dict(TimeDependentStrategy.defaults, reciprocity=1.0, jitter=0.0)
+    limits = dict(TimeDependentStrategy.limits, reciprocity=(lambda value: value >= 0, "at least 0"))
+
+    def sellPrice(self, bundleCost, offerPrice, myLastPrice, lastBuyerOffer, timeRemaining, rng):
+        if myLastPrice is None or lastBuyerOffer is None or lastBuyerOffer.price is None:
+            return super().sellPrice(bundleCost, offerPrice, myLastPrice, lastBuyerOffer, timeRemaining, rng)
+        concession = max(0.0, offerPrice - lastBuyerOffer.price)
+        price = myLastPrice - self.params['reciprocity'] * concession
+        return max(price, offerPrice, (1.0 + self.params['minMarkup']) * bundleCost)
+
+
+# *** OpponentModelStrategy
+# Follows a Boulware curve, but predicts how far the buyer will still go: their latest concession, repeated
+# expectedOffers more times. When the curve asks for more than that prediction, the agent asks for the prediction
+# instead, as a buyer is unlikely to go beyond it; a buyer who stops conceding is met at their price.
+class OpponentModelStrategy(TimeDependentStrategy):
+    name = 'opponentModel'
+    defaults = dict(TimeDependentStrategy.defaults, beta=0.5, expectedOffers=2.0)
+    limits = dict(TimeDependentStrategy.limits, expectedOffers=(lambda value: value >= 0, "at least 0"))
+
+    def sellPrice(self, bundleCost, offerPrice, myLastPrice, lastBuyerOffer, timeRemaining, rng):
+        price = super().sellPrice(bundleCost, offerPrice, myLastPrice, lastBuyerOffer, timeRemaining, rng)
+        if lastBuyerOffer is None or lastBuyerOffer.price is None:
+            return price
+        predicted = offerPrice + self.params['expectedOffers'] * max(0.0, offerPrice - lastBuyerOffer.price)
+        return max(min(price, predicted), offerPrice, (1.0 + self.params['minMarkup']) * bundleCost)
+
+
+strategies = {strategy.name: strategy for strategy in
+              (LinearStrategy, BoulwareStrategy, ConcederStrategy, TitForTatStrategy, OpponentModelStrategy)}
+
+
+# *** createStrategy()
+# Build and prepare the strategy described by settings ({'name': ..., 'params': {...}}) for a round of the given
+# duration. Raises ValueError for an unknown strategy, an unknown parameter or a parameter value out of range.
+def createStrategy(settings, roundDuration):
+    name = (settings or {}).get('name') or 'linear'
+    if name not in strategies:
+        raise ValueError("unknown strategy " + str(name) + "; choose one of " + ', '.join(strategies))
+    params = (settings or {}).get('params')
+    if params is not None and not isinstance(params, dict):
+        raise ValueError("params of strategy " + name + " must be an object")
+    return strategies[name](params).prepare(roundDuration)
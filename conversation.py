@@ -1,86 +1,204 @@
 # Imports
+import atexit
 import importlib
 import json
-import ibm_watson
-from ibm_cloud_sdk_core.authenticators import IAMAuthenticator
-
-# Global Variables & settings
-AssistantV2 = ibm_watson.AssistantV2
-
-assistantParams = None
-with open('./assistantParams.json') as f:
-    assistantParams = json.load(f)
-
-authenticator = IAMAuthenticator(assistantParams['apikey'])
-assistant = AssistantV2(
-    version=assistantParams['version'],
-    authenticator=authenticator
-)
-assistant.set_service_url(assistantParams['url'])
-assistant.set_default_headers({'x-watson-learning-opt-out': "true"})
-
-GLOBAL_sessionID = None
-
-# Methods
-# create a new session ID for watson assistant
-def createSessionID(assistantID):
-    sessionData = assistant.create_session(assistant_id=assistantID).get_result()
-    return sessionData['session_id']
-
-
-# Send a user message to ibm assistant to be processed and classified
-def classifyMessage(input_):
-    assistantId = assistantParams['assistantId']
-    text = None
-    if input_['text']:
-        text = input_['text'].replace('/[\t\r\n]+/g', " ").strip()
-    
-    assistantMessageParams = {'assistantId': assistantId, 'input': {}}
-
-    if text:
-        assistantMessageParams['input'] = {
+import logging
+import re
+import threading
+local_classifier = importlib.import_module('local-classifier')
+offer_parser = importlib.import_module('offer-parser')
+classification_cache = importlib.import_module('classification-cache')
+metrics = importlib.import_module('metrics')
+watson_sessions = importlib.import_module('watson-sessions')
+
+logger = logging.getLogger('agent-py.conversation')
+
+
+# *** loadAssistantParams()
+# Read the Watson Assistant settings (see assistantParams.json.template)
+def loadAssistantParams(path='./assistantParams.json'):
+    with open(path) as f:
+        return json.load(f)
+
+
+# *** Conversation
+# Classifies messages into intents and entities, with the engine chosen in assistantParams: 'watson' (default) or
+# 'local'. In 'local' mode, Watson is only consulted when the local classifier's top intent confidence falls below
+# localConfidenceThreshold. Well-formed offers are parsed by a fast path ahead of either engine (see offer-parser.py),
+# unless fastPath.enabled is false. The Watson SDK is imported, and the Watson client built, on the first message that needs
+# Watson, so that an agent that classifies locally (or is only being tested) never pays for it.
+# One Conversation can serve several agents; avatarNames lists the names of all of them.
+class Conversation:
+
+    def __init__(self, assistantParams, avatarNames=None):
+        self.assistantParams = assistantParams
+        self.assistant = None # Watson Assistant client, built on first use
+        self.assistantLock = threading.Lock()
+        skillFile = assistantParams.get('skillFile', local_classifier.defaultSkillFile)
+        self.skillFile = skillFile
+        avatarNames = assistantParams.get('avatarNames', []) + [name for name in avatarNames or []
+                                                                if name not in assistantParams.get('avatarNames', [])]
+
+        self.classifierMode = assistantParams.get('classifier', 'watson')
+        self.localConfidenceThreshold = assistantParams.get('localConfidenceThreshold', 0.5)
+        self.localClassifier = None
+        if self.classifierMode == 'local':
+            self.localClassifier = local_classifier.LocalClassifier.fromSkillFile(skillFile, avatarNames)
+        self.offerParser = None
+        if assistantParams.get('fastPath', {}).get('enabled', True):
+            self.offerParser = offer_parser.OfferParser.fromSkillFile(skillFile, avatarNames)
+
+        # Cache of classification results, keyed on the normalized message text. Optionally persisted across restarts.
+        cacheParams = assistantParams.get('cache', {})
+        self.classificationCache = None
+        if cacheParams.get('enabled', True):
+            self.classificationCache = classification_cache.ClassificationCache(
+                cacheParams.get('maxSize', 1000),
+                cacheParams.get('ttl', 3600),
+                cacheParams.get('persistFile'),
+                local_classifier.readAvatarNames(skillFile) + avatarNames)
+            atexit.register(self.classificationCache.save)
+            metrics.addCollector(self.report)
+
+        # Pool of live sessions, created on first use and renewed in the background before Watson expires them
+        poolParams = assistantParams.get('sessionPool', {})
+        self.sessionPool = watson_sessions.WatsonSessionPool(
+            lambda: self.createSessionID(assistantParams['assistantId']),
+            lambda sessionID: self.deleteSessionID(assistantParams['assistantId'], sessionID),
+            poolParams.get('size', 4),
+            poolParams.get('sessionTimeout', 300),
+            poolParams.get('renewMargin', 30))
+
+
+    # *** watsonAssistant()
+    # The Watson Assistant client, importing the SDK and authenticating the first time it is needed
+    def watsonAssistant(self):
+        with self.assistantLock:
+            if self.assistant is None:
+                import ibm_watson
+                from ibm_cloud_sdk_core.authenticators import IAMAuthenticator
+                assistant = ibm_watson.AssistantV2(
+                    version=self.assistantParams['version'],
+                    authenticator=IAMAuthenticator(self.assistantParams['apikey'])
+                )
+                assistant.set_service_url(self.assistantParams['url'])
+                assistant.set_default_headers({'x-watson-learning-opt-out': "true"})
+                self.assistant = assistant
+            return self.assistant
+
+
+    # create a new session ID for watson assistant
+    def createSessionID(self, assistantID):
+        sessionData = self.watsonAssistant().create_session(assistant_id=assistantID).get_result()
+        return sessionData['session_id']
+
+
+    # delete a session ID that will no longer be used
+    def deleteSessionID(self, assistantID, sessionID):
+        self.watsonAssistant().delete_session(assistant_id=assistantID, session_id=sessionID)
+
+
+    # Classify a user message, parsing well-formed offers directly and answering repeated phrases from the
+    # classification cache
+    @metrics.timed('classifyMessage')
+    def classifyMessage(self, input_):
+        if self.offerParser:
+            output = self.offerParser.parse(input_['text'])
+            if output:
+                return translateWatsonResponse({'output': output}, input_)
+
+        if not self.classificationCache:
+            return self.classifyMessageUncached(input_)
+
+        output = self.classificationCache.get(input_)
+        if output:
+            return translateWatsonResponse({'output': output}, input_)
+
+        response = self.classifyMessageUncached(input_)
+        if response:
+            self.classificationCache.put(input_, response)
+        return response
+
+
+    # Classify a user message with the configured engine, falling back to Watson Assistant when the local
+    # classifier is not confident enough
+    def classifyMessageUncached(self, input_):
+        if not self.localClassifier:
+            return self.classifyMessageWatson(input_)
+
+        output = self.localClassifier.classify(input_['text'])
+        if output['intents'] and output['intents'][0]['confidence'] >= self.localConfidenceThreshold:
+            return translateWatsonResponse({'output': output}, input_)
+
+        response = self.classifyMessageWatson(input_)
+        if response:
+            return response
+        return translateWatsonResponse({'output': output}, input_) # Watson unavailable; the low-confidence answer will have to do
+
+
+    # Send a user message to ibm assistant to be processed and classified, using a session from the pool.
+    # Only an expired session is worth a retry (with a fresh session); any other error gives up, and gives the session back.
+    def classifyMessageWatson(self, input_):
+        assistantId = self.assistantParams['assistantId']
+        text = None
+        if input_['text']:
+            text = re.sub(r'[\t\r\n]+', " ", input_['text']).strip()
+
+        messageInput = {
             'message_type': "text",
             'text': text,
             'options': {
-                'alternate_intents': True,
-                "return_context": True
+                'alternate_intents': True
             }
         }
-        assistantMessageParams['sessionId'] = GLOBAL_sessionID
-    
-    response = None
-
-    # try to get a response with the current session ID
-    try:
-        response = assistant.message(
-            assistant_id=assistantId,
-            session_id=GLOBAL_sessionID,
-            input={
-                'message_type': 'text',
-                'text': text
-            }
-        )
-        translateWatsonResponse(response, input_)
-    except:
 
-        # create a new session ID and try again
         try:
-
-            sessionId = createSessionID(assistantId)
-            response = response = assistant.message(
-                assistant_id=assistantId,
-                session_id=sessionId,
-                input={
-                    'message_type': 'text',
-                    'text': text
-                }
-            ).get_result()
-
+            assistant = self.watsonAssistant()
+            from ibm_cloud_sdk_core import ApiException # Already loaded with the client
+        except Exception as e: # e.g. ibm-watson not installed
+            logger.error("Error creating Watson Assistant client: %s", e)
+            return None
+        for attempt in range(2):
+            try:
+                session = self.sessionPool.acquire()
+            except Exception as e:
+                logger.error("Error creating sessionId for assistantId %s: %s", assistantId, e)
+                return None
+            try:
+                response = assistant.message(
+                    assistant_id=assistantId,
+                    session_id=session.sessionId,
+                    input=messageInput
+                ).get_result()
+            except ApiException as e:
+                if watson_sessions.isSessionExpired(e):
+                    self.sessionPool.discard(session)
+                    continue
+                self.sessionPool.release(session)
+                logger.error("Error classifying message with assistantId %s: %s", assistantId, e)
+                return None
+            except Exception: # Not an API error (e.g. a dropped connection); the session itself is still good
+                self.sessionPool.release(session)
+                logger.exception("Error classifying message with assistantId %s", assistantId)
+                return None
+            self.sessionPool.release(session)
             return translateWatsonResponse(response, input_)
-        except:
-            print("Error creating sessionId for assistantId", assistantId)
-    
-    return None
+
+        logger.error("Watson sessions keep expiring for assistantId %s", assistantId)
+        return None
+
+
+    # *** report()
+    # Counters of the classification cache, as (name, type, help, labels, value) samples for /metrics
+    def report(self):
+        samples = []
+        if self.classificationCache:
+            cache = self.classificationCache.report()
+            for counter in ('hits', 'misses', 'evictions', 'expirations'):
+                samples.append(('agent_classification_cache_' + counter + '_total', 'counter',
+                                'Classification cache ' + counter, {}, cache[counter]))
+            samples.append(('agent_classification_cache_size', 'gauge', 'Classification cache entries', {}, cache['size']))
+        return samples
 
 
 # convert watsons response to a usable JSON object
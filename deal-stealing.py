@@ -0,0 +1,127 @@
+# Imports
+import threading
+
+# Global variables / settings
+defaultSmoothing = 0.3 # weight of the newest quote in a competitor's moving average markup
+
+
+# *** CompetitorStats
+# What the agent has learned about the prices quoted by one competing seller, as markups over the agent's own cost of
+# the quoted bundles (so that quotes for different bundles can be compared)
+class CompetitorStats:
+    __slots__ = ('quotes', 'meanMarkup', 'minMarkup', 'lastMarkup', 'lastSeen')
+
+    def __init__(self):
+        self.quotes = 0
+        self.meanMarkup = None # exponentially weighted moving average
+        self.minMarkup = None
+        self.lastMarkup = None
+        self.lastSeen = None
+
+
+    # *** observe()
+    def observe(self, markup, timestamp, smoothing):
+        self.quotes += 1
+        self.meanMarkup = markup if self.meanMarkup is None else smoothing * markup + (1.0 - smoothing) * self.meanMarkup
+        self.minMarkup = markup if self.minMarkup is None else min(self.minMarkup, markup)
+        self.lastMarkup = markup
+        self.lastSeen = timestamp
+
+
+# *** CompetitorModel
+# Incremental model of the other sellers in one environment, built from the offers they are overheard making, and the
+# bookkeeping of the agent's own attempts to steal deals, which the StealPolicy limits. Every update is O(1).
+class CompetitorModel:
+
+    def __init__(self, smoothing=defaultSmoothing):
+        self.smoothing = smoothing
+        self.lock = threading.Lock()
+        self.competitors = {} # seller -> CompetitorStats
+        self.attempts = {}    # buyer -> (number of attempts this round, time of the latest attempt)
+
+
+    # *** observe()
+    # Learn from an offer of the given price, by a competing seller, for a bundle that costs the agent `cost`
+    def observe(self, seller, cost, price, timestamp):
+        if cost <= 0:
+            return
+        with self.lock:
+            stats = self.competitors.get(seller)
+            if stats is None:
+                stats = self.competitors[seller] = CompetitorStats()
+            stats.observe(price / cost - 1.0, timestamp, self.smoothing)
+
+
+    # *** expectedMarkup()
+    # The markup that a seller (or, without a seller, the cheapest competitor) can be expected to ask;
+    # None when no quotes have been overheard
+    def expectedMarkup(self, seller=None):
+        with self.lock:
+            if seller is not None:
+                stats = self.competitors.get(seller)
+                return stats.meanMarkup if stats else None
+            markups = [stats.meanMarkup for stats in self.competitors.values()]
+        return min(markups) if markups else None
+
+
+    # *** newRound()
+    # Forget the steal attempts of the previous round; what was learned about competitors is kept
+    def newRound(self):
+        with self.lock:
+            self.attempts = {}
+
+
+    # *** report()
+    def report(self):
+        with self.lock:
+            return {
+                'competitors': {seller: {'quotes': stats.quotes, 'meanMarkup': stats.meanMarkup,
+                                         'minMarkup': stats.minMarkup, 'lastMarkup': stats.lastMarkup,
+                                         'lastSeen': stats.lastSeen}
+                                for seller, stats in self.competitors.items()},
+                'stealAttempts': {buyer: count for buyer, (count, _) in self.attempts.items()}
+            }
+
+
+# *** StealPolicy
+# The rules within which the agent may answer messages that were not addressed to it, from appSettings `dealStealing`.
+# The agent only ever addresses buyers, never sells below minMarkupRatio over cost, gives up on messages older than
+# latencyBudgetMs (another seller will have answered by then), and makes at most maxAttemptsPerBuyer attempts per
+# buyer per round, at least cooldownSeconds apart.
+class StealPolicy:
+
+    def __init__(self, settings):
+        self.enabled = settings.get('enabled', False)
+        self.buyerOffers = settings.get('buyerOffers', True)   # offer to sell at the price a buyer offered another seller
+        self.sellerOffers = settings.get('sellerOffers', True) # undercut the offers of other sellers
+        self.undercutRatio = settings.get('undercutRatio', 0.05)
+        self.minMarkupRatio = settings.get('minMarkupRatio', 0.2)
+        self.latencyBudgetMs = settings.get('latencyBudgetMs', 500)
+        self.cooldownSeconds = settings.get('cooldownSeconds', 10)
+        self.maxAttemptsPerBuyer = settings.get('maxAttemptsPerBuyer', 3)
+
+
+    # *** price()
+    # The price at which to undercut a competing price for a bundle that costs `cost`, or None if that would
+    # take the markup below minMarkupRatio
+    def price(self, cost, competingPrice):
+        price = competingPrice * (1.0 - self.undercutRatio)
+        if price < (1.0 + self.minMarkupRatio) * cost:
+            return None
+        return price
+
+
+    # *** admit()
+    # Whether the agent may make a steal attempt with this buyer now, for a message sent at messageTime
+    # (both in seconds); if so, the attempt is counted
+    def admit(self, competitors, buyer, now, messageTime):
+        if messageTime is not None and 1000 * (now - messageTime) > self.latencyBudgetMs:
+            return False
+        with competitors.lock:
+            count, lastAttempt = competitors.attempts.get(buyer, (0, None))
+            if count >= self.maxAttemptsPerBuyer:
+                return False
+            if lastAttempt is not None and now - lastAttempt < self.cooldownSeconds:
+                return False
+            competitors.attempts[buyer] = (count + 1, now)
+        return True
@@ -1,14 +1,25 @@
 # imports
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import argparse
 import time
 import json
 import importlib
+import logging
+import re
+import sys
 conversation = importlib.import_module('conversation')
+metrics = importlib.import_module('metrics')
+
+logger = logging.getLogger('agent-py.extract-bid')
+whitespacePattern = re.compile(r'\s+')
 
 # Methods
 # From the intents and entities obtained from Watson Assistant, extract a structured representation
 # of the message
+@metrics.timed('interpretMessage')
 def interpretMessage(watsonResponse):
-    print("entered interpretMessage")
+    logger.debug("entered interpretMessage")
 
     intents = watsonResponse['intents']
     entities = watsonResponse['entities']
@@ -31,7 +42,7 @@ def interpretMessage(watsonResponse):
             elif watsonResponse['input']['role'] == 'seller':
                 cmd['type'] = "SellRequest"
     elif intents[0]['intent'] == "AcceptOffer" and intents[0]['confidence'] > 0.2:
-        cmd = {'type': "AcceptedOffer"}
+        cmd = {'type': "AcceptOffer"}
     elif intents[0]['intent'] == "RejectOffer" and intents[0]['confidence'] > 0.2:
         cmd = {'type': "RejectOffer"}
     elif intents[0]['intent'] == 'Information' and intents[0]['confidence'] > 0.2:
@@ -48,80 +59,185 @@ def interpretMessage(watsonResponse):
 
 # Extract the addressee from entities (in case addressee is not already supplied with the input message)
 def extractAddressee(entities):
-    print("entered extractAddressee")
+    logger.debug("entered extractAddressee")
     addressees = []
     addressee = None
     for eBlock in entities:
         if eBlock['entity'] == "avatarName":
             addressees.append(eBlock['value'])
     
-    if 'agentName' in addressees.keys():
-        addressee = addressees['agentName']
-    else:
+    if addressees:
         addressee = addressees[0]
     return addressee
 
 
-# Extract goods and their amounts from the entities extracted by Watson Assistant
+# Extract goods and their amounts, and the price, from the entities extracted by Watson Assistant, in one pass
+# and without copying them. A good takes its amount from the last number before it, and it and the entity just before
+# it are not considered for the price; every other entity is passed on to addPrice() as soon as that is known.
 def extractOfferFromEntities(entityList):
-    print("entered extractOfferFromEntities")
-    entities = json.loads(json.dumps(entityList))
-    removedIndices = []
+    logger.debug("entered extractOfferFromEntities")
     quantity = {}
-    state = None
+    price = None
     amount = None
+    previous = None # the last entity, until it is known whether the next one is a good that consumes it
 
-    for i, eBlock in enumerate(entities):
-        entities[i]['index'] = i
+    for eBlock in entityList:
         if eBlock['entity'] == 'sys-number':
+            if previous is not None:
+                price = addPrice(price, previous)
             amount = float(eBlock['value'])
-            state = 'amount'
-        elif eBlock['entity'] == 'good' and state == 'amount':
+            previous = eBlock
+        elif eBlock['entity'] == 'good' and amount is not None:
             if(amount % 1 == 0):
                 quantity[eBlock['value']] = int(amount)
             else:
                 quantity[eBlock['value']] = amount
-            state = None
-            removedIndices.append(i - 1)
-            removedIndices.append(i)
-    
-    entities = [entity for entity in entities if entity['index'] not in removedIndices]
-
-    price = extractPrice(entities)
+            amount = None
+            previous = None
+        else:
+            if previous is not None:
+                price = addPrice(price, previous)
+            previous = eBlock
+    if previous is not None:
+        price = addPrice(price, previous)
 
     return {'quantity': quantity, 'price': price}
 
 
 # Extract price from entities extracted by Watson Assistant
 def extractPrice(entities):
-    print("entered extractPrice")
+    logger.debug("entered extractPrice")
     price = None
 
     for eBlock in entities:
-        if eBlock['entity'] == 'sys-currency':
-            price = {
-                'value': eBlock['metadata']['numeric_value'],
-                'unit': eBlock['metadata']['unit']
-            }
-        elif eBlock['entity'] == 'sys-number' and not price:
-            price = {
-                'value': eBlock['metadata']['numeric_value'],
-                'unit': 'USD'
-            }
+        price = addPrice(price, eBlock)
 
     return price
 
 
-# Extract bid from message sent by another agent, a human, or myself
-def extractBidFromMessage(message):
-    print("entered extractBidFromMessage")
+# The price so far, updated with the next entity: the last currency amount, or else the first number
+def addPrice(price, eBlock):
+    if eBlock['entity'] == 'sys-currency':
+        return {
+            'value': eBlock['metadata']['numeric_value'],
+            'unit': eBlock['metadata']['unit']
+        }
+    elif eBlock['entity'] == 'sys-number' and not price:
+        return {
+            'value': eBlock['metadata']['numeric_value'],
+            'unit': 'USD'
+        }
+    return price
+
+
+# Extract bid from message sent by another agent, a human, or myself, classifying it with the given Conversation
+def extractBidFromMessage(message, conversation):
+    logger.debug("entered extractBidFromMessage")
     response = conversation.classifyMessage(message)
     response['environmentUUID'] = message['environmentUUID']
 
     receivedOffer = interpretMessage(response)
     extractedBid = {
         'type': receivedOffer['type'],
-        'price': receivedOffer['price'],
-        'quantity': receivedOffer['quantity']
+        'price': receivedOffer.get('price'),
+        'quantity': receivedOffer.get('quantity')
     }
     return extractedBid
+
+
+# A line of a message stream that is not a JSON message, passed on so that its error is reported in order
+class MalformedMessage:
+    __slots__ = ('text', 'error')
+
+    def __init__(self, text, error):
+        self.text = text
+        self.error = error
+
+
+# Messages from an iterable of JSON lines (str or bytes), with the given defaults filled in. Blank lines are skipped;
+# a line that is not a JSON object becomes a MalformedMessage, so one bad line does not end the stream.
+def readMessageLines(lines, defaults):
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', errors='replace')
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            message = json.loads(line)
+        except ValueError as e:
+            yield MalformedMessage(line, "invalid JSON: " + str(e))
+            continue
+        if not isinstance(message, dict):
+            yield MalformedMessage(line, "not a JSON object")
+            continue
+        yield withDefaults(message, defaults)
+
+
+# Extract bids from a stream of messages, classifying up to `concurrency` messages at a time. Messages with the same
+# text (up to whitespace and case) and role are classified only once. Yields (message, bid, error) in input order,
+# keeping at most `window` messages in flight, so arbitrarily long streams can be processed in constant memory.
+# A MalformedMessage in the stream is yielded as (its text, None, its error).
+def extractBidsFromMessages(messages, conversation, concurrency=8, window=1000):
+    pending = deque()
+    known = {} # dedup key -> future, for the texts seen in the current window
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for message in messages:
+            if isinstance(message, MalformedMessage):
+                future = Future()
+                future.set_exception(ValueError(message.error))
+                pending.append((message.text, None, future))
+                if len(pending) >= window:
+                    yield batchResult(pending.popleft(), known)
+                continue
+            key = (whitespacePattern.sub(' ', message.get('text') or '').strip().lower(), message.get('role'))
+            future = known.get(key)
+            if future is None:
+                future = executor.submit(extractBidFromMessage, dict(message), conversation) # Classification annotates its input
+                known[key] = future
+            pending.append((message, key, future))
+            if len(pending) >= window:
+                yield batchResult(pending.popleft(), known)
+        while pending:
+            yield batchResult(pending.popleft(), known)
+
+
+# Wait for the bid of one message from extractBidsFromMessages(); forget the dedup key once it leaves the window
+def batchResult(entry, known):
+    message, key, future = entry
+    try:
+        result = (message, future.result(), None)
+    except Exception as e:
+        result = (message, None, str(e) or type(e).__name__)
+    if known.get(key) is future:
+        del known[key]
+    return result
+
+
+# Fill in the metadata that the /classifyMessage and /extractBid routes would default
+def withDefaults(message, defaults):
+    for field, value in defaults.items():
+        if not message.get(field):
+            message[field] = value
+    return message
+
+
+# Command-line batch interpretation: read messages as JSON lines (from files or stdin) and write one JSON line per
+# message, {"message": ..., "bid": ...} or {"message": ..., "error": ...}, in the same order.
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Extract structured bids from a JSONL stream of messages.')
+    parser.add_argument('files', nargs='*', help='JSONL files of messages (default: stdin)')
+    parser.add_argument('--concurrency', type=int, default=8, help='messages classified at the same time')
+    parser.add_argument('--role', default='buyer', help='role assumed for messages without one')
+    parser.add_argument('--assistant-params', default='./assistantParams.json', help='Watson Assistant settings')
+    args = parser.parse_args()
+
+    defaults = {'speaker': 'Jeff', 'addressee': None, 'role': args.role, 'environmentUUID': 'abcdefg'}
+    def readMessages():
+        for f in ([open(name) for name in args.files] if args.files else [sys.stdin]):
+            yield from readMessageLines(f, defaults)
+
+    classifier = conversation.Conversation(conversation.loadAssistantParams(args.assistant_params))
+    for message, bid, error in extractBidsFromMessages(readMessages(), classifier, args.concurrency):
+        result = {'message': message, 'error': error} if error else {'message': message, 'bid': bid}
+        sys.stdout.write(json.dumps(result) + '\n')
@@ -0,0 +1,23 @@
+# gunicorn settings for serving the agent, taken from the `serving` block of appSettings.json:
+#
+#   gunicorn -c gunicorn.conf.py wsgi:app
+#
+# Negotiation state (utility functions, rounds, bid histories) lives in the worker process. Keep `workers` at 1 and
+# scale with `threads`, unless every worker is meant to act as a separate agent.
+
+# Imports
+import json
+import logging
+
+# Global variables / settings
+with open('./appSettings.json') as f:
+    appSettings = json.load(f)
+servingSettings = appSettings.get('serving', {})
+
+bind = servingSettings.get('host', '127.0.0.1') + ':' + str(appSettings['defaultPort'])
+workers = servingSettings.get('workers', 1)
+threads = servingSettings.get('threads', 8)
+worker_class = 'gthread'
+graceful_timeout = int(servingSettings.get('drainTimeout', 5.0)) + 5 # Time for a worker to drain its replies at shutdown
+if workers > 1:
+    logging.getLogger('gunicorn.error').warning("%d workers: each worker keeps its own negotiation state", workers)
@@ -0,0 +1,161 @@
+# Load test of the agent's HTTP serving.
+#
+# Starts the agent as a separate process (with generated settings and the local classifier, as in simulate.py) once per
+# server, and has concurrent clients post buyer offers to /receiveMessage for a fixed time. Replies go to a stand-in
+# orchestrator. Reports requests/sec and latency percentiles per server, e.g. the development server against waitress.
+#
+#   python load-test.py
+#   python load-test.py --servers flask waitress --clients 16 --duration 10 --threads 8
+
+# Imports
+import argparse
+import importlib
+import itertools
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import requests
+
+simulate = importlib.import_module('simulate')
+
+# Global variables / settings
+startupTimeout = 30.0
+offers = [
+    "{agent}, I'll give you $5 for 3 eggs and 2 cups of milk.",
+    "{agent}, I want to buy 4 cups of flour and 2 cups of sugar for $6.50.",
+    "{agent}, how about 2 ounces of chocolate and 1 packet of blueberries for $3?",
+    "{agent}, I'd like 6 eggs, 1 teaspoon of vanilla and 3 cups of milk."
+]
+
+
+# *** freePort()
+def freePort():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+# *** startAgent()
+# Run the agent in its own process with the given server, and wait until it is ready
+def startAgent(server, orchestratorPort, args):
+    serving = {'server': server, 'host': '127.0.0.1', 'threads': args.threads, 'connectionLimit': 4 * args.clients}
+    admission = {'enabled': True, 'perSpeaker': {'rate': args.speaker_rate, 'burst': args.speaker_rate}} if args.speaker_rate else None
+    workDir = simulate.writeSettings(orchestratorPort, 'local', args.async_, serving=serving, admission=admission)
+    port = freePort()
+    process = subprocess.Popen([sys.executable, os.path.join(simulate.repoDir, 'agent-py.py'), '--port', str(port)],
+                               cwd=workDir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    baseURL = 'http://127.0.0.1:' + str(port)
+    deadline = time.time() + startupTimeout
+    while time.time() < deadline:
+        try:
+            if requests.get(baseURL + '/ready', timeout=1).status_code == 200:
+                return process, baseURL
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("agent with server " + server + " did not become ready")
+
+
+# *** runClients()
+# Post offers from `clients` concurrent clients for `duration` seconds; returns the latencies (ms), the error count
+# and the number of messages deferred by admission control
+def runClients(baseURL, args):
+    latencies = []
+    errors = [0]
+    deferrals = [0]
+    lock = threading.Lock()
+    stopAt = time.time() + args.duration
+
+    def client(i):
+        session = requests.Session()
+        buyers = itertools.cycle(['Buyer' + str(i) + '-' + str(j) for j in range(4)])
+        texts = itertools.cycle(offers)
+        mine = []
+        failed = 0
+        deferred = 0
+        while time.time() < stopAt:
+            message = {'text': next(texts).format(agent=simulate.agentName), 'speaker': next(buyers),
+                       'addressee': simulate.agentName, 'role': 'buyer', 'environmentUUID': 'load-test',
+                       'timestamp': time.time() * 1000}
+            startedAt = time.perf_counter()
+            try:
+                status = session.post(baseURL + '/receiveMessage', json=message, timeout=10).status_code
+                if status == 429:
+                    deferred += 1
+                elif status != 200:
+                    failed += 1
+            except requests.RequestException:
+                failed += 1
+            mine.append(1000 * (time.perf_counter() - startedAt))
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+            deferrals[0] += deferred
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sorted(latencies), errors[0], deferrals[0]
+
+
+# *** loadTest()
+def loadTest(server, orchestrator, args):
+    process, baseURL = startAgent(server, orchestrator.port, args)
+    try:
+        utility = simulate.randomUtility(simulate.random.Random(args.seed))
+        requests.post(baseURL + '/setUtility', json={'currencyUnit': 'USD', 'utility': utility, 'name': simulate.agentName})
+        requests.post(baseURL + '/startRound', json={'roundDuration': 3600, 'roundNumber': 1, 'seed': args.seed})
+        latencies, errors, deferred = runClients(baseURL, args)
+        requests.post(baseURL + '/endRound', json={'roundNumber': 1})
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    return {
+        'server': server,
+        'requests': len(latencies),
+        'errors': errors,
+        'deferred': deferred,
+        'requestsPerSec': len(latencies) / args.duration,
+        'latencyMs': {'p50': simulate.percentile(latencies, 0.50), 'p99': simulate.percentile(latencies, 0.99)}
+    }
+
+
+# *** printReport()
+def printReport(results):
+    print("%-10s %10s %8s %9s %12s %12s %12s" % ('server', 'requests', 'errors', 'deferred', 'requests/s', 'p50 ms', 'p99 ms'))
+    for result in results:
+        print("%-10s %10d %8d %9d %12.1f %12.2f %12.2f" % (
+            result['server'], result['requests'], result['errors'], result['deferred'], result['requestsPerSec'],
+            result['latencyMs']['p50'] or 0, result['latencyMs']['p99'] or 0))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare requests/sec of the agent under different HTTP servers.')
+    parser.add_argument('--servers', nargs='+', default=['flask', 'waitress'], choices=['flask', 'waitress'],
+                        help='servers to compare (flask is the development server)')
+    parser.add_argument('--clients', type=int, default=8, help='concurrent clients')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds of load per server')
+    parser.add_argument('--threads', type=int, default=8, help='server worker threads (waitress)')
+    parser.add_argument('--async', dest='async_', action='store_true', help='enable asynchronous replies')
+    parser.add_argument('--speaker-rate', type=float, help='enable admission control, allowing this many messages/sec per buyer')
+    parser.add_argument('--seed', type=int, default=1, help='random seed')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+    orchestrator = simulate.Orchestrator()
+    results = [loadTest(server, orchestrator, args) for server in args.servers]
+    orchestrator.shutdown()
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        printReport(results)
@@ -0,0 +1,227 @@
+# Imports
+import json
+import math
+import re
+
+# Global variables / settings
+defaultSkillFile = './skill-HUMAINE-agent-v2.json'
+maxAlternateIntents = 10
+numberWords = {
+    'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6, 'seven': 7, 'eight': 8, 'nine': 9, 'ten': 10,
+    'eleven': 11, 'twelve': 12, 'dozen': 12, 'fifteen': 15, 'twenty': 20
+}
+currencyWords = r'(?:dollars?|bucks|usd)'
+tokenPattern = re.compile(r"@[\w-]+|[a-z0-9']+")
+placeholderPattern = re.compile(r'@(sys-number|sys-currency|good|avatarName)\b')
+
+
+# *** LocalClassifier
+# A small, in-process stand-in for Watson Assistant. Intents are scored by TF-IDF cosine similarity against the
+# examples of the skill file (with entity mentions replaced by their @entity placeholders, exactly as the examples
+# are written), and entities are found with precompiled regular expressions. The output has the same shape as the
+# 'output' block of a Watson Assistant response, so it can be fed straight into extract-bid.interpretMessage().
+# Intents are listed by score, but the confidence of the top intent is its margin over the runner-up: with so few
+# examples, a text that resembles two intents (e.g. "That is too expensive", close to both "That is acceptable" and
+# "That is not acceptable") must not count as a confident answer for either.
+class LocalClassifier:
+
+    def __init__(self, skill, extraAvatarNames=None):
+        self.goodValues, unitWords = readGoods(skill) # lowercased surface form -> canonical good name
+        self.avatarNames = readAvatarNameForms(skill, extraAvatarNames) # lowercased name -> canonical name
+
+        self.currencyMatcher = re.compile(
+            r'\$\s?(?P<a>\d+(?:\.\d+)?)|(?P<b>\d+(?:\.\d+)?)\s?' + currencyWords + r'\b', re.IGNORECASE)
+        self.numberMatcher = re.compile(
+            r'(?<![\w.])(?:\d+(?:\.\d+)?|' + '|'.join(numberWords.keys()) + r')(?![\w])', re.IGNORECASE)
+        self.goodMatcher = re.compile(
+            r'\b(?:(?:' + '|'.join(sorted((re.escape(u) for u in unitWords), key=len, reverse=True)) + r')s? of )?' +
+            r'(?P<good>' + '|'.join(sorted((re.escape(g) for g in self.goodValues), key=len, reverse=True)) + r')\b',
+            re.IGNORECASE)
+        self.avatarMatcher = None
+        if self.avatarNames:
+            self.avatarMatcher = re.compile(
+                r'\b(?:' + '|'.join(sorted((re.escape(n) for n in self.avatarNames), key=len, reverse=True)) + r')\b',
+                re.IGNORECASE)
+
+        self.train(skill.get('intents', []))
+
+
+    # *** fromSkillFile()
+    # Build a classifier from a Watson Assistant skill export
+    @classmethod
+    def fromSkillFile(cls, skillFile=defaultSkillFile, extraAvatarNames=None):
+        with open(skillFile) as f:
+            return cls(json.load(f), extraAvatarNames)
+
+
+    # *** train()
+    # Compute IDF weights and the normalized TF-IDF vector of every intent example
+    def train(self, intents):
+        documents = []
+        for intent in intents:
+            for example in intent.get('examples', []):
+                text = placeholderPattern.sub(lambda m: ' @' + m.group(1) + ' ', example['text'].lower())
+                documents.append((intent['intent'], features(text)))
+
+        documentFrequency = {}
+        for _, feats in documents:
+            for feat in set(feats):
+                documentFrequency[feat] = documentFrequency.get(feat, 0) + 1
+        self.idf = {feat: math.log((1.0 + len(documents)) / (1.0 + df)) + 1.0 for feat, df in documentFrequency.items()}
+        self.intentNames = [intent['intent'] for intent in intents]
+        self.examples = [(intent, self.vectorize(feats)) for intent, feats in documents]
+
+
+    # *** vectorize()
+    # Turn a list of features into a unit-length sparse TF-IDF vector (a dict); unseen features are ignored
+    def vectorize(self, feats):
+        vector = {}
+        for feat in feats:
+            weight = self.idf.get(feat)
+            if weight:
+                vector[feat] = vector.get(feat, 0.0) + weight
+        norm = math.sqrt(sum(w * w for w in vector.values()))
+        if norm:
+            for feat in vector:
+                vector[feat] /= norm
+        return vector
+
+
+    # *** extractEntities()
+    # Find avatar names, goods, currency amounts and numbers in the text, in the Watson entity format
+    def extractEntities(self, text):
+        entities = []
+        if self.avatarMatcher:
+            for m in self.avatarMatcher.finditer(text):
+                entities.append({
+                    'entity': 'avatarName',
+                    'location': [m.start(), m.end()],
+                    'value': self.avatarNames[m.group(0).lower()],
+                    'confidence': 1
+                })
+        for m in self.goodMatcher.finditer(text):
+            entities.append({
+                'entity': 'good',
+                'location': [m.start(), m.end()],
+                'value': self.goodValues[m.group('good').lower()],
+                'confidence': 1
+            })
+        for m in self.currencyMatcher.finditer(text):
+            value = m.group('a') or m.group('b')
+            entities.append({
+                'entity': 'sys-currency',
+                'location': [m.start(), m.end()],
+                'value': value,
+                'confidence': 1,
+                'metadata': {'numeric_value': toNumber(value), 'unit': 'USD'}
+            })
+        for m in self.numberMatcher.finditer(text):
+            word = m.group(0).lower()
+            value = numberWords[word] if word in numberWords else toNumber(word)
+            entities.append({
+                'entity': 'sys-number',
+                'location': [m.start(), m.end()],
+                'value': str(value),
+                'confidence': 1,
+                'metadata': {'numeric_value': value}
+            })
+        # Watson lists entities in order of appearance; at equal start, the wider (currency) span comes first
+        entities.sort(key=lambda e: (e['location'][0], -e['location'][1]))
+        return entities
+
+
+    # *** classify()
+    # Return {'intents': [...], 'entities': [...]} for the given text, like the 'output' of a Watson response
+    def classify(self, text):
+        text = text or ""
+        entities = self.extractEntities(text)
+
+        # Replace entity mentions with their placeholders, so that the text looks like the training examples
+        delexicalized = []
+        cursor = 0
+        for e in entities:
+            start, end = e['location']
+            if start < cursor: # Overlaps a wider entity that was already replaced (e.g. the number inside "$2")
+                continue
+            delexicalized.append(text[cursor:start].lower())
+            delexicalized.append(' @' + e['entity'] + ' ')
+            cursor = end
+        delexicalized.append(text[cursor:].lower())
+        vector = self.vectorize(features(''.join(delexicalized)))
+
+        scores = {name: 0.0 for name in self.intentNames}
+        for intent, example in self.examples:
+            similarity = sum(weight * example.get(feat, 0.0) for feat, weight in vector.items())
+            if similarity > scores[intent]:
+                scores[intent] = similarity
+
+        intents = [{'intent': name, 'confidence': min(score, 1.0)} for name, score in scores.items()]
+        intents.sort(key=lambda i: i['confidence'], reverse=True)
+        if len(intents) > 1:
+            intents[0]['confidence'] -= intents[1]['confidence']
+        return {
+            'intents': intents[:maxAlternateIntents],
+            'entities': entities
+        }
+
+
+# *** readGoods()
+# The surface forms of the goods of a skill (lowercased, mapped to the canonical good name), and the unit words
+# that may precede them ("cups" in "cups of milk")
+def readGoods(skill):
+    goodValues = {}
+    unitWords = set()
+    for entity in skill.get('entities', []):
+        if entity['entity'] == 'good':
+            for v in entity.get('values', []):
+                for form in [v['value'], v['value'] + 's', v['value'] + 'es'] + v.get('synonyms', []):
+                    form = form.lower()
+                    if ' of ' in form: # e.g. "cups of milk": remember the unit, and match the bare noun as well
+                        unit, noun = form.split(' of ', 1)
+                        unitWords.add(unit.rstrip('s'))
+                        form = noun
+                    goodValues[form] = v['value']
+    return goodValues, unitWords
+
+
+# *** readAvatarNameForms()
+# The avatar names of a skill and their synonyms, plus extraAvatarNames (lowercased, mapped to the canonical name)
+def readAvatarNameForms(skill, extraAvatarNames=None):
+    avatarNames = {}
+    for entity in skill.get('entities', []):
+        if entity['entity'] == 'avatarName':
+            for v in entity.get('values', []):
+                for name in [v['value']] + v.get('synonyms', []):
+                    avatarNames[name.lower()] = v['value']
+    for name in extraAvatarNames or []:
+        avatarNames[name.lower()] = name
+    return avatarNames
+
+
+# *** readAvatarNames()
+# List the avatarName entity values (and their synonyms) defined in a skill file
+def readAvatarNames(skillFile=defaultSkillFile):
+    with open(skillFile) as f:
+        skill = json.load(f)
+    names = []
+    for entity in skill.get('entities', []):
+        if entity['entity'] == 'avatarName':
+            for v in entity.get('values', []):
+                names += [v['value']] + v.get('synonyms', [])
+    return names
+
+
+# *** features()
+# Unigram and bigram features of an (already lowercased) text
+def features(text):
+    tokens = tokenPattern.findall(text)
+    return tokens + [tokens[i] + ' ' + tokens[i + 1] for i in range(len(tokens) - 1)]
+
+
+# *** toNumber()
+# Parse a numeric string, keeping whole numbers as ints (as Watson does in numeric_value)
+def toNumber(value):
+    number = float(value)
+    if number % 1 == 0:
+        return int(number)
+    return number
@@ -0,0 +1,101 @@
+# Imports
+import json
+import string
+
+# Global variables / settings
+# The agent's own phrasings. A phrase set loaded from the phrase file only needs to give the phrasings it changes.
+defaultPhrases = {
+    'offer': [
+        "How about if I sell you {bundle} for {price} {unit}."
+    ],
+    'accept': [
+        "You've got a deal! I'll sell you {bundle} for {price} {unit}.",
+        "You've got it! I'll let you have {bundle} for {price} {unit}.",
+        "I accept your offer. Just to confirm, I'll give you {bundle} for {price} {unit}."
+    ],
+    'confirmAccept': [
+        "I confirm that I'm selling you {bundle} for {price} {unit}.",
+        "I'm so glad! This is to confirm that I'll give you {bundle} for {price} {unit}.",
+        "Perfect! Just to confirm, I'm giving you {bundle} for {price} {unit}."
+    ],
+    'reject': [
+        "No thanks. Your offer is much too low for me to consider.",
+        "Forget it. That's not a serious offer.",
+        "Sorry. You're going to have to do a lot better than that!"
+    ],
+    'bundleItem': "{amount} {good}",
+    'bundleSeparator': " ",
+    'decimalMark': "."
+}
+phraseFields = {'bundle', 'price', 'unit'}
+bundleItemFields = {'amount', 'good'}
+templateKinds = {'SellOffer': 'offer', 'Accept': 'accept', 'Reject': 'reject'}
+
+
+# *** PhraseSet
+# The phrasings of one persona or locale, compiled once: every template is checked for unknown fields when it is
+# loaded, and kept as a bound format method, so that rendering a bid is one format call plus one join for the bundle.
+class PhraseSet:
+
+    def __init__(self, name, phrases=None):
+        phrases = dict(defaultPhrases, **(phrases or {}))
+        self.name = name
+        self.templates = {kind: [compileTemplate(name, kind, template, phraseFields) for template in phrases[kind]]
+                          for kind in ('offer', 'accept', 'confirmAccept', 'reject')}
+        for kind, templates in self.templates.items():
+            if not templates:
+                raise ValueError("phrase set " + name + " has no " + kind + " phrasings")
+        self.bundleItem = compileTemplate(name, 'bundleItem', phrases['bundleItem'], bundleItemFields)
+        self.bundleSeparator = phrases['bundleSeparator']
+        self.decimalMark = phrases['decimalMark']
+
+
+    # *** render()
+    # Text of a bid. Where there are several phrasings, one is picked with a single draw from rng (anything with a
+    # random() method), so the text is the same for the same random seed. A SellOffer with one phrasing draws nothing.
+    def render(self, bid, confirm, rng):
+        kind = templateKinds.get(bid['type'])
+        if kind is None:
+            return ""
+        if kind == 'accept' and confirm:
+            kind = 'confirmAccept'
+        templates = self.templates[kind]
+        template = templates[int(rng.random() * len(templates))] if len(templates) > 1 else templates[0]
+        price = bid.get('price') or {}
+        value = str(price.get('value', ''))
+        if self.decimalMark != '.':
+            value = value.replace('.', self.decimalMark)
+        bundleItem = self.bundleItem
+        return template(
+            bundle=self.bundleSeparator.join([bundleItem(amount=amount, good=good)
+                                              for good, amount in (bid.get('quantity') or {}).items()]),
+            price=value,
+            unit=price.get('unit', ''))
+
+
+# *** compileTemplate()
+# Check that a template only uses the allowed fields, and return its bound format method
+def compileTemplate(phraseSet, kind, template, fields):
+    try:
+        used = {field for _, field, _, _ in string.Formatter().parse(template) if field is not None}
+    except ValueError as e:
+        raise ValueError("invalid " + kind + " phrasing in phrase set " + phraseSet + ": " + str(e))
+    unknown = used - fields
+    if unknown:
+        raise ValueError("unknown field " + ', '.join(sorted(unknown)) + " in " + kind + " phrasing of phrase set " + phraseSet)
+    return template.format
+
+
+# *** loadPhraseSet()
+# The phrase set selected by the `messages` settings: `phraseSet` names a set in the JSON file `phraseFile`
+# ({name: phrases}); without either, the agent's own phrasings are used.
+def loadPhraseSet(settings):
+    name = settings.get('phraseSet') or 'default'
+    phraseFile = settings.get('phraseFile')
+    if not phraseFile:
+        return PhraseSet(name)
+    with open(phraseFile) as f:
+        phraseSets = json.load(f)
+    if name not in phraseSets and name != 'default':
+        raise ValueError("no phrase set " + name + " in " + phraseFile)
+    return PhraseSet(name, phraseSets.get(name))
@@ -0,0 +1,170 @@
+# Imports
+from functools import wraps
+import threading
+import time
+
+# Global variables / settings
+enabled = True # When False, timed functions skip all bookkeeping
+defaultBuckets = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+families = {}   # metric name -> MetricFamily, in registration order
+collectors = [] # functions returning extra (name, type, help, labels, value) samples at scrape time
+registryLock = threading.Lock()
+
+
+# *** Histogram
+# Cumulative-bucket histogram of observed durations, in seconds
+class Histogram:
+
+    def __init__(self, buckets=defaultBuckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+
+    # *** observe()
+    def observe(self, value):
+        with self.lock:
+            self.sum += value
+            self.count += 1
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+
+
+    # *** samples()
+    # Prometheus sample lines for this histogram
+    def samples(self, name, labels):
+        with self.lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        lines = []
+        cumulative = 0
+        for bound, n in zip(self.buckets, counts):
+            cumulative += n
+            lines.append(name + '_bucket' + formatLabels(labels + (('le', repr(bound)),)) + ' ' + str(cumulative))
+        lines.append(name + '_bucket' + formatLabels(labels + (('le', '+Inf'),)) + ' ' + str(count))
+        lines.append(name + '_sum' + formatLabels(labels) + ' ' + repr(total))
+        lines.append(name + '_count' + formatLabels(labels) + ' ' + str(count))
+        return lines
+
+
+# *** Counter
+# Monotonically increasing count
+class Counter:
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+
+    # *** inc()
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+
+    # *** samples()
+    def samples(self, name, labels):
+        return [name + formatLabels(labels) + ' ' + str(self.value)]
+
+
+# *** MetricFamily
+# All metrics of one name and type, one per combination of label values
+class MetricFamily:
+
+    def __init__(self, name, type_, help_, factory):
+        self.name = name
+        self.type = type_
+        self.help = help_
+        self.factory = factory
+        self.metrics = {}
+
+
+    # *** labels()
+    # The metric for the given label values, created on first use
+    def labels(self, **labels):
+        key = tuple(sorted(labels.items()))
+        metric = self.metrics.get(key)
+        if metric is None:
+            with registryLock:
+                metric = self.metrics.setdefault(key, self.factory())
+        return metric
+
+
+# *** family()
+# Look up or register a metric family
+def family(name, type_, help_, factory):
+    with registryLock:
+        if name not in families:
+            families[name] = MetricFamily(name, type_, help_, factory)
+        return families[name]
+
+
+# *** histogram()
+def histogram(name, help_, **labels):
+    return family(name, 'histogram', help_, Histogram).labels(**labels)
+
+
+# *** counter()
+def counter(name, help_, **labels):
+    return family(name, 'counter', help_, Counter).labels(**labels)
+
+
+# *** timed()
+# Decorator recording the duration of every call of a hot-path function in the agent_function_duration_seconds
+# histogram, labelled with the given function name
+def timed(functionName):
+    def decorate(f):
+        observed = histogram('agent_function_duration_seconds', 'Duration of hot-path function calls', function=functionName)
+
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return f(*args, **kwargs)
+            startedAt = time.perf_counter()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                observed.observe(time.perf_counter() - startedAt)
+        return wrapper
+    return decorate
+
+
+# *** addCollector()
+# Register a function that returns extra samples, as (name, type, help, labels dict, value) tuples, at scrape time
+def addCollector(collector):
+    collectors.append(collector)
+
+
+# *** render()
+# All metrics in the Prometheus text exposition format. The samples of each metric name are grouped under one HELP
+# and TYPE header, whichever collectors (e.g. one per agent in the process) report them.
+def render():
+    with registryLock:
+        snapshot = [(f, list(f.metrics.items())) for f in families.values()]
+    grouped = {} # metric name -> [type, help, sample lines], in order of first appearance
+    for f, metrics in snapshot:
+        group = grouped[f.name] = [f.type, f.help, []]
+        for labels, metric in metrics:
+            group[2] += metric.samples(f.name, labels)
+    for collector in collectors:
+        for name, type_, help_, labels, value in collector():
+            group = grouped.get(name)
+            if group is None:
+                group = grouped[name] = [type_, help_, []]
+            group[2].append(name + formatLabels(tuple(sorted(labels.items()))) + ' ' + str(value))
+    lines = []
+    for name, (type_, help_, samples) in grouped.items():
+        lines.append('# HELP ' + name + ' ' + help_)
+        lines.append('# TYPE ' + name + ' ' + type_)
+        lines += samples
+    return '\n'.join(lines) + '\n'
+
+
+# *** formatLabels()
+def formatLabels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(k + '="' + str(v).replace('\\', '\\\\').replace('"', '\\"') + '"' for k, v in labels) + '}'
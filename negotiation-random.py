@@ -0,0 +1,116 @@
+# Imports
+import hashlib
+import json
+import random
+
+# Global variables / settings
+defaultBatchSize = 64 # random numbers drawn ahead for each negotiation
+
+
+# *** negotiationSeed()
+# The seed of one negotiation's generator: a hash of the round seed, round number, environment UUID and buyer. Each
+# negotiation thus draws the same numbers in every run of a round with the same seed, however the messages of different
+# buyers interleave.
+def negotiationSeed(roundSeed, roundNumber, environmentUUID, buyer):
+    key = json.dumps([roundSeed, roundNumber, environmentUUID, buyer])
+    return int.from_bytes(hashlib.sha256(key.encode('utf-8')).digest()[:8], 'big')
+
+
+# *** NegotiationRandom
+# The random numbers of one negotiation. They are drawn from the generator in batches, ahead of use: random() takes the
+# next one from the batch, and prefill(), called after a reply has been sent, tops the batch up. The bidding decision
+# itself only calls the generator when a batch runs out. Batching does not change the sequence of numbers, only when
+# they are drawn. Call with the lock of the negotiation session held.
+class NegotiationRandom:
+    __slots__ = ('seed', 'generator', 'batchSize', 'values', 'index', 'position')
+
+    def __init__(self, seed, batchSize=defaultBatchSize):
+        self.seed = seed
+        self.generator = random.Random(seed)
+        self.batchSize = max(1, batchSize)
+        self.values = []
+        self.index = 0     # of the next number in values
+        self.position = 0  # numbers used so far
+        self.prefill()
+
+
+    # *** random()
+    # The next number in [0, 1)
+    def random(self):
+        if self.index == len(self.values):
+            self.prefill()
+        value = self.values[self.index]
+        self.index += 1
+        self.position += 1
+        return value
+
+
+    # *** prefill()
+    # Draw numbers ahead, so that at least batchSize are ready
+    def prefill(self):
+        ready = len(self.values) - self.index
+        if ready < self.batchSize:
+            draw = self.generator.random
+            self.values = self.values[self.index:] + [draw() for _ in range(2 * self.batchSize - ready)]
+            self.index = 0
+
+
+    # *** peek()
+    # The number that random() will return after `ahead` further draws, without using it
+    def peek(self, ahead):
+        while self.index + ahead >= len(self.values):
+            self.values.append(self.generator.random())
+        return self.values[self.index + ahead]
+
+
+    # *** advance()
+    # Use up `draws` numbers, e.g. those that a lookahead read
+    def advance(self, draws):
+        if draws:
+            self.peek(draws - 1)
+        self.index += draws
+        self.position += draws
+
+
+    # *** lookahead()
+    def lookahead(self):
+        return Lookahead(self)
+
+
+# *** Lookahead
+# Reads the numbers that a negotiation will draw next without using them, e.g. to precompute a bid speculatively.
+# If the bid is used, NegotiationRandom.advance(lookahead.draws) uses them up, so that the negotiation's numbers are the
+# same as if the bid had been computed then.
+class Lookahead:
+    __slots__ = ('source', 'draws')
+
+    def __init__(self, source):
+        self.source = source
+        self.draws = 0
+
+
+    # *** random()
+    def random(self):
+        value = self.source.peek(self.draws)
+        self.draws += 1
+        return value
+
+
+# *** RandomSource
+# Creates the generator of each negotiation. Negotiations outside a round that has a seed (e.g. when /startRound was
+# never called) use `seed` from the settings, or one picked at random when the agent starts. Tests may give the agent
+# another source with the same forNegotiation() method.
+class RandomSource:
+
+    def __init__(self, settings):
+        self.batchSize = settings.get('batchSize', defaultBatchSize)
+        self.seed = settings.get('seed')
+        if self.seed is None:
+            self.seed = random.SystemRandom().getrandbits(32)
+
+
+    # *** forNegotiation()
+    def forNegotiation(self, roundSeed, roundNumber, environmentUUID, buyer):
+        if roundSeed is None:
+            roundSeed = self.seed
+        return NegotiationRandom(negotiationSeed(roundSeed, roundNumber, environmentUUID, buyer), self.batchSize)
@@ -0,0 +1,185 @@
+# Imports
+import importlib
+import threading
+bid_ledger = importlib.import_module('bid-ledger')
+deal_stealing = importlib.import_module('deal-stealing')
+
+
+# *** EnvironmentState
+# Everything the agent knows about one environment (one negotiation round hosted by an environment orchestrator):
+# the utility function it was given, the name it goes by, the state of the round, and what it knows of its competitors.
+# An orchestrator may name the environment in some calls and not in others (e.g. in /setUtility and the messages, but
+# not in /startRound). So an environment that has not been given a utility function uses that of `fallback` (the
+# default environment), with its name, and one whose round has not been started uses the round of `fallback`.
+class EnvironmentState:
+
+    def __init__(self, environmentUUID, agentName, roundDuration, fallback=None):
+        self.environmentUUID = environmentUUID
+        self.fallback = fallback
+        self.ownAgentName = agentName
+        self.ownUtilityInfo = None
+        self.ownUtilityEngine = None # Built from utilityInfo when it is set
+        self.ownTranscript = None    # TranscriptLog of the current round, when transcripts are enabled
+        self.competitors = deal_stealing.CompetitorModel()
+        self.ownStrategy = None      # ConcessionStrategy prepared for the current round
+        self.profile = None          # whether its rounds are profiled (see profiler.py); None to follow the settings
+        self.ownNegotiationState = {
+          "active": False,
+          "startTime": None,
+          "roundDuration": roundDuration
+        }
+        self.lock = threading.RLock()
+
+
+    # *** utilitySource()
+    # The environment whose utility function and name this one uses
+    def utilitySource(self):
+        if self.ownUtilityEngine is None and self.fallback is not None and self.fallback.ownUtilityEngine is not None:
+            return self.fallback
+        return self
+
+
+    # *** roundSource()
+    # The environment whose round this one takes part in
+    def roundSource(self):
+        if (self.ownNegotiationState['startTime'] is None and self.fallback is not None
+                and self.fallback.ownNegotiationState['startTime'] is not None):
+            return self.fallback
+        return self
+
+
+    @property
+    def agentName(self):
+        return self.utilitySource().ownAgentName
+
+    @agentName.setter
+    def agentName(self, agentName):
+        self.ownAgentName = agentName
+
+    @property
+    def utilityInfo(self):
+        return self.utilitySource().ownUtilityInfo
+
+    @utilityInfo.setter
+    def utilityInfo(self, utilityInfo):
+        self.ownUtilityInfo = utilityInfo
+
+    @property
+    def utilityEngine(self):
+        return self.utilitySource().ownUtilityEngine
+
+    @utilityEngine.setter
+    def utilityEngine(self, utilityEngine):
+        self.ownUtilityEngine = utilityEngine
+
+    @property
+    def negotiationState(self):
+        return self.roundSource().ownNegotiationState
+
+    @negotiationState.setter
+    def negotiationState(self, negotiationState):
+        self.ownNegotiationState = negotiationState
+
+    @property
+    def strategy(self):
+        return self.roundSource().ownStrategy
+
+    @strategy.setter
+    def strategy(self, strategy):
+        self.ownStrategy = strategy
+
+    @property
+    def transcript(self):
+        return self.roundSource().ownTranscript
+
+    @transcript.setter
+    def transcript(self, transcript):
+        self.ownTranscript = transcript
+
+
+# *** NegotiationSession
+# The negotiation between the agent and one buyer in one environment. Hold the session lock while reading
+# or updating the bid ledger, so that concurrent messages about the same negotiation are decided one at a time.
+class NegotiationSession:
+    __slots__ = ('environmentUUID', 'buyer', 'ledger', 'rng', 'lock')
+
+    def __init__(self, environmentUUID, buyer):
+        self.environmentUUID = environmentUUID
+        self.buyer = buyer
+        self.ledger = bid_ledger.BidLedger() # Bid history with this buyer
+        self.rng = None                      # NegotiationRandom, created on first use (see negotiation-random.py)
+        self.lock = threading.RLock()
+
+
+# *** NegotiationStore
+# Environments keyed by environment UUID, and negotiation sessions keyed by environment UUID and buyer.
+# The store lock is held only to look up or create entries, never while a negotiation is being decided.
+class NegotiationStore:
+
+    def __init__(self, defaultAgentName, defaultRoundDuration):
+        self.defaultAgentName = defaultAgentName
+        self.defaultRoundDuration = defaultRoundDuration
+        self.lock = threading.Lock()
+        self.environments = {}
+        self.sessions = {}
+        self.defaultEnvironment = EnvironmentState(None, defaultAgentName, defaultRoundDuration)
+
+
+    # *** environment()
+    # Look up the state of an environment. Messages that name an environment for which the orchestrator never
+    # sent /setUtility or /startRound with that UUID belong to the default environment (the single-round setup).
+    def environment(self, environmentUUID):
+        return self.environments.get(environmentUUID, self.defaultEnvironment)
+
+
+    # *** registerEnvironment()
+    # Return the state of an environment, creating it if needed; without a UUID, the default environment
+    def registerEnvironment(self, environmentUUID):
+        if not environmentUUID:
+            return self.defaultEnvironment
+        with self.lock:
+            if environmentUUID not in self.environments:
+                self.environments[environmentUUID] = EnvironmentState(
+                    environmentUUID, self.defaultAgentName, self.defaultRoundDuration, self.defaultEnvironment)
+            return self.environments[environmentUUID]
+
+
+    # *** session()
+    # Return the negotiation session with a buyer in an environment, creating it if needed
+    def session(self, environmentUUID, buyer):
+        key = (environmentUUID, buyer)
+        session = self.sessions.get(key)
+        if session:
+            return session
+        with self.lock:
+            if key not in self.sessions:
+                self.sessions[key] = NegotiationSession(environmentUUID, buyer)
+            return self.sessions[key]
+
+
+    # *** findSession()
+    # The negotiation session with a buyer in an environment, or None if there is none yet (none is created)
+    def findSession(self, environmentUUID, buyer):
+        return self.sessions.get((environmentUUID, buyer))
+
+
+    # *** clearSessions()
+    # Forget every negotiation in an environment (e.g. when a new round starts). Clearing the default environment
+    # also forgets negotiations in environments that were never registered, since those messages fall back to it.
+    def clearSessions(self, environment):
+        with self.lock:
+            if environment is self.defaultEnvironment:
+                self.sessions = {key: session for key, session in self.sessions.items() if key[0] in self.environments}
+            else:
+                self.sessions = {key: session for key, session in self.sessions.items()
+                                 if key[0] != environment.environmentUUID}
+
+
+    # *** report()
+    # Number of environments and negotiation sessions currently held
+    def report(self):
+        with self.lock:
+            return {
+                'environments': len(self.environments) + 1,
+                'sessions': len(self.sessions)
+            }
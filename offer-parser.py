@@ -0,0 +1,104 @@
+# Imports
+import importlib
+import json
+import re
+import threading
+local_classifier = importlib.import_module('local-classifier')
+metrics = importlib.import_module('metrics')
+
+# Global variables / settings
+# Phrases that may introduce a bundle or a price in a well-formed offer, as in the Offer examples of the skill file
+leadPhrases = ["i will give you", "i'll give you", "i can give you", "i will pay", "i'll pay", "i'll pay you", "i can pay",
+               "i will sell you", "i'll sell you", "i can sell you", "i would like to buy", "i'd like to buy",
+               "i would like", "i'd like", "i want to buy", "i want", "i'll take", "i will take", "i'll buy", "i will buy",
+               "i offer", "i can do", "how about", "how about if you give me", "what about", "would you take",
+               "would you accept", "would you sell me", "can i have", "can i get", "give me", "sell me"]
+pricePattern = r'(?P<price>\$\s?(?P<a>\d+(?:\.\d+)?)|(?P<b>\d+(?:\.\d+)?)\s?' + local_classifier.currencyWords + r'\b)'
+endPattern = r'[\s.!?]*'
+
+
+# *** OfferParser
+# Fast path ahead of the classifier: parses well-formed offers ("I'll give you $4.50 for 4 cups of milk", "Celia, 2 eggs
+# and 1 cup of sugar for $6?") with a small grammar of precompiled regular expressions. A bundle of amounts and goods
+# and one price, optionally preceded by an avatar name and one of leadPhrases, must make up the whole message; anything
+# else (a negation, a second price, "each") is left to the classifier. The output has the same shape as the 'output'
+# block of a Watson Assistant response, with the entities in order of appearance.
+class OfferParser:
+
+    def __init__(self, skill, extraAvatarNames=None):
+        self.goodValues, unitWords = local_classifier.readGoods(skill)
+        self.avatarNames = local_classifier.readAvatarNameForms(skill, extraAvatarNames)
+        self.stats = {'hits': 0, 'misses': 0}
+        self.lock = threading.Lock()
+
+        amount = r'\d+(?:\.\d+)?|' + '|'.join(local_classifier.numberWords.keys())
+        units = r'(?:(?:' + '|'.join(sorted((re.escape(u) for u in unitWords), key=len, reverse=True)) + r')s?\s+of\s+)?'
+        goods = '|'.join(sorted((re.escape(g) for g in self.goodValues), key=len, reverse=True))
+        self.itemPattern = re.compile(
+            r'(?P<amount>' + amount + r')\s+' + units + r'(?P<good>' + goods + r')\b', re.IGNORECASE)
+        item = r'(?:' + amount + r')\s+' + units + r'(?:' + goods + r')\b'
+        bundle = r'(?P<bundle>' + item + r'(?:(?:\s*,\s*(?:and\s+)?|\s+and\s+|\s+)' + item + r')*)'
+        lead = r'(?:(?:' + '|'.join(sorted((re.escape(p).replace("'", "['’]") for p in leadPhrases),
+                                           key=len, reverse=True)) + r')\s+)?'
+        name = r'\s*(?:(?P<name>' + '|'.join(sorted((re.escape(n) for n in self.avatarNames), key=len, reverse=True)) + \
+               r')\b\s*[,:]?\s*)?' if self.avatarNames else r'\s*'
+        self.patterns = [re.compile(name + form + endPattern, re.IGNORECASE) for form in (
+            lead + bundle + r'\s+for\s+' + pricePattern,                                     # 2 eggs for $3
+            lead + pricePattern + r'\s+for\s+' + bundle,                                     # $3 for 2 eggs
+            r'for\s+(?:a\s+price\s+of\s+)?' + pricePattern + r'\s*,?\s+' + lead + bundle)]  # For $3, I'll sell you 2 eggs
+
+
+    # *** fromSkillFile()
+    @classmethod
+    def fromSkillFile(cls, skillFile=local_classifier.defaultSkillFile, extraAvatarNames=None):
+        with open(skillFile) as f:
+            return cls(json.load(f), extraAvatarNames)
+
+
+    # *** parse()
+    # {'intents': [...], 'entities': [...]} for a well-formed offer, or None if the classifier has to look at the text
+    def parse(self, text):
+        output = self.parseOffer(text or '')
+        with self.lock:
+            self.stats['hits' if output else 'misses'] += 1
+        metrics.counter('agent_offer_fast_path_total', 'Messages seen by the offer fast path',
+                        outcome='hit' if output else 'miss').inc()
+        return output
+
+
+    # *** parseOffer()
+    def parseOffer(self, text):
+        for pattern in self.patterns:
+            m = pattern.fullmatch(text)
+            if m:
+                break
+        else:
+            return None
+
+        entities = []
+        if self.avatarNames and m.group('name'):
+            entities.append({'entity': 'avatarName', 'location': list(m.span('name')),
+                             'value': self.avatarNames[m.group('name').lower()], 'confidence': 1})
+        for item in self.itemPattern.finditer(text, m.start('bundle'), m.end('bundle')):
+            word = item.group('amount').lower()
+            value = local_classifier.numberWords[word] if word in local_classifier.numberWords else local_classifier.toNumber(word)
+            entities.append({'entity': 'sys-number', 'location': list(item.span('amount')), 'value': str(value),
+                             'confidence': 1, 'metadata': {'numeric_value': value}})
+            entities.append({'entity': 'good', 'location': list(item.span('good')),
+                             'value': self.goodValues[item.group('good').lower()], 'confidence': 1})
+        price = m.group('a') or m.group('b')
+        entities.append({'entity': 'sys-currency', 'location': list(m.span('price')), 'value': price, 'confidence': 1,
+                         'metadata': {'numeric_value': local_classifier.toNumber(price), 'unit': 'USD'}})
+        entities.sort(key=lambda e: e['location'][0])
+        return {
+            'intents': [{'intent': 'Offer', 'confidence': 1.0}],
+            'entities': entities
+        }
+
+
+    # *** report()
+    # Messages parsed by the fast path (hits) and left to the classifier (misses), for the /fastPathStats API
+    def report(self):
+        with self.lock:
+            total = self.stats['hits'] + self.stats['misses']
+            return dict(self.stats, hitRate=round(self.stats['hits'] / total, 4) if total else None)
@@ -0,0 +1,194 @@
+# Imports
+from collections import Counter
+from contextlib import contextmanager
+import os
+import sys
+import threading
+import time
+
+# Global variables / settings
+defaultInterval = 0.005   # seconds between samples
+defaultDirectory = 'profiles'
+defaultTopFunctions = 30  # rows of the summary table
+
+
+# *** ProfiledRound
+# The samples taken for one round: how often each stack was seen (stacks are tuples of code objects, outermost first)
+class ProfiledRound:
+    __slots__ = ('path', 'stacks', 'ticks', 'startedAt')
+
+    def __init__(self, path, startedAt):
+        self.path = path
+        self.stacks = Counter()
+        self.ticks = 0
+        self.startedAt = startedAt
+
+
+# *** RoundProfiler
+# Opt-in sampling profiler. While at least one round is being profiled, a thread looks at the stacks of all other
+# threads every `interval` seconds, and counts those that are inside one of the `roots` functions (the API handlers,
+# message processing, outbound posts), from the outermost root down; threads that are idle or elsewhere are not
+# counted. A stack is counted in the profile of the round that its thread is serving (see serving()), so that rounds
+# of different environments profiled at the same time do not share their samples; threads that serve no profiled
+# round are not counted. Frames of the files in `hidden` (such as the metrics wrappers) are left out. When a round's profile is
+# stopped, it is written as collapsed stacks (<path>.collapsed, the input format of flamegraph.pl and speedscope) and
+# as a table of the top functions by cumulative time (<path>.txt). When no round is profiled, there is no thread and
+# no hook: the profiler costs nothing.
+class RoundProfiler:
+
+    def __init__(self, settings, roots, hidden=()):
+        self.interval = settings.get('interval', defaultInterval)
+        self.directory = settings.get('directory', defaultDirectory)
+        self.topFunctions = settings.get('topFunctions', defaultTopFunctions)
+        self.rootCodes = {root.__code__ for root in roots}
+        self.hidden = set(hidden)
+        self.labels = {} # code object -> "module:function"
+        self.lock = threading.Lock()
+        self.rounds = {} # key -> ProfiledRound
+        self.threadKeys = {} # thread id -> key of the round that the thread is working for
+        self.written = []
+        self.thread = None
+
+
+    # *** start()
+    # Start profiling a round; its profile will be written to files named after `name` in the profile directory
+    def start(self, key, name):
+        with self.lock:
+            if key in self.rounds:
+                return
+            self.rounds[key] = ProfiledRound(os.path.join(self.directory, name), time.time())
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='round-profiler', daemon=True)
+                self.thread.start()
+
+
+    # *** stop()
+    # Stop profiling a round and write its profile; returns the paths written (None if the round was not profiled)
+    def stop(self, key):
+        with self.lock:
+            profiled = self.rounds.pop(key, None)
+        if profiled is None:
+            return None
+        paths = self.write(profiled, time.time())
+        with self.lock:
+            self.written = (self.written + [paths])[-10:]
+        return paths
+
+
+    # *** serving()
+    # Context in which the calling thread works for the round of `key`: its samples are counted in that round's profile.
+    # Outside a profiled round, it only looks up the round.
+    @contextmanager
+    def serving(self, key):
+        if key not in self.rounds:
+            yield
+            return
+        threadId = threading.get_ident()
+        previous = self.threadKeys.get(threadId)
+        self.threadKeys[threadId] = key
+        try:
+            yield
+        finally:
+            if previous is None:
+                del self.threadKeys[threadId]
+            else:
+                self.threadKeys[threadId] = previous
+
+
+    # *** profiling()
+    def profiling(self, key):
+        return key in self.rounds
+
+
+    # *** run()
+    # Sampling thread; it exits when no round is being profiled
+    def run(self):
+        ownId = threading.get_ident()
+        while True:
+            with self.lock:
+                if not self.rounds:
+                    self.thread = None
+                    return
+            stacks = []
+            for threadId, frame in sys._current_frames().items():
+                key = self.threadKeys.get(threadId)
+                if threadId != ownId and key is not None:
+                    stack = self.stackOf(frame)
+                    if stack:
+                        stacks.append((key, stack))
+            with self.lock:
+                for profiled in self.rounds.values():
+                    profiled.ticks += 1
+                for key, stack in stacks:
+                    profiled = self.rounds.get(key)
+                    if profiled is not None:
+                        profiled.stacks[stack] += 1
+            time.sleep(self.interval)
+
+
+    # *** stackOf()
+    # The stack of a frame from its outermost root function down, or None if it is not inside a root
+    def stackOf(self, frame):
+        codes = []
+        rootDepth = None
+        while frame is not None:
+            code = frame.f_code
+            if code.co_filename not in self.hidden:
+                codes.append(code)
+                if code in self.rootCodes:
+                    rootDepth = len(codes)
+            frame = frame.f_back
+        if rootDepth is None:
+            return None
+        return tuple(reversed(codes[:rootDepth]))
+
+
+    # *** label()
+    def label(self, code):
+        label = self.labels.get(code)
+        if label is None:
+            module = os.path.splitext(os.path.basename(code.co_filename))[0]
+            label = self.labels[code] = module + ':' + getattr(code, 'co_qualname', code.co_name)
+        return label
+
+
+    # *** write()
+    # Write the collapsed stacks and the summary table of a profiled round
+    def write(self, profiled, stoppedAt):
+        os.makedirs(os.path.dirname(profiled.path) or '.', exist_ok=True)
+        collapsed = Counter()
+        for stack, count in profiled.stacks.items():
+            collapsed[';'.join(self.label(code) for code in stack)] += count
+        with open(profiled.path + '.collapsed', 'w') as f:
+            for stack, count in sorted(collapsed.items()):
+                f.write(stack + ' ' + str(count) + '\n')
+
+        elapsed = stoppedAt - profiled.startedAt
+        period = elapsed / profiled.ticks if profiled.ticks else self.interval # measured time between samples
+        cumulative = Counter()
+        own = Counter()
+        for stack, count in collapsed.items():
+            functions = stack.split(';')
+            for function in set(functions):
+                cumulative[function] += count
+            own[functions[-1]] += count
+        total = sum(collapsed.values())
+        with open(profiled.path + '.txt', 'w') as f:
+            f.write("%.1f seconds profiled, %d samples of busy threads (one every %.1f ms)\n\n" % (
+                elapsed, total, 1000 * period))
+            f.write("%12s %7s %12s  %s\n" % ('cumulative s', '%', 'self s', 'function'))
+            for function, count in cumulative.most_common(self.topFunctions):
+                f.write("%12.3f %6.1f%% %12.3f  %s\n" % (
+                    count * period, 100.0 * count / total, own[function] * period, function))
+        return {'collapsed': profiled.path + '.collapsed', 'summary': profiled.path + '.txt'}
+
+
+    # *** report()
+    # Rounds being profiled and the profiles written last, for the /profiling API
+    def report(self):
+        with self.lock:
+            return {
+                'profiling': [{'path': profiled.path, 'samples': sum(profiled.stacks.values()), 'ticks': profiled.ticks}
+                              for profiled in self.rounds.values()],
+                'written': list(self.written)
+            }
@@ -0,0 +1,156 @@
+# Replay of a recorded round, for debugging and performance regression tests.
+#
+# Feeds the messages of a transcript log (see transcript-log.py) through the agent's processMessage() again, with the
+# recorded classifications, random seed, utility function and clock, and compares the replies with the recorded ones.
+# No Watson Assistant or environment orchestrator is needed, and nothing is sent. Each negotiation draws its random
+# numbers from its own generator (see negotiation-random.py), so replies are reproduced however the messages of
+# different buyers interleaved, with synchronous or asynchronous replies.
+#
+#   python replay.py transcripts/abcdefg-round1-1602700000000.jsonl
+#   python replay.py --repeat 20 --json transcripts/abcdefg-round1-1602700000000.jsonl
+
+# Imports
+import argparse
+import copy
+import importlib
+import json
+import statistics
+import sys
+import time
+
+simulate = importlib.import_module('simulate')
+transcript_log = importlib.import_module('transcript-log')
+message_templates = importlib.import_module('message-templates')
+utility_engine = importlib.import_module('utility-engine')
+deal_stealing = importlib.import_module('deal-stealing')
+concession_strategy = importlib.import_module('concession-strategy')
+
+# Global variables / settings
+maxReportedMismatches = 10
+
+
+# *** readRound()
+# The round header of a transcript, and the processing of each message: its classification, the time at which the
+# agent decided on its reply, and the reply that was sent (if any)
+def readRound(reader):
+    header = None
+    steps = []
+    latest = {}  # speaker -> step of the latest message from that speaker
+    bidding = {} # buyer -> step that made a bid to that buyer, until the bid is sent
+    for event in reader:
+        data = event['data']
+        if event['kind'] == 'round':
+            header = data
+        elif event['kind'] == 'classification':
+            step = {'classification': data, 'time': event['time'], 'reply': None}
+            latest[data['input']['speaker']] = step
+            steps.append(step)
+        elif event['kind'] == 'bid' and data.get('replyTo', data['buyer']) in latest:
+            step = latest[data.get('replyTo', data['buyer'])]
+            step['time'] = event['time']
+            bidding[data['buyer']] = step
+        elif event['kind'] == 'outbound':
+            step = bidding.pop(data.get('addressee'), None) or latest.get(data.get('addressee'))
+            if step and step['reply'] is None:
+                step['reply'] = data
+    if header is None:
+        raise ValueError("transcript has no round header")
+    return header, steps
+
+
+# *** replayRound()
+# Replay a round through a loaded agent. Returns the number of replies that matched and a list of mismatches.
+def replayRound(agent, header, steps):
+    environment = agent.negotiationStore.registerEnvironment(header['environmentUUID'])
+    agent.negotiationStore.clearSessions(environment)
+    with environment.lock:
+        environment.agentName = header['agentName']
+        environment.utilityInfo = header['utilityInfo']
+        environment.utilityEngine = utility_engine.compileUtility(header['utilityInfo'])
+        environment.negotiationState = dict(header['negotiationState'], seed=header['seed'])
+        environment.competitors = deal_stealing.CompetitorModel()
+        environment.strategy = concession_strategy.createStrategy(
+            header.get('strategy'), environment.negotiationState['roundDuration'])
+    agent.engineSettings = header['utilityEngineSettings']
+    agent.counterOfferMode = agent.engineSettings.get('counterOfferMode', 'off')
+    agent.stealPolicy = deal_stealing.StealPolicy(header.get('dealStealing', {}))
+
+    now = [environment.negotiationState['startTime'] / 1000]
+    current = [None]
+    classifyMessage = agent.conversation.classifyMessage
+    agent.clock = lambda: now[0]
+    agent.conversation.classifyMessage = lambda message, *args: copy.deepcopy(current[0])
+    matched = 0
+    mismatches = []
+    try:
+        for i, step in enumerate(steps):
+            now[0] = step['time']
+            current[0] = step['classification']
+            reply = agent.processMessage(copy.deepcopy(step['classification']['input']))
+            expected = step['reply']
+            if replyKey(reply) == replyKey(expected):
+                matched += 1
+            else:
+                mismatches.append({'step': i, 'expected': expected, 'replayed': reply})
+    finally:
+        agent.conversation.classifyMessage = classifyMessage
+        agent.clock = time.time
+    return matched, mismatches
+
+
+# *** replyKey()
+# The parts of a reply that a replay must reproduce
+def replyKey(reply):
+    if not reply:
+        return None
+    return reply.get('text'), json.dumps(reply.get('bid'), sort_keys=True)
+
+
+# *** replay()
+def replay(args):
+    with transcript_log.TranscriptReader(args.transcript) as reader:
+        header, steps = readRound(reader)
+    agent = simulate.loadAgent(9, 'local', False) # Nothing is sent, so the orchestrator port does not matter
+    agent.phraseSet = message_templates.loadPhraseSet(header.get('messages', {}))
+    durations = []
+    for _ in range(args.repeat):
+        startedAt = time.perf_counter()
+        matched, mismatches = replayRound(agent, header, steps)
+        durations.append(time.perf_counter() - startedAt)
+    elapsed = statistics.median(durations)
+    return {
+        'transcript': args.transcript,
+        'seed': header['seed'],
+        'messages': len(steps),
+        'replies': sum(1 for step in steps if step['reply']),
+        'matched': matched,
+        'mismatched': len(mismatches),
+        'mismatches': mismatches[:maxReportedMismatches],
+        'repeat': args.repeat,
+        'elapsedSec': elapsed,
+        'messagesPerSec': len(steps) / elapsed if elapsed else None
+    }
+
+
+# *** printReport()
+def printReport(report):
+    print("transcript:  ", report['transcript'], "(seed " + str(report['seed']) + ")")
+    print("messages:    ", report['messages'], "with", report['replies'], "replies")
+    print("reproduced:  ", report['matched'], "of", report['messages'], "replies;", report['mismatched'], "mismatched")
+    for mismatch in report['mismatches']:
+        print("  step", mismatch['step'], "expected", replyKey(mismatch['expected']), "replayed", replyKey(mismatch['replayed']))
+    print("throughput:   %.1f messages/sec (median of %d replays)" % (report['messagesPerSec'], report['repeat']))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Replay a recorded round through the agent and compare its replies.')
+    parser.add_argument('transcript', help='transcript log (.jsonl) of the round')
+    parser.add_argument('--repeat', type=int, default=1, help='number of replays, for timing')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args()
+    report = replay(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        printReport(report)
+    sys.exit(1 if report['mismatched'] else 0)
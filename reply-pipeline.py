@@ -0,0 +1,157 @@
+# Imports
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+
+# Global variables / settings
+latencySampleSize = 1000
+
+logger = logging.getLogger('agent-py.reply-pipeline')
+
+
+# *** ReplyPipeline
+# Processes received messages on a pool of worker threads, so that /receiveMessage can acknowledge immediately.
+# Messages are queued per key (environment UUID and buyer); a key is handed to at most one worker at a time,
+# so the messages of any one buyer are handled strictly in the order in which they arrived, while different
+# buyers are handled concurrently.
+# Keys are handed out in order of when their oldest message was enqueued, less the priority that the optional
+# priority(message) function gave it (in seconds), so that a message can be let ahead of messages that have been
+# waiting for up to that long. A message's priority is computed when it becomes the oldest of its key: when it is
+# submitted with no other message of its key queued or being handled, or else once the message before it has been
+# handled (so it reflects what that message changed). It is not revised while the key waits in the ready queue.
+class ReplyPipeline:
+
+    def __init__(self, handler, workers=4, priority=None):
+        self.handler = handler
+        self.priority = priority
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        self.wakeup = threading.Condition(self.lock)
+        self.pending = {}  # key -> deque of (enqueuedAt, message)
+        self.ready = []    # heap of (due, sequence, key), for keys that have pending messages and no worker
+        self.sequence = itertools.count()
+        self.depth = 0
+        self.inFlight = 0
+        self.stats = {'enqueued': 0, 'processed': 0, 'errors': 0, 'cancelled': 0}
+        self.latencies = deque(maxlen=latencySampleSize) # enqueue -> reply sent, in ms
+        self.waits = deque(maxlen=latencySampleSize)     # enqueue -> picked up by a worker, in ms
+        self.threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self.work, name='reply-worker-' + str(i), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+
+    # *** submit()
+    # Queue a message for processing behind any earlier messages with the same key
+    def submit(self, key, message):
+        enqueuedAt = time.time()
+        with self.lock:
+            self.stats['enqueued'] += 1
+            self.depth += 1
+            if key in self.pending: # A worker owns this key (or it is already waiting in the ready queue)
+                self.pending[key].append((enqueuedAt, message))
+                return
+            self.pending[key] = deque([(enqueuedAt, message)])
+            heapq.heappush(self.ready, (self.due(enqueuedAt, message), next(self.sequence), key))
+            self.wakeup.notify()
+
+
+    # *** work()
+    # Worker loop: take the ready key that is due first, handle its oldest message, and give the key back if more are waiting
+    def work(self):
+        while True:
+            with self.lock:
+                while not self.ready:
+                    self.wakeup.wait()
+                _, _, key = heapq.heappop(self.ready)
+                enqueuedAt, message = self.pending[key].popleft()
+                self.depth -= 1
+                self.inFlight += 1
+            startedAt = time.time()
+            try:
+                self.handler(message)
+            except Exception:
+                logger.exception("Error processing message from %s", key)
+                with self.lock:
+                    self.stats['errors'] += 1
+            finishedAt = time.time()
+            with self.lock:
+                self.inFlight -= 1
+                self.stats['processed'] += 1
+                self.waits.append(1000 * (startedAt - enqueuedAt))
+                self.latencies.append(1000 * (finishedAt - enqueuedAt))
+                if self.pending[key]:
+                    heapq.heappush(self.ready, (self.due(*self.pending[key][0]), next(self.sequence), key))
+                    self.wakeup.notify()
+                else:
+                    del self.pending[key]
+                    self.idle.notify_all() # For drain() of the key's environment
+
+
+    # *** due()
+    # When a message enqueued at enqueuedAt is due: earlier by its priority, in seconds. Called with the lock held, so
+    # priority() must be quick.
+    def due(self, enqueuedAt, message):
+        return enqueuedAt - (self.priority(message) if self.priority else 0.0)
+
+
+    # *** cancel()
+    # Drop the queued messages whose key matches, e.g. when their round has ended; messages already being handled are
+    # finished. Returns the dropped messages.
+    def cancel(self, matches):
+        cancelled = []
+        with self.lock:
+            readyKeys = {key for _, _, key in self.ready}
+            for key in [key for key in self.pending if matches(key)]:
+                cancelled.extend(message for _, message in self.pending[key])
+                self.pending[key].clear()
+                if key in readyKeys: # No worker owns the key; a worker that does forgets it when it is done
+                    del self.pending[key]
+            if cancelled:
+                self.ready = [entry for entry in self.ready if entry[2] in self.pending]
+                heapq.heapify(self.ready)
+                self.depth -= len(cancelled)
+                self.stats['cancelled'] += len(cancelled)
+                self.idle.notify_all()
+        return cancelled
+
+
+    # *** drain()
+    # Wait until every queued message has been handled, or until the timeout (in seconds) expires. With an
+    # environmentUUID, only wait for the messages of that environment (keys are (environment UUID, buyer)).
+    # Returns True if there is nothing left to wait for.
+    def drain(self, timeout=None, environmentUUID=None):
+        if environmentUUID is None:
+            done = lambda: not self.depth and not self.inFlight
+        else: # A key stays in pending until its last message has been handled
+            done = lambda: not any(key[0] == environmentUUID for key in self.pending)
+        with self.lock:
+            return self.idle.wait_for(done, timeout)
+
+
+    # *** report()
+    # Queue depth, throughput counters and latency percentiles, for the /pipelineStats API
+    def report(self):
+        with self.lock:
+            report = dict(self.stats)
+            report['queueDepth'] = self.depth
+            report['inFlight'] = self.inFlight
+            report['activeBuyers'] = len(self.pending)
+            latencies = sorted(self.latencies)
+            waits = sorted(self.waits)
+        report['workers'] = len(self.threads)
+        report['latencyMs'] = {'p50': percentile(latencies, 0.50), 'p99': percentile(latencies, 0.99)}
+        report['queueWaitMs'] = {'p50': percentile(waits, 0.50), 'p99': percentile(waits, 0.99)}
+        return report
+
+
+# *** percentile()
+# Nearest-rank percentile of an already sorted list (None if the list is empty)
+def percentile(values, fraction):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
@@ -0,0 +1,113 @@
+# Imports
+import heapq
+import itertools
+import logging
+import threading
+
+logger = logging.getLogger('agent-py.round-scheduler')
+
+
+# *** ScheduledEvent
+# A callback due at a time (in seconds, on the scheduler's clock) for an environment. Cancelled events stay in the
+# heap until they come up, and are skipped then.
+class ScheduledEvent:
+    __slots__ = ('when', 'environmentUUID', 'kind', 'callback', 'args', 'cancelled')
+
+    def __init__(self, when, environmentUUID, kind, callback, args):
+        self.when = when
+        self.environmentUUID = environmentUUID
+        self.kind = kind
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+
+# *** RoundScheduler
+# The timers of the rounds an agent takes part in (the start of a round, warnings before its end, and its end), run on
+# one thread in order of their due time. The thread is started with the first timer. Callbacks run on that thread, so
+# they should be quick; an exception in one is logged and does not stop the others.
+class RoundScheduler:
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.events = []  # heap of (when, sequence, ScheduledEvent)
+        self.sequence = itertools.count()
+        self.thread = None
+        self.closed = False
+        self.stats = {'scheduled': 0, 'fired': 0, 'cancelled': 0, 'errors': 0}
+
+
+    # *** schedule()
+    # Call callback(*args) at time `when`, or as soon as possible if that has passed
+    def schedule(self, environmentUUID, kind, when, callback, *args):
+        event = ScheduledEvent(when, environmentUUID, kind, callback, args)
+        with self.lock:
+            if self.closed:
+                return None
+            heapq.heappush(self.events, (when, next(self.sequence), event))
+            self.stats['scheduled'] += 1
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='round-scheduler', daemon=True)
+                self.thread.start()
+            self.wakeup.notify()
+        return event
+
+
+    # *** cancel()
+    # Cancel the pending timers of an environment; returns how many were cancelled
+    def cancel(self, environmentUUID):
+        cancelled = 0
+        with self.lock:
+            for _, _, event in self.events:
+                if event.environmentUUID == environmentUUID and not event.cancelled:
+                    event.cancelled = True
+                    cancelled += 1
+            self.stats['cancelled'] += cancelled
+        return cancelled
+
+
+    # *** run()
+    # Timer thread: sleep until the earliest timer is due, and fire it
+    def run(self):
+        while True:
+            with self.lock:
+                while True:
+                    if self.closed:
+                        return
+                    while self.events and self.events[0][2].cancelled:
+                        heapq.heappop(self.events)
+                    if not self.events:
+                        self.wakeup.wait()
+                        continue
+                    delay = self.events[0][0] - self.clock()
+                    if delay <= 0:
+                        break
+                    self.wakeup.wait(delay)
+                _, _, event = heapq.heappop(self.events)
+                self.stats['fired'] += 1
+            try:
+                event.callback(*event.args)
+            except Exception:
+                logger.exception("Error in %s timer of environment %s", event.kind, event.environmentUUID)
+                with self.lock:
+                    self.stats['errors'] += 1
+
+
+    # *** close()
+    # Stop the timer thread; pending timers are dropped
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.events = []
+            self.wakeup.notify()
+
+
+    # *** report()
+    # Counters, and the pending timers in order, for the /schedulerStats API
+    def report(self):
+        with self.lock:
+            pending = sorted((entry for entry in self.events if not entry[2].cancelled), key=lambda entry: entry[:2])
+            return dict(self.stats, pending=[{'environmentUUID': event.environmentUUID, 'kind': event.kind,
+                                              'inSeconds': round(when - self.clock(), 3)} for when, _, event in pending])
@@ -0,0 +1,441 @@
+# Offline negotiation simulator and throughput benchmark.
+#
+# Runs the agent in-process against simulated buyers, with a stub (or the local) classifier and a stand-in
+# environment orchestrator listening on localhost, so no Watson Assistant or other network service is needed.
+# Reports messages/sec, /receiveMessage latency percentiles, reply latency and memory per active negotiation.
+#
+#   python simulate.py --buyers 20 --negotiations 5 --concurrency 4
+#   python simulate.py --classifier local --async --json
+#   python simulate.py --transcripts transcripts   (record the round, for replay.py)
+
+# Imports
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import importlib
+import json
+import os
+import queue
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+
+# Global variables / settings
+repoDir = os.path.dirname(os.path.abspath(__file__))
+agentName = 'Agent007'
+goods = {
+    'egg': ('each', 'eggs'),
+    'flour': ('cup', 'cups of flour'),
+    'sugar': ('cup', 'cups of sugar'),
+    'milk': ('cup', 'cups of milk'),
+    'chocolate': ('ounce', 'ounces of chocolate'),
+    'blueberry': ('packet', 'packets of blueberries'),
+    'vanilla': ('teaspoon', 'teaspoons of vanilla')
+}
+replyTimeout = 5.0
+
+
+# ******************************************************************************************************* #
+#                                       Stand-in environment orchestrator                                 #
+# ******************************************************************************************************* #
+
+# *** Orchestrator
+# Receives /relayMessage posts from the agent and delivers each message to the mailbox of its addressee
+class Orchestrator:
+
+    def __init__(self):
+        self.mailboxes = {}
+        self.lock = threading.Lock()
+        self.received = 0
+        orchestrator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                messages = json.loads(body or b'null')
+                for message in messages if isinstance(messages, list) else [messages]:
+                    orchestrator.deliver(message)
+                reply = json.dumps({'status': 'Acknowledged'}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(reply)))
+                self.end_headers()
+                self.wfile.write(reply)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+
+    # *** mailbox()
+    # The queue of messages relayed to a given addressee
+    def mailbox(self, addressee):
+        with self.lock:
+            if addressee not in self.mailboxes:
+                self.mailboxes[addressee] = queue.Queue()
+            return self.mailboxes[addressee]
+
+
+    # *** deliver()
+    # Put a relayed message into its addressee's mailbox
+    def deliver(self, message):
+        with self.lock:
+            self.received += 1
+        self.mailbox(message.get('addressee')).put((time.time(), message))
+
+
+    # *** shutdown()
+    def shutdown(self):
+        self.server.shutdown()
+
+
+# ******************************************************************************************************* #
+#                                              Stub classifier                                            #
+# ******************************************************************************************************* #
+
+# *** StubClassifier
+# Simulated buyers register the Watson-style output for every text they say, so classification is a dictionary lookup
+class StubClassifier:
+
+    def __init__(self):
+        self.outputs = {}
+
+
+    # *** register()
+    # Remember the intent and entities of a text
+    def register(self, text, output):
+        self.outputs[text] = output
+
+
+    # *** classifyMessage()
+    # Drop-in replacement for conversation.classifyMessage()
+    def classifyMessage(self, input_):
+        output = dict(self.outputs.get(input_['text']) or {'intents': [], 'entities': []})
+        output['input'] = input_
+        output['addressee'] = input_['addressee']
+        output['speaker'] = input_['speaker']
+        return output
+
+
+# *** offerOutput()
+# Watson-style output for an offer of a bundle, with an optional price
+def offerOutput(quantity, price):
+    entities = [{'entity': 'avatarName', 'value': agentName, 'confidence': 1}]
+    if price is not None:
+        entities.append({'entity': 'sys-currency', 'value': str(price), 'confidence': 1,
+                         'metadata': {'numeric_value': price, 'unit': 'USD'}})
+        entities.append({'entity': 'sys-number', 'value': str(price), 'confidence': 1,
+                         'metadata': {'numeric_value': price}})
+    for good, amount in quantity.items():
+        entities.append({'entity': 'sys-number', 'value': str(amount), 'confidence': 1,
+                         'metadata': {'numeric_value': amount}})
+        entities.append({'entity': 'good', 'value': good, 'confidence': 1})
+    return {'intents': [{'intent': 'Offer', 'confidence': 0.9}], 'entities': entities}
+
+
+# *** intentOutput()
+# Watson-style output for a message with just an intent
+def intentOutput(intent):
+    return {
+        'intents': [{'intent': intent, 'confidence': 0.9}],
+        'entities': [{'entity': 'avatarName', 'value': agentName, 'confidence': 1}]
+    }
+
+
+# ******************************************************************************************************* #
+#                                             Simulated buyers                                            #
+# ******************************************************************************************************* #
+
+# *** Buyer
+# A buyer that opens with a low offer, raises it towards a private reservation price while the agent counters,
+# and accepts as soon as the agent asks for no more than that. Scripted buyers use fixed bundles and prices.
+class Buyer:
+
+    def __init__(self, name, rng, utility, scripted, maxTurns=6):
+        self.name = name
+        self.rng = rng
+        self.utility = utility
+        self.scripted = scripted
+        self.maxTurns = maxTurns
+
+
+    # *** newBundle()
+    def newBundle(self):
+        if self.scripted:
+            return {'egg': 3, 'milk': 2}
+        chosen = self.rng.sample(sorted(goods.keys()), self.rng.randint(1, 3))
+        return {good: self.rng.randint(1, 6) for good in chosen}
+
+
+    # *** say()
+    # Build a message, registering its classification with the stub classifier
+    def say(self, stub, text, output):
+        stub.register(text, output)
+        return {
+            'text': text,
+            'speaker': self.name,
+            'addressee': agentName,
+            'role': 'buyer',
+            'environmentUUID': 'simulation',
+            'timestamp': time.time() * 1000
+        }
+
+
+    # *** negotiate()
+    # Generate the messages of one negotiation. Sends each message, then learns the agent's reply from what is sent back.
+    def negotiate(self, stub):
+        quantity = self.newBundle()
+        cost = sum(self.utility[good]['parameters']['unitcost'] * amount for good, amount in quantity.items())
+        if self.scripted:
+            reservation, offer = round(cost * 1.6, 2), round(cost * 1.1, 2)
+        else:
+            reservation = round(cost * (1.3 + self.rng.random()), 2)
+            offer = round(reservation * (0.5 + 0.3 * self.rng.random()), 2)
+        described = ' and '.join(str(amount) + ' ' + goods[good][1] for good, amount in quantity.items())
+
+        for turn in range(self.maxTurns):
+            text = agentName + ", I'll give you $" + ('%.2f' % offer) + ' for ' + described + '.'
+            reply = yield self.say(stub, text, offerOutput(quantity, offer))
+            bid = (reply or {}).get('bid') or {}
+            if bid.get('type') == 'Accept' or not bid:
+                return
+            if bid.get('type') == 'SellOffer' and bid['price']['value'] <= reservation:
+                yield self.say(stub, agentName + ', I accept.', intentOutput('AcceptOffer'))
+                return
+            if bid.get('type') == 'SellOffer':
+                offer = round(min(reservation, offer + 0.5 * (bid['price']['value'] - offer)), 2)
+        yield self.say(stub, 'No deal.', intentOutput('RejectOffer'))
+
+
+# ******************************************************************************************************* #
+#                                                 Simulation                                              #
+# ******************************************************************************************************* #
+
+# *** agentSettings()
+# appSettings and assistantParams for an offline agent that relays its replies to the given orchestrator port
+def agentSettings(orchestratorPort, classifier, asyncReplies, transcriptDirectory=None, serving=None, speculation=False,
+                  admission=None, historyFile=None, profileDirectory=None):
+    appSettings = {
+        'defaultPort': '14007',
+        'name': agentName,
+        'serviceMap': {
+            'environment-orchestrator': {'protocol': 'http', 'host': '127.0.0.1', 'port': orchestratorPort}
+        },
+        'asyncReplies': {'enabled': asyncReplies, 'workers': 4},
+        'transcripts': {'enabled': bool(transcriptDirectory), 'directory': transcriptDirectory},
+        'serving': serving or {},
+        'speculation': {'enabled': speculation},
+        'admission': admission or {},
+        'buyerHistory': {'enabled': bool(historyFile), 'file': historyFile},
+        'profiling': {'enabled': bool(profileDirectory), 'directory': profileDirectory}
+    }
+    assistantParams = {
+        'apikey': 'offline',
+        'url': 'http://127.0.0.1:9',
+        'assistantId': 'offline',
+        'version': '2019-02-28',
+        'classifier': 'local',
+        'localConfidenceThreshold': 0.0, # Never fall back to Watson
+        'skillFile': os.path.join(repoDir, 'skill-HUMAINE-agent-v2.json'),
+        'avatarNames': [agentName],
+        'cache': {'enabled': classifier == 'local'}
+    }
+    return appSettings, assistantParams
+
+
+# *** writeSettings()
+# Write appSettings.json and assistantParams.json for an offline agent into a new scratch directory, and return it
+def writeSettings(orchestratorPort, classifier, asyncReplies, transcriptDirectory=None, serving=None, admission=None):
+    workDir = tempfile.mkdtemp(prefix='agent-sim-')
+    appSettings, assistantParams = agentSettings(orchestratorPort, classifier, asyncReplies, transcriptDirectory, serving,
+                                                 admission=admission)
+    with open(os.path.join(workDir, 'appSettings.json'), 'w') as f:
+        json.dump(appSettings, f)
+    with open(os.path.join(workDir, 'assistantParams.json'), 'w') as f:
+        json.dump(assistantParams, f)
+    return workDir
+
+
+# *** loadAgent()
+# Build an agent in-process from generated settings, so that nothing in the repository is touched
+def loadAgent(orchestratorPort, classifier, asyncReplies, transcriptDirectory=None, speculation=False, historyFile=None,
+              profileDirectory=None):
+    appSettings, assistantParams = agentSettings(orchestratorPort, classifier, asyncReplies, transcriptDirectory,
+                                                 speculation=speculation, historyFile=historyFile,
+                                                 profileDirectory=profileDirectory)
+    agent_py = importlib.import_module('agent-py')
+    agent_py.configureProcess(appSettings)
+    return agent_py.createAgents(appSettings, assistantParams)[0]
+
+
+# *** randomUtility()
+def randomUtility(rng):
+    return {
+        good: {'type': 'unitcost', 'unit': unit, 'parameters': {'unitcost': round(0.1 + rng.random(), 2)}}
+        for good, (unit, _) in goods.items()
+    }
+
+
+# *** runBuyer()
+# Play all negotiations of one buyer against the agent, recording handling and reply latencies. The buyer calls
+# think(), if given, before answering a reply.
+def runBuyer(buyer, negotiations, client, orchestrator, stub, results, lock, think=None):
+    mailbox = orchestrator.mailbox(buyer.name)
+    for _ in range(negotiations):
+        script = buyer.negotiate(stub)
+        message = next(script)
+        while message is not None:
+            sentAt = time.time()
+            response = client.post('/receiveMessage', json=message)
+            handledAt = time.time()
+            reply = None
+            receivedAt = None
+            try:
+                receivedAt, reply = mailbox.get(timeout=replyTimeout)
+            except queue.Empty:
+                pass
+            with lock:
+                results['messages'] += 1
+                results['handleLatencies'].append(1000 * (handledAt - sentAt))
+                if receivedAt:
+                    results['replyLatencies'].append(1000 * (receivedAt - sentAt))
+                if response.status_code != 200:
+                    results['errors'] += 1
+            if think and reply:
+                think()
+            try:
+                message = script.send(reply)
+            except StopIteration:
+                message = None
+
+
+# *** simulate()
+def simulate(args):
+    rng = random.Random(args.seed)
+    random.seed(args.seed)
+    orchestrator = Orchestrator()
+    agent = loadAgent(orchestrator.port, args.classifier, args.async_,
+                      os.path.abspath(args.transcripts) if args.transcripts else None, args.speculate, args.history,
+                      os.path.abspath(args.profile) if args.profile else None)
+    stub = StubClassifier()
+    if args.classifier == 'stub':
+        agent.conversation.classifyMessage = stub.classifyMessage
+    client = agent.app.test_client()
+    lock = threading.Lock()
+
+    utility = randomUtility(rng)
+    client.post('/setUtility', json={'currencyUnit': 'USD', 'utility': utility, 'name': agentName})
+    client.post('/startRound', json={'roundDuration': 3600, 'roundNumber': 1, 'seed': args.seed})
+
+    buyers = [Buyer('Buyer' + str(i), random.Random(rng.random()), utility, args.scripted) for i in range(args.buyers)]
+    results = {'messages': 0, 'errors': 0, 'handleLatencies': [], 'replyLatencies': []}
+
+    tracemalloc.start()
+    memoryBefore = tracemalloc.get_traced_memory()[0]
+    startedAt = time.time()
+    work = queue.Queue()
+    for buyer in buyers:
+        work.put(buyer)
+
+    # Simulated buyers answer at once, before the agent could have speculated on their answer; with speculation, they
+    # wait for it, as a buyer reading the offer would give it time to
+    think = (lambda: agent.speculator.drain(replyTimeout)) if agent.speculator else None
+
+    def worker():
+        workerClient = agent.app.test_client()
+        while True:
+            try:
+                buyer = work.get_nowait()
+            except queue.Empty:
+                return
+            runBuyer(buyer, args.negotiations, workerClient, orchestrator, stub, results, lock, think)
+
+    threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - startedAt
+    sessions = agent.negotiationStore.report()['sessions']
+    memoryAfter = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    client.post('/endRound', json={'roundNumber': 1})
+    orchestrator.shutdown()
+
+    handle = sorted(results['handleLatencies'])
+    reply = sorted(results['replyLatencies'])
+    return {
+        'classifier': args.classifier,
+        'asyncReplies': args.async_,
+        'buyers': args.buyers,
+        'messages': results['messages'],
+        'errors': results['errors'],
+        'relayed': orchestrator.received,
+        'elapsedSec': elapsed,
+        'messagesPerSec': results['messages'] / elapsed if elapsed else None,
+        'handleLatencyMs': {'p50': percentile(handle, 0.50), 'p99': percentile(handle, 0.99)},
+        'replyLatencyMs': {'p50': percentile(reply, 0.50), 'p99': percentile(reply, 0.99)},
+        'activeNegotiations': sessions,
+        'bytesPerNegotiation': (memoryAfter - memoryBefore) / sessions if sessions else None,
+        'speculation': agent.speculator.report() if agent.speculator else None,
+        'buyerHistory': agent.buyerHistory.report() if agent.buyerHistory else None,
+        'fastPath': agent.conversation.offerParser.report() if args.classifier != 'stub' and agent.conversation.offerParser else None
+    }
+
+
+# *** percentile()
+# Nearest-rank percentile of an already sorted list (None if the list is empty)
+def percentile(values, fraction):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+# *** printReport()
+def printReport(report):
+    print("classifier:            ", report['classifier'] + (" (async replies)" if report['asyncReplies'] else ""))
+    print("messages:              ", report['messages'], "from", report['buyers'], "buyers,", report['errors'], "errors,",
+          report['relayed'], "replies relayed")
+    print("throughput:             %.1f messages/sec" % report['messagesPerSec'])
+    print("handling latency:       p50 %.3f ms, p99 %.3f ms" % (report['handleLatencyMs']['p50'], report['handleLatencyMs']['p99']))
+    if report['replyLatencyMs']['p50'] is not None:
+        print("reply latency:          p50 %.3f ms, p99 %.3f ms" % (report['replyLatencyMs']['p50'], report['replyLatencyMs']['p99']))
+    if report['bytesPerNegotiation'] is not None:
+        print("memory per negotiation: %.0f bytes (%d active)" % (report['bytesPerNegotiation'], report['activeNegotiations']))
+    if report['speculation']:
+        print("speculation:            %d replies matched (%d with a precomputed bid), %d missed" % (
+            report['speculation']['matched'], report['speculation']['bids'], report['speculation']['missed']))
+    if report['buyerHistory']:
+        print("buyer history:          %d buyers loaded, %d reloaded, %d flushes" % (
+            report['buyerHistory']['loads'], report['buyerHistory']['reloads'], report['buyerHistory']['flushes']))
+    if report['fastPath'] and report['fastPath']['hitRate'] is not None:
+        print("offer fast path:        %d messages parsed without the classifier, %d not (hit rate %.1f%%)" % (
+            report['fastPath']['hits'], report['fastPath']['misses'], 100 * report['fastPath']['hitRate']))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Simulate buyers negotiating with the agent, without any network services.')
+    parser.add_argument('--buyers', type=int, default=20, help='number of simulated buyers')
+    parser.add_argument('--negotiations', type=int, default=5, help='negotiations per buyer')
+    parser.add_argument('--concurrency', type=int, default=1, help='buyers negotiating at the same time')
+    parser.add_argument('--classifier', choices=['stub', 'local'], default='stub', help='stub lookup, or the local classifier')
+    parser.add_argument('--async', dest='async_', action='store_true', help='enable asynchronous replies')
+    parser.add_argument('--scripted', action='store_true', help='use scripted rather than randomized buyers')
+    parser.add_argument('--seed', type=int, default=1, help='random seed')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    parser.add_argument('--transcripts', help='directory in which to record the transcript of the round')
+    parser.add_argument('--speculate', action='store_true', help='enable speculative replies')
+    parser.add_argument('--profile', help='directory in which to write a profile of the round')
+    parser.add_argument('--history', help='keep buyer history in this file (carried over to the next simulation)')
+    args = parser.parse_args()
+    report = simulate(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        printReport(report)
@@ -0,0 +1,272 @@
+# Imports
+import importlib
+import json
+import logging
+import re
+import threading
+local_classifier = importlib.import_module('local-classifier')
+metrics = importlib.import_module('metrics')
+
+# Global variables / settings
+defaultCounterFractions = (0.25, 0.5, 0.75, 1.0) # counter-prices speculated on, as fractions of the way from the
+                                                  # buyer's last price to mine
+defaultMaxAge = 30.0 # seconds for which a speculation is trusted; the concession curve moves on after that
+pricePattern = re.compile(r'\$\s?(?P<a>\d+(?:\.\d+)?)|(?P<b>\d+(?:\.\d+)?)\s?(?:dollars?|bucks)\b')
+separatorPattern = re.compile(r"[^\w$'.]+")
+pricePlaceholder = '$#'
+# Counters that name nothing but a price, answered as counters on the bundle of my offer
+priceOnlyTemplates = {'$#', 'how about $#', 'what about $#', 'would you take $#', 'would you accept $#', "i'll give you $#",
+                      "i'll pay $#", "i'll pay you $#", 'i can pay $#', 'i can do $#', 'i offer $#', 'make it $#'}
+
+
+logger = logging.getLogger('agent-py.speculation')
+
+
+# *** Prediction
+# A matched follow-up: its kind (AcceptOffer, RejectOffer or BuyOffer), and for a counter the price and bundle
+class Prediction:
+    __slots__ = ('kind', 'price', 'quantity', 'speculation')
+
+    def __init__(self, kind, speculation, price=None, quantity=None):
+        self.kind = kind
+        self.speculation = speculation
+        self.price = price
+        self.quantity = quantity
+
+
+    # *** classification()
+    # Watson-style classification output for the message, as the classifier would have produced it
+    def classification(self, message):
+        entities = [{'entity': 'avatarName', 'value': self.speculation.agentName, 'confidence': 1}]
+        intent = self.kind
+        if self.kind == 'BuyOffer':
+            intent = 'Offer'
+            for good, amount in self.quantity.items():
+                entities.append({'entity': 'sys-number', 'value': str(amount), 'confidence': 1,
+                                 'metadata': {'numeric_value': amount}})
+                entities.append({'entity': 'good', 'value': good, 'confidence': 1})
+            entities.append({'entity': 'sys-currency', 'value': str(self.price), 'confidence': 1,
+                             'metadata': {'numeric_value': self.price, 'unit': self.speculation.unit}})
+        return {
+            'intents': [{'intent': intent, 'confidence': 1.0}],
+            'entities': entities,
+            'input': message,
+            'addressee': message['addressee'],
+            'speaker': message['speaker']
+        }
+
+
+# *** Speculation
+# What was speculated after my offer to one buyer: the offer and the buyer's previous price (so that a precomputed
+# bid is only used while the negotiation is where it was), the phrasings of a counter, and my bids for a grid of
+# counter-prices, keyed by price in cents, with the number of random draws each bid read ahead from position (the
+# random numbers the negotiation had used then)
+class Speculation:
+    __slots__ = ('agentName', 'quantity', 'ownPrice', 'buyerPrice', 'unit', 'templates', 'bids', 'position', 'createdAt')
+
+    def __init__(self, agentName, quantity, ownPrice, buyerPrice, unit, templates, position, createdAt):
+        self.agentName = agentName
+        self.quantity = quantity
+        self.ownPrice = ownPrice
+        self.buyerPrice = buyerPrice
+        self.unit = unit
+        self.templates = templates # counter template -> bundle
+        self.bids = {}  # cents -> (bid, draws)
+        self.position = position
+        self.createdAt = createdAt
+
+
+# *** Speculator
+# Speculative replies. After the agent sends a SellOffer, the buyer's next message is very often an accept, a reject,
+# or a counter-price on the same bundle. speculate() precomputes my bids for a small grid of counter-prices, and
+# match() recognizes those follow-ups without the classifier: accepts and rejects by the phrasings of the skill file,
+# and counters by the buyer's previous offer with only the price changed (or by a bare price, "How about $5?").
+# A matched message skips classification and, if its price is on the grid, the bidding decision as well.
+# Speculating runs on a worker thread of its own (see submit()), after the offer has been sent, so that it never delays
+# a reply.
+class Speculator:
+
+    def __init__(self, settings, skillFile=local_classifier.defaultSkillFile):
+        self.counterFractions = tuple(settings.get('counterFractions', defaultCounterFractions))
+        self.maxAge = settings.get('maxAge', defaultMaxAge)
+        self.speculations = {} # (environment UUID, buyer) -> Speculation
+        self.stats = {'matched': 0, 'missed': 0, 'bids': 0}
+        self.lock = threading.Lock()
+        self.tasks = {} # (environment UUID, buyer) -> speculation waiting for the worker, the newest one per buyer
+        self.running = 0
+        self.wakeup = threading.Condition(self.lock)
+        self.idle = threading.Condition(self.lock)
+        self.thread = threading.Thread(target=self.work, name='speculation-worker', daemon=True)
+        self.thread.start()
+        with open(skillFile) as f:
+            skill = json.load(f)
+        self.phrases = {} # normalized phrasing -> AcceptOffer or RejectOffer
+        for intent in skill.get('intents', []):
+            if intent['intent'] in ('AcceptOffer', 'RejectOffer'):
+                for example in intent.get('examples', []):
+                    if '@' not in example['text']:
+                        self.phrases[normalize(example['text'], ())] = intent['intent']
+
+
+    # *** submit()
+    # Queue a speculation (a function of no arguments) about the reply of a buyer, to run on the worker thread. It
+    # replaces a speculation about the same buyer that has not started yet, which would be out of date.
+    def submit(self, key, task):
+        with self.lock:
+            self.tasks.pop(key, None)
+            self.tasks[key] = task
+            self.wakeup.notify()
+
+
+    # *** work()
+    # Worker loop: run the queued speculations, oldest first. An error in one is logged and does not stop the loop.
+    def work(self):
+        while True:
+            with self.lock:
+                self.wakeup.wait_for(lambda: self.tasks)
+                key = next(iter(self.tasks))
+                task = self.tasks.pop(key)
+                self.running += 1
+            try:
+                task()
+            except Exception:
+                logger.exception("Error speculating on the reply of %s", key)
+            finally:
+                with self.lock:
+                    self.running -= 1
+                    self.idle.notify_all()
+
+
+    # *** drain()
+    # Wait until the queued speculations have run, or until the timeout (in seconds) expires. Returns True if none
+    # are left.
+    def drain(self, timeout=None):
+        with self.lock:
+            return self.idle.wait_for(lambda: not self.tasks and not self.running, timeout)
+
+
+    # *** counterPrices()
+    # The grid of counter-prices to speculate on, between the buyer's last price and mine
+    def counterPrices(self, buyerPrice, ownPrice):
+        return sorted({round(buyerPrice + fraction * (ownPrice - buyerPrice), 2) for fraction in self.counterFractions})
+
+
+    # *** store()
+    # Remember a speculation about the reply of a buyer to my offer, made after their message `message`.
+    # bids maps counter-prices to my precomputed bids and the random draws they read ahead of position.
+    def store(self, environmentUUID, message, offer, lastBuyerOffer, bids, position, now):
+        buyer = message['speaker']
+        names = (offer['speaker'], buyer)
+        quantity = offer['bid']['quantity']
+        templates = {}
+        text = normalize(message.get('text'), names)
+        prices = list(pricePattern.finditer(text))
+        if len(prices) == 1 and priceValue(prices[0]) == lastBuyerOffer.price:
+            templates[text[:prices[0].start()] + pricePlaceholder + text[prices[0].end():]] = lastBuyerOffer.quantityDict()
+        speculation = Speculation(offer['speaker'], quantity, offer['bid']['price']['value'], lastBuyerOffer.price,
+                                  offer['bid']['price']['unit'], templates, position, now)
+        speculation.bids = {cents(price): bid for price, bid in bids.items()}
+        with self.lock:
+            self.speculations[(environmentUUID, buyer)] = speculation
+
+
+    # *** match()
+    # The follow-up that a message from a buyer was speculated to be, or None. A speculation is used at most once.
+    def match(self, message, now):
+        key = (message.get('environmentUUID'), message.get('speaker'))
+        with self.lock:
+            speculation = self.speculations.get(key)
+            if speculation is None:
+                return None
+            if (now - speculation.createdAt > self.maxAge or message.get('role') != 'buyer'
+                    or message.get('addressee') not in (speculation.agentName, None, '')):
+                del self.speculations[key]
+                return None
+        prediction = self.predict(message, speculation)
+        with self.lock:
+            if self.speculations.get(key) is speculation:
+                del self.speculations[key]
+            self.stats['matched' if prediction else 'missed'] += 1
+        metrics.counter('agent_speculation_total', 'Messages from buyers with a speculated reply',
+                        outcome='matched' if prediction else 'missed').inc()
+        return prediction
+
+
+    # *** predict()
+    def predict(self, message, speculation):
+        text = normalize(message.get('text'), (speculation.agentName, message.get('speaker')))
+        kind = self.phrases.get(text)
+        if kind:
+            return Prediction(kind, speculation)
+        prices = list(pricePattern.finditer(text))
+        if len(prices) != 1:
+            return None
+        template = text[:prices[0].start()] + pricePlaceholder + text[prices[0].end():]
+        quantity = speculation.templates.get(template)
+        if quantity is None and template in priceOnlyTemplates:
+            quantity = speculation.quantity
+        if quantity is None:
+            return None
+        return Prediction('BuyOffer', speculation, priceValue(prices[0]), quantity)
+
+
+    # *** bid()
+    # My precomputed bid for a predicted counter, if the negotiation (its ledger, and the random numbers rng has used) is
+    # still where it was when it was speculated on; the random numbers that the bid read ahead are then used up.
+    # Call with the lock of the negotiation session held.
+    def bid(self, prediction, ledger, rng):
+        speculation = prediction.speculation
+        own, buyer = ledger.lastOwnOffer, ledger.lastBuyerOffer
+        if (prediction.kind != 'BuyOffer' or prediction.quantity != speculation.quantity or own is None or buyer is None
+                or own.price != speculation.ownPrice or own.quantityDict() != speculation.quantity
+                or buyer.price != speculation.buyerPrice or rng.position != speculation.position):
+            return None
+        bid, draws = speculation.bids.get(cents(prediction.price), (None, 0))
+        if bid is not None:
+            rng.advance(draws)
+            with self.lock:
+                self.stats['bids'] += 1
+            metrics.counter('agent_speculation_total', 'Messages from buyers with a speculated reply', outcome='bid').inc()
+            return json.loads(json.dumps(bid))
+        return None
+
+
+    # *** forget()
+    # Drop the speculations about an environment (all environments if environmentUUID is None), and those still
+    # queued, e.g. at a new round
+    def forget(self, environmentUUID=None):
+        with self.lock:
+            if environmentUUID is None:
+                self.speculations.clear()
+                self.tasks.clear()
+            else:
+                for held in (self.speculations, self.tasks):
+                    for key in [key for key in held if key[0] == environmentUUID]:
+                        del held[key]
+            self.idle.notify_all()
+
+
+    # *** report()
+    def report(self):
+        with self.lock:
+            return dict(self.stats, speculations=len(self.speculations), queued=len(self.tasks))
+
+
+# *** normalize()
+# A message text in lowercase, without the given names, with punctuation collapsed into spaces
+def normalize(text, names):
+    text = (text or '').lower()
+    for name in names:
+        if name:
+            text = re.sub(r'\b' + re.escape(name.lower()) + r'\b', ' ', text)
+    return separatorPattern.sub(' ', text).strip(" .'")
+
+
+# *** priceValue()
+def priceValue(match):
+    return float(match.group('a') or match.group('b'))
+
+
+# *** cents()
+def cents(price):
+    return int(round(price * 100))
@@ -0,0 +1,5 @@
+# The agent's modules have hyphenated file names and are loaded with importlib from the repository root
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
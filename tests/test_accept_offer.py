@@ -0,0 +1,36 @@
+# Imports
+import importlib
+simulate = importlib.import_module('simulate')
+agent_py = importlib.import_module('agent-py')
+extract_bid = importlib.import_module('extract-bid')
+
+utility = {
+    'egg': {'type': 'unitcost', 'unit': 'each', 'parameters': {'unitcost': 0.5}},
+    'milk': {'type': 'unitcost', 'unit': 'cup', 'parameters': {'unitcost': 1.0}}
+}
+
+
+def buyerMessage(text):
+    return {'text': text, 'speaker': 'Buyer1', 'addressee': 'Agent007', 'role': 'buyer', 'environmentUUID': 'abcdefg'}
+
+
+def test_accept_intent_is_interpreted_as_accept_offer():
+    watsonResponse = {'intents': [{'intent': 'AcceptOffer', 'confidence': 0.9}], 'entities': [],
+                      'input': buyerMessage("Agent007, I accept your offer")}
+    assert extract_bid.interpretMessage(watsonResponse)['type'] == 'AcceptOffer'
+
+
+def test_buyer_acceptance_closes_the_deal():
+    appSettings, assistantParams = simulate.agentSettings(9, 'local', False)
+    agent = agent_py.createAgents(appSettings, assistantParams)[0]
+    sent = []
+    agent.sendMessage = sent.append
+    client = agent.createApp().test_client()
+    client.post('/setUtility', json={'currencyUnit': 'USD', 'utility': utility, 'name': 'Agent007'})
+    client.post('/startRound', json={'roundDuration': 600, 'roundNumber': 1, 'seed': 7})
+    client.post('/receiveMessage', json=buyerMessage("Agent007, I'll give you $5 for 4 eggs and 2 cups of milk"))
+    assert sent[-1]['bid']['type'] == 'SellOffer'
+    counter = sent[-1]['bid']
+    client.post('/receiveMessage', json=buyerMessage("Agent007, I accept your offer"))
+    assert sent[-1]['bid']['type'] == 'Accept'
+    assert sent[-1]['bid']['price'] == counter['price'] and sent[-1]['bid']['quantity'] == counter['quantity']
@@ -0,0 +1,157 @@
+# Imports
+import importlib
+import threading
+admission_control = importlib.import_module('admission-control')
+utility_engine = importlib.import_module('utility-engine')
+simulate = importlib.import_module('simulate')
+agent_py = importlib.import_module('agent-py')
+
+utilityInfo = {'currencyUnit': 'USD', 'utility': {
+    'egg': {'type': 'unitcost', 'unit': 'each', 'parameters': {'unitcost': 0.5}},
+    'milk': {'type': 'unitcost', 'unit': 'cup', 'parameters': {'unitcost': 1.0}}
+}}
+
+
+def message(text, addressee):
+    return {'text': text, 'speaker': 'Buyer1', 'addressee': addressee, 'role': 'buyer', 'environmentUUID': 'env'}
+
+
+def loadAgent():
+    appSettings, assistantParams = simulate.agentSettings(9, 'local', False, admission={'enabled': True})
+    agent = agent_py.createAgents(appSettings, assistantParams)[0]
+    environment = agent.negotiationStore.registerEnvironment('env')
+    environment.agentName = simulate.agentName
+    environment.utilityEngine = utility_engine.compileUtility(utilityInfo)
+    environment.negotiationState.update({'active': True, 'startTime': 0, 'stopTime': 600000, 'roundDuration': 600})
+    agent.clock = lambda: 0.0
+    return agent
+
+
+def test_only_newer_messages_that_supersede_count():
+    admission = admission_control.AdmissionControl({}, lambda: 0.0)
+    key = ('env', 'Buyer1')
+    older, newer = message('a', 'Agent007'), message('b', 'Agent007')
+    assert admission.admit(key, older) is None and admission.admit(key, newer) is None
+    assert not admission.superseded(key, older, lambda m: False)
+    assert admission.superseded(key, older, lambda m: m is newer)
+    assert not admission.superseded(key, newer, lambda m: True)
+    admission.finish(key, newer)
+    assert not admission.superseded(key, older, lambda m: True)
+
+
+def test_offer_is_answered_when_the_newer_message_is_for_another_seller():
+    agent = loadAgent()
+    key = ('env', 'Buyer1')
+    offer = message("Agent007, I'll give you $4 for 4 eggs and 2 cups of milk", 'Agent007')
+    aside = message("Watson, I'll give you $3 for 4 eggs and 2 cups of milk", 'Watson')
+    assert agent.admission.admit(key, offer) is None and agent.admission.admit(key, aside) is None
+    reply = agent.processMessage(offer)
+    assert reply is not None and reply['bid']['type'] in ('SellOffer', 'Accept')
+    assert agent.admission.report()['coalesced'] == 0
+
+
+def test_offer_is_coalesced_when_the_buyer_makes_a_newer_offer():
+    agent = loadAgent()
+    key = ('env', 'Buyer1')
+    offer = message("Agent007, I'll give you $4 for 4 eggs and 2 cups of milk", 'Agent007')
+    newer = message("Agent007, I'll give you $5 for 4 eggs and 2 cups of milk", 'Agent007')
+    assert agent.admission.admit(key, offer) is None and agent.admission.admit(key, newer) is None
+    assert agent.processMessage(offer) is None
+    assert agent.admission.report()['coalesced'] == 1
+
+
+def test_newer_messages_are_classified_without_the_session_lock():
+    agent = loadAgent()
+    key = ('env', 'Buyer1')
+    offer = message("Agent007, I'll give you $4 for 4 eggs and 2 cups of milk", 'Agent007')
+    newer = message("Agent007, I'll give you $5 for 4 eggs and 2 cups of milk", 'Agent007')
+    assert agent.admission.admit(key, offer) is None and agent.admission.admit(key, newer) is None
+    session = agent.negotiationStore.session('env', 'Buyer1')
+    classifyMessage = agent.conversation.classifyMessage
+    locked = []
+    def checkingClassify(message):
+        free = []
+        def tryLock():
+            free.append(session.lock.acquire(blocking=False))
+            if free[0]:
+                session.lock.release()
+        thread = threading.Thread(target=tryLock)
+        thread.start()
+        thread.join()
+        locked.append(not free[0])
+        return classifyMessage(message)
+    agent.conversation.classifyMessage = checkingClassify
+    assert agent.processMessage(offer) is None
+    assert locked and not any(locked)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_speaker_is_deferred_beyond_its_burst_until_tokens_refill():
+    clock = Clock()
+    admission = admission_control.AdmissionControl({'perSpeaker': {'rate': 2, 'burst': 3}}, clock)
+    key, other = ('env', 'Buyer1'), ('env', 'Buyer2')
+    for _ in range(3):
+        assert admission.admit(key, message('offer', 'Agent007')) is None
+    assert admission.admit(key, message('offer', 'Agent007')) == ('too many messages from Buyer1', 0.5)
+    assert admission.admit(other, message('offer', 'Agent007')) is None # Other buyers have their own bucket
+    clock.now = 0.5
+    assert admission.admit(key, message('offer', 'Agent007')) is None
+    report = admission.report()
+    assert report['admitted'] == 5 and report['deferred']['speakerRate'] == 1 and report['speakers'] == 2
+
+
+def test_all_speakers_share_the_global_limit():
+    clock = Clock()
+    admission = admission_control.AdmissionControl({'global': {'rate': 4, 'burst': 2}}, clock)
+    assert admission.admit(('env', 'Buyer1'), message('a', 'Agent007')) is None
+    assert admission.admit(('env', 'Buyer2'), message('b', 'Agent007')) is None
+    assert admission.admit(('env', 'Buyer3'), message('c', 'Agent007')) == ('too many messages', 0.25)
+    assert admission.report()['deferred']['globalRate'] == 1
+
+
+def test_messages_in_flight_are_bounded_until_finished():
+    admission = admission_control.AdmissionControl({'maxInFlight': 2}, Clock())
+    key = ('env', 'Buyer1')
+    first, second = message('a', 'Agent007'), message('b', 'Agent007')
+    assert admission.admit(key, first) is None and admission.admit(key, second) is None
+    assert admission.admit(key, message('c', 'Agent007')) == ('too many messages in flight', admission_control.inFlightRetryAfter)
+    admission.finish(key, first)
+    assert admission.report()['inFlight'] == 1
+    assert admission.admit(key, message('c', 'Agent007')) is None
+
+
+def test_quiet_speakers_are_pruned_when_there_are_too_many():
+    clock = Clock()
+    admission = admission_control.AdmissionControl({'maxSpeakers': 2, 'perSpeaker': {'rate': 1, 'burst': 1}}, clock)
+    for buyer in ('Buyer1', 'Buyer2'):
+        key = ('env', buyer)
+        msg = message('a', 'Agent007')
+        admission.admit(key, msg)
+        admission.finish(key, msg)
+    clock.now = 10.0
+    admission.admit(('env', 'Buyer3'), message('a', 'Agent007'))
+    assert admission.report()['speakers'] == 1
+
+
+def test_receive_message_defers_with_429_and_retry_after():
+    agent = loadAgent()
+    agent.admission = admission_control.AdmissionControl({'perSpeaker': {'rate': 0.4, 'burst': 1}}, Clock())
+    agent.sendMessage = lambda reply: None
+    client = agent.createApp().test_client()
+    offer = message("Agent007, I'll give you $4 for 4 eggs and 2 cups of milk", 'Agent007')
+    assert client.post('/receiveMessage', json=offer).get_json()['status'] == 'Acknowledged'
+    response = client.post('/receiveMessage', json=offer)
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '3'
+    assert response.get_json() == {'status': 'Deferred; too many messages from Buyer1', 'retryAfter': 2.5}
+    own = dict(offer, speaker=simulate.agentName, role='seller') # The agent's own messages are never deferred
+    assert client.post('/receiveMessage', json=own).status_code == 200
+    stats = client.get('/admissionStats').get_json()
+    assert stats['admitted'] == 1 and stats['deferred']['speakerRate'] == 1 and stats['inFlight'] == 0
@@ -0,0 +1,31 @@
+# Imports
+import importlib
+bid_ledger = importlib.import_module('bid-ledger')
+
+
+def interpretation(type_, speaker, quantity, price):
+    return {'type': type_, 'quantity': quantity, 'price': price and {'value': price, 'unit': 'USD'},
+            'metadata': {'speaker': speaker, 'timeStamp': 1.0}}
+
+
+def test_latest_offer_of_each_side_is_indexed():
+    ledger = bid_ledger.BidLedger()
+    ledger.addInterpretation(interpretation('BuyRequest', 'Buyer1', {'egg': 2}, None))
+    ledger.add('SellOffer', 'Agent007', {'egg': 2}, {'value': 4.0, 'unit': 'USD'}, 2.0)
+    ledger.addInterpretation(interpretation('BuyOffer', 'Buyer1', {'egg': 2}, 3.0))
+    ledger.addInterpretation(interpretation('Information', 'Buyer1', None, None))
+    assert len(ledger) == 4
+    assert ledger.lastOwnOffer.priceDict() == {'value': 4.0, 'unit': 'USD'}
+    assert ledger.lastBuyerOffer.price == 3.0 and ledger.lastBuyerOffer.quantityDict() == {'egg': 2}
+    ledger.clear()
+    assert len(ledger) == 0 and ledger.lastOwnOffer is None and ledger.lastBuyerOffer is None
+
+
+def test_only_recent_records_are_kept():
+    ledger = bid_ledger.BidLedger()
+    for i in range(bid_ledger.maxLedgerRecords + 10):
+        ledger.add('BuyOffer', 'Buyer1', {'egg': 1}, {'value': float(i), 'unit': 'USD'}, float(i))
+    assert len(ledger) == bid_ledger.maxLedgerRecords
+    assert ledger.records[0].price == 10.0
+    assert ledger.lastBuyerOffer.price == bid_ledger.maxLedgerRecords + 9
+    assert ledger.lastBuyerOffer.priceDict()['unit'] == 'USD' and ledger.records[0].priceDict()['value'] == 10.0
@@ -0,0 +1,21 @@
+# Imports
+import importlib
+buyer_history = importlib.import_module('buyer-history')
+
+
+def test_history_is_preloaded_and_lookups_do_not_read_the_file(tmp_path, monkeypatch):
+    settings = {'file': str(tmp_path / 'history.sqlite3')}
+    history = buyer_history.BuyerHistory(settings)
+    history.observeDeal('Jeff', 0.4)
+    history.observeOffer('Jeff', 0.2, 0.1)
+    history.close()
+
+    history = buyer_history.BuyerHistory(settings)
+    history.close()
+    def noFile(*args, **kwargs):
+        raise AssertionError("the history file was read on lookup")
+    monkeypatch.setattr(buyer_history.sqlite3, 'connect', noFile)
+    jeff = history.lookup('Jeff')
+    assert (jeff.offers, jeff.deals, jeff.concessions) == (1, 1, 1)
+    assert history.lookup('Celia').offers == 0
+    assert history.report()['loads'] == 1
@@ -0,0 +1,86 @@
+# Imports
+import copy
+import importlib
+import os
+classification_cache = importlib.import_module('classification-cache')
+local_classifier = importlib.import_module('local-classifier')
+conversation = importlib.import_module('conversation')
+extract_bid = importlib.import_module('extract-bid')
+
+skillFile = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'skill-HUMAINE-agent-v2.json')
+classifier = local_classifier.LocalClassifier.fromSkillFile(skillFile, ['Agent007'])
+
+
+def classify(input_):
+    return conversation.translateWatsonResponse({'output': classifier.classify(input_['text'])}, input_)
+
+
+def message(addressee):
+    return {'text': addressee + ", I'll give you $5 for 2 eggs and 1 cup of milk", 'speaker': 'Buyer1',
+            'addressee': addressee, 'role': 'buyer', 'environmentUUID': 'env'}
+
+
+def interpret(classification):
+    classification['environmentUUID'] = 'env'
+    interpretation = extract_bid.interpretMessage(classification)
+    del interpretation['metadata']['timeStamp']
+    return interpretation
+
+
+def test_hit_for_another_addressee_matches_a_miss():
+    cache = classification_cache.ClassificationCache(names=['Celia', 'Watson', 'Agent007'])
+    cache.put(message('Celia'), classify(message('Celia')))
+    input_ = message('Agent007')
+    hit = cache.get(input_)
+    assert hit is not None
+    hit = conversation.translateWatsonResponse({'output': hit}, input_)
+    miss = classify(copy.deepcopy(input_))
+    assert interpret(hit) == interpret(miss)
+    assert [(e['entity'], e['location']) for e in hit['entities']] == \
+           [(e['entity'], e['location']) for e in miss['entities']]
+
+
+def test_miss_then_hit_ignoring_case_whitespace_and_names():
+    cache = classification_cache.ClassificationCache(names=['Celia', 'Watson', 'Agent007'])
+    first = message('Celia')
+    assert cache.get(first) is None
+    cache.put(first, classify(first))
+    again = dict(message('Watson'), text="watson,   I'll give you $5 for 2 EGGS and 1 cup of milk")
+    assert cache.get(again) is not None
+    assert cache.get(dict(first, text="Celia, I'll give you $6 for 2 eggs and 1 cup of milk")) is None
+    report = cache.report()
+    assert (report['hits'], report['misses'], report['size']) == (1, 2, 1)
+    assert report['hitRate'] == 1 / 3
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = classification_cache.ClassificationCache(maxSize=2)
+    texts = [dict(message('Celia'), text=text) for text in ('one', 'two', 'three')]
+    cache.put(texts[0], classify(texts[0]))
+    cache.put(texts[1], classify(texts[1]))
+    assert cache.get(texts[0]) is not None # now the most recently used
+    cache.put(texts[2], classify(texts[2]))
+    assert cache.get(texts[1]) is None
+    assert cache.get(texts[0]) is not None and cache.get(texts[2]) is not None
+    assert cache.report()['evictions'] == 1
+
+
+def test_expired_entries_miss():
+    cache = classification_cache.ClassificationCache(ttl=60)
+    input_ = message('Celia')
+    cache.put(input_, classify(input_))
+    key = next(iter(cache.entries))
+    storedAt, output = cache.entries[key]
+    cache.entries[key] = (storedAt - 61, output)
+    assert cache.get(input_) is None
+    assert cache.report()['expirations'] == 1
+
+
+def test_saved_entries_are_loaded_warm(tmp_path):
+    persistFile = str(tmp_path / 'cache.json')
+    cache = classification_cache.ClassificationCache(persistFile=persistFile)
+    input_ = message('Celia')
+    cache.put(input_, classify(input_))
+    cache.save()
+    warm = classification_cache.ClassificationCache(persistFile=persistFile)
+    assert warm.get(input_)['intents'] == cache.get(input_)['intents']
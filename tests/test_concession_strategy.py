@@ -0,0 +1,29 @@
+# Imports
+import importlib
+import pytest
+concession_strategy = importlib.import_module('concession-strategy')
+simulate = importlib.import_module('simulate')
+agent_py = importlib.import_module('agent-py')
+
+
+@pytest.mark.parametrize('name, params', [
+    ('boulware', {'beta': 0}),
+    ('conceder', {'beta': -1}),
+    ('linear', {'jitter': 2}),
+    ('titForTat', {'minMarkup': 'lots'}),
+    ('opponentModel', {'expectedOffers': float('nan')}),
+    ('linear', [0.5])
+])
+def test_out_of_range_parameters_are_rejected(name, params):
+    with pytest.raises(ValueError):
+        concession_strategy.createStrategy({'name': name, 'params': params}, 600)
+
+
+def test_set_strategy_reports_out_of_range_parameters():
+    appSettings, assistantParams = simulate.agentSettings(9, 'local', False)
+    agent = agent_py.createAgents(appSettings, assistantParams)[0]
+    client = agent.createApp().test_client()
+    response = client.post('/setStrategy', json={'name': 'boulware', 'params': {'beta': 0}})
+    assert response.status_code == 200
+    assert response.json['status'] == "Failed; parameter beta of strategy boulware must be greater than 0, not 0.0"
+    assert client.get('/strategy').json['name'] == 'linear'
@@ -0,0 +1,59 @@
+# Imports
+import importlib
+deal_stealing = importlib.import_module('deal-stealing')
+utility_engine = importlib.import_module('utility-engine')
+simulate = importlib.import_module('simulate')
+agent_py = importlib.import_module('agent-py')
+
+utilityInfo = {'currencyUnit': 'USD', 'utility': {
+    'egg': {'type': 'unitcost', 'unit': 'each', 'parameters': {'unitcost': 0.5}}
+}}
+
+
+def test_competitor_markups_are_averaged_per_seller():
+    competitors = deal_stealing.CompetitorModel(smoothing=0.5)
+    competitors.observe('Celia', 2.0, 4.0, 1.0)  # markup 1.0
+    competitors.observe('Celia', 2.0, 3.0, 2.0)  # markup 0.5
+    competitors.observe('Watson', 2.0, 5.0, 3.0) # markup 1.5
+    assert competitors.expectedMarkup('Celia') == 0.75
+    assert competitors.expectedMarkup() == 0.75
+    assert competitors.expectedMarkup('Nobody') is None
+    assert competitors.report()['competitors']['Celia']['minMarkup'] == 0.5
+
+
+def test_policy_undercuts_only_above_the_floor():
+    policy = deal_stealing.StealPolicy({'undercutRatio': 0.1, 'minMarkupRatio': 0.2})
+    assert policy.price(2.0, 4.0) == 3.6
+    assert policy.price(2.0, 2.5) is None # 2.25 would be below 1.2 x cost
+
+
+def test_policy_limits_attempts_per_buyer():
+    policy = deal_stealing.StealPolicy({'cooldownSeconds': 10, 'maxAttemptsPerBuyer': 2, 'latencyBudgetMs': 500})
+    competitors = deal_stealing.CompetitorModel()
+    assert not policy.admit(competitors, 'Buyer1', 100.0, 99.0) # The message is too old
+    assert policy.admit(competitors, 'Buyer1', 100.0, 100.0)
+    assert not policy.admit(competitors, 'Buyer1', 105.0, None) # Cooling down
+    assert policy.admit(competitors, 'Buyer1', 111.0, None)
+    assert not policy.admit(competitors, 'Buyer1', 200.0, None) # Out of attempts for the round
+    competitors.newRound()
+    assert policy.admit(competitors, 'Buyer1', 300.0, None)
+
+
+def test_overheard_seller_offer_is_undercut_and_confirmable():
+    appSettings, assistantParams = simulate.agentSettings(9, 'local', False)
+    appSettings['dealStealing'] = {'enabled': True, 'undercutRatio': 0.1, 'minMarkupRatio': 0.2}
+    agent = agent_py.createAgents(appSettings, assistantParams)[0]
+    environment = agent.negotiationStore.defaultEnvironment
+    environment.utilityEngine = utility_engine.compileUtility(utilityInfo)
+    agent.clock = lambda: 100.0
+    interpretation = {'type': 'SellOffer', 'quantity': {'egg': 4}, 'price': {'value': 4.0, 'unit': 'USD'},
+                      'metadata': {'speaker': 'Celia', 'addressee': 'Buyer1', 'role': 'seller', 'environmentUUID': None,
+                                   'timestamp': 100000.0}}
+    reply = agent.stealDeal(interpretation, environment)
+    assert reply['addressee'] == 'Buyer1' and reply['speaker'] == environment.agentName
+    assert reply['bid'] == {'type': 'SellOffer', 'quantity': {'egg': 4}, 'price': {'unit': 'USD', 'value': 3.6}}
+    assert environment.competitors.expectedMarkup('Celia') == 1.0
+    session = agent.negotiationStore.findSession(None, 'Buyer1')
+    assert session.ledger.lastOwnOffer.price == 3.6
+    interpretation['price']['value'] = 2.2 # Undercutting this would go below the floor
+    assert agent.stealDeal(interpretation, environment) is None
@@ -0,0 +1,58 @@
+# Imports
+import importlib
+simulate = importlib.import_module('simulate')
+agent_py = importlib.import_module('agent-py')
+
+utility = {
+    'egg': {'type': 'unitcost', 'unit': 'each', 'parameters': {'unitcost': 0.5}},
+    'milk': {'type': 'unitcost', 'unit': 'cup', 'parameters': {'unitcost': 1.0}}
+}
+offer = {'text': "Agent007, I'll give you $5 for 4 eggs and 2 cups of milk", 'speaker': 'Buyer1', 'addressee': 'Agent007',
+         'role': 'buyer', 'environmentUUID': 'abcdefg'}
+
+
+def loadAgent():
+    appSettings, assistantParams = simulate.agentSettings(9, 'local', False)
+    agent = agent_py.createAgents(appSettings, assistantParams)[0]
+    sent = []
+    agent.sendMessage = sent.append
+    return agent, agent.createApp().test_client(), sent
+
+
+def test_utility_for_the_environment_and_round_without_one():
+    agent, client, sent = loadAgent()
+    client.post('/setUtility', json={'currencyUnit': 'USD', 'utility': utility, 'name': 'Agent007',
+                                     'environmentUUID': 'abcdefg'})
+    client.post('/startRound', json={'roundDuration': 600, 'roundNumber': 1})
+    response = client.post('/receiveMessage', json=dict(offer))
+    assert response.status_code == 200 and response.json['status'] == 'Acknowledged'
+    assert sent and sent[0]['bid']['type'] in ('SellOffer', 'Accept')
+
+
+def test_round_for_the_environment_and_utility_without_one():
+    agent, client, sent = loadAgent()
+    client.post('/setUtility', json={'currencyUnit': 'USD', 'utility': utility, 'name': 'Agent007'})
+    client.post('/startRound', json={'roundDuration': 600, 'roundNumber': 1, 'environmentUUID': 'abcdefg'})
+    response = client.post('/receiveMessage', json=dict(offer))
+    assert response.status_code == 200 and response.json['status'] == 'Acknowledged'
+    assert sent and sent[0]['bid']['type'] in ('SellOffer', 'Accept')
+
+
+def test_offer_without_any_utility_fails_without_an_error():
+    agent, client, sent = loadAgent()
+    client.post('/startRound', json={'roundDuration': 600, 'roundNumber': 1, 'environmentUUID': 'abcdefg'})
+    response = client.post('/receiveMessage', json=dict(offer))
+    assert response.status_code == 200 and response.json['status'].startswith('Failed')
+    assert not sent
+
+
+def test_round_with_a_malformed_start_time_is_not_started():
+    agent, client, sent = loadAgent()
+    client.post('/setUtility', json={'currencyUnit': 'USD', 'utility': utility, 'name': 'Agent007'})
+    response = client.post('/startRound', json={'roundDuration': 600, 'roundNumber': 1, 'startTime': 'soon'})
+    assert response.status_code == 200 and response.json['status'] == 'Failed; startTime must be a number, not "soon"'
+    assert not agent.negotiationStore.environment(None).negotiationState['active']
+    response = client.post('/startRound', json={'roundDuration': '600', 'roundNumber': 1, 'startTime': '0'})
+    assert response.json['status'] == 'Acknowledged'
+    negotiationState = agent.negotiationStore.environment(None).negotiationState
+    assert negotiationState['active'] and negotiationState['roundDuration'] == 600
@@ -0,0 +1,44 @@
+# Imports
+import importlib
+import io
+import json
+simulate = importlib.import_module('simulate')
+agent_py = importlib.import_module('agent-py')
+extract_bid = importlib.import_module('extract-bid')
+
+lines = [json.dumps({'text': "I'll give you $5 for 2 eggs", 'role': 'buyer'}), 'notjson', '',
+         json.dumps({'text': "I accept", 'role': 'buyer'})]
+defaults = {'speaker': 'Jeff', 'addressee': None, 'role': 'buyer', 'environmentUUID': 'abcdefg'}
+
+
+def loadAgent():
+    appSettings, assistantParams = simulate.agentSettings(9, 'local', False)
+    return agent_py.createAgents(appSettings, assistantParams)[0]
+
+
+def test_malformed_line_is_reported_in_order():
+    agent = loadAgent()
+    messages = extract_bid.readMessageLines(io.StringIO('\n'.join(lines) + '\n'), defaults)
+    results = list(extract_bid.extractBidsFromMessages(messages, agent.conversation, 2))
+    assert [error is None for _, _, error in results] == [True, False, True]
+    assert results[1][0] == 'notjson' and results[1][2].startswith('invalid JSON')
+    assert results[0][1]['type'] == 'BuyOffer' and results[2][1]['type'] == 'AcceptOffer'
+
+
+def test_extract_bids_route_streams_lines():
+    agent = loadAgent()
+    client = agent.createApp().test_client()
+    response = client.post('/extractBids', data='\n'.join(lines) + '\n', content_type='application/x-ndjson')
+    results = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert len(results) == 3
+    assert results[0]['bid']['type'] == 'BuyOffer'
+    assert results[1] == {'message': 'notjson', 'error': results[1]['error']}
+    assert results[2]['bid']['type'] == 'AcceptOffer'
+
+
+def test_extract_bids_route_reads_arrays():
+    agent = loadAgent()
+    client = agent.createApp().test_client()
+    response = client.post('/extractBids', json=[{'text': "I accept"}, 5])
+    results = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert results[0]['bid']['type'] == 'AcceptOffer' and 'error' in results[1]
@@ -0,0 +1,28 @@
+# Imports
+import importlib
+import os
+import pytest
+local_classifier = importlib.import_module('local-classifier')
+
+skillFile = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'skill-HUMAINE-agent-v2.json')
+classifier = local_classifier.LocalClassifier.fromSkillFile(skillFile)
+threshold = 0.5 # localConfidenceThreshold in assistantParams.json.template
+
+
+@pytest.mark.parametrize('text', ["That is too expensive", "That's too much", "That's a rip-off", "I can't afford that",
+                                  "No way, too expensive", "No thanks", "No deal.", "I reject your offer"])
+def test_rejections_are_never_confident_accepts(text):
+    top = classifier.classify(text)['intents'][0]
+    assert not (top['intent'] == 'AcceptOffer' and top['confidence'] >= threshold)
+
+
+@pytest.mark.parametrize('text', ["No way, too expensive", "No thanks", "I reject your offer"])
+def test_clear_rejections_are_confident(text):
+    top = classifier.classify(text)['intents'][0]
+    assert top['intent'] == 'RejectOffer' and top['confidence'] >= threshold
+
+
+@pytest.mark.parametrize('text', ["I accept", "It's a deal"])
+def test_clear_acceptances_are_confident(text):
+    top = classifier.classify(text)['intents'][0]
+    assert top['intent'] == 'AcceptOffer' and top['confidence'] >= threshold
@@ -0,0 +1,94 @@
+# Imports
+import importlib
+import json
+import os
+import pytest
+message_templates = importlib.import_module('message-templates')
+negotiation_random = importlib.import_module('negotiation-random')
+
+phraseFile = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'phrases.json')
+offer = {'type': 'SellOffer', 'price': {'unit': 'USD', 'value': 4.5}, 'quantity': {'egg': 2, 'milk': 1}}
+accept = dict(offer, type='Accept')
+
+
+class Fixed:
+    def __init__(self, value):
+        self.value = value
+
+    def random(self):
+        return self.value
+
+
+class Counting:
+    def __init__(self):
+        self.draws = 0
+
+    def random(self):
+        self.draws += 1
+        return 0.0
+
+
+def test_offer_renders_bundle_price_and_unit():
+    assert message_templates.PhraseSet('default').render(offer, False, Fixed(0.0)) == \
+        "How about if I sell you 2 egg 1 milk for 4.5 USD."
+
+
+def test_offer_with_one_phrasing_draws_nothing():
+    rng = Counting()
+    message_templates.PhraseSet('default').render(offer, False, rng)
+    assert rng.draws == 0
+
+
+def test_accept_picks_a_phrasing_with_one_draw_and_confirm_switches_kind():
+    phrases = message_templates.PhraseSet('default')
+    rng = Counting()
+    assert phrases.render(accept, False, rng).startswith("You've got a deal!")
+    assert rng.draws == 1
+    assert phrases.render(accept, False, Fixed(0.99)).startswith("I accept your offer.")
+    assert phrases.render(accept, True, Fixed(0.0)).startswith("I confirm that I'm selling you")
+
+
+def test_same_seed_renders_the_same_text():
+    phrases = message_templates.PhraseSet('default')
+    first = negotiation_random.NegotiationRandom(7)
+    second = negotiation_random.NegotiationRandom(7)
+    assert [phrases.render(accept, False, first) for _ in range(10)] == \
+           [phrases.render(accept, False, second) for _ in range(10)]
+
+
+def test_unknown_bid_type_renders_nothing():
+    assert message_templates.PhraseSet('default').render({'type': 'Information'}, False, Fixed(0.0)) == ""
+
+
+def test_phrase_set_overrides_separator_item_and_decimal_mark():
+    phrases = message_templates.PhraseSet('custom', {'offer': ["{bundle} = {price}{unit}"], 'bundleSeparator': " & ",
+                                                     'bundleItem': "{good} x{amount}", 'decimalMark': ","})
+    assert phrases.render(offer, False, Fixed(0.0)) == "egg x2 & milk x1 = 4,5USD"
+    assert phrases.render({'type': 'Reject'}, False, Fixed(0.0)) == "No thanks. Your offer is much too low for me to consider."
+
+
+def test_unknown_field_is_rejected_when_loaded():
+    with pytest.raises(ValueError, match='unknown field cost'):
+        message_templates.PhraseSet('bad', {'offer': ["{bundle} for {cost}"]})
+    with pytest.raises(ValueError, match='unknown field colour'):
+        message_templates.PhraseSet('bad', {'bundleItem': "{amount} {colour} {good}"})
+
+
+def test_empty_phrasings_are_rejected():
+    with pytest.raises(ValueError, match='no reject phrasings'):
+        message_templates.PhraseSet('bad', {'reject': []})
+
+
+def test_load_phrase_set_from_file():
+    assert message_templates.loadPhraseSet({}).name == 'default'
+    terse = message_templates.loadPhraseSet({'phraseSet': 'terse', 'phraseFile': phraseFile})
+    assert terse.render(offer, False, Fixed(0.0)) == "2 egg, 1 milk: 4.5 USD."
+    assert terse.render(accept, True, Fixed(0.0)) == "Confirmed: 2 egg, 1 milk for 4.5 USD."
+    assert message_templates.loadPhraseSet({'phraseFile': phraseFile}).name == 'default'
+
+
+def test_load_missing_phrase_set_fails(tmp_path):
+    path = tmp_path / 'phrases.json'
+    path.write_text(json.dumps({'terse': {}}))
+    with pytest.raises(ValueError, match='no phrase set pirate'):
+        message_templates.loadPhraseSet({'phraseSet': 'pirate', 'phraseFile': str(path)})
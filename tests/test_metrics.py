@@ -0,0 +1,62 @@
+# Imports
+import importlib
+metrics = importlib.import_module('metrics')
+simulate = importlib.import_module('simulate')
+
+
+def test_samples_of_a_metric_are_contiguous_across_collectors(monkeypatch):
+    monkeypatch.setattr(metrics, 'collectors', [])
+    for agent in ('Agent1', 'Agent2'):
+        metrics.addCollector(lambda agent=agent: [
+            ('test_queue_depth', 'gauge', 'Queue depth', {'agent': agent}, 1),
+            ('test_processed_total', 'counter', 'Messages processed', {'agent': agent}, 2)])
+    names = []
+    for line in metrics.render().splitlines():
+        if line.startswith('# TYPE '):
+            names.append(line.split()[2])
+        elif not line.startswith('#'):
+            assert line.split('{')[0].split(' ')[0].startswith(names[-1])
+    assert names.count('test_queue_depth') == 1 and names.count('test_processed_total') == 1
+
+
+def test_timed_functions_are_observed_even_when_they_raise():
+    @metrics.timed('testTimed')
+    def work(fail):
+        if fail:
+            raise ValueError("failed")
+        return 'done'
+    observed = metrics.histogram('agent_function_duration_seconds', 'Duration of hot-path function calls',
+                                 function='testTimed')
+    assert work(False) == 'done'
+    try:
+        work(True)
+    except ValueError:
+        pass
+    assert observed.count == 2
+    assert sum(observed.counts) == 2 and observed.sum >= 0
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = metrics.Histogram(buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        histogram.observe(value)
+    lines = histogram.samples('test_seconds', (('function', 'f'),))
+    assert lines[:3] == ['test_seconds_bucket{function="f",le="0.1"} 1', 'test_seconds_bucket{function="f",le="1.0"} 2',
+                         'test_seconds_bucket{function="f",le="+Inf"} 3']
+    assert lines[-1] == 'test_seconds_count{function="f"} 3'
+
+
+def test_counters_are_labelled_and_escaped():
+    metrics.counter('test_events_total', 'Events', outcome='say "hi"').inc(2)
+    assert 'test_events_total{outcome="say \\"hi\\""} 2' in metrics.render().splitlines()
+
+
+def test_metrics_route_reports_hot_path_histograms():
+    agent = simulate.loadAgent(9, 'local', False)
+    client = agent.createApp().test_client()
+    client.get('/classifyMessage?text=I%20accept')
+    response = client.get('/metrics')
+    assert response.status_code == 200 and response.mimetype == 'text/plain'
+    text = response.get_data(as_text=True)
+    assert '# TYPE agent_function_duration_seconds histogram' in text
+    assert 'agent_function_duration_seconds_count{function="classifyMessage"}' in text
@@ -0,0 +1,92 @@
+# Imports
+import importlib
+negotiation_random = importlib.import_module('negotiation-random')
+simulate = importlib.import_module('simulate')
+agent_py = importlib.import_module('agent-py')
+
+utility = {
+    'egg': {'type': 'unitcost', 'unit': 'each', 'parameters': {'unitcost': 0.5}},
+    'milk': {'type': 'unitcost', 'unit': 'cup', 'parameters': {'unitcost': 1.0}},
+    'sugar': {'type': 'unitcost', 'unit': 'cup', 'parameters': {'unitcost': 0.75}}
+}
+offers = ["I'll give you $3 for 4 eggs and 2 cups of milk", "How about $4 for 4 eggs and 2 cups of milk",
+          "$2 for 1 cup of sugar", "I'll pay $5 for 4 eggs, 2 cups of milk and 1 cup of sugar"]
+
+
+def test_negotiation_seed_depends_on_every_part():
+    seed = negotiation_random.negotiationSeed(7, 1, 'env', 'Buyer1')
+    assert seed == negotiation_random.negotiationSeed(7, 1, 'env', 'Buyer1')
+    assert len({seed, negotiation_random.negotiationSeed(8, 1, 'env', 'Buyer1'),
+                negotiation_random.negotiationSeed(7, 2, 'env', 'Buyer1'),
+                negotiation_random.negotiationSeed(7, 1, 'other', 'Buyer1'),
+                negotiation_random.negotiationSeed(7, 1, 'env', 'Buyer2')}) == 5
+
+
+def test_batches_and_prefill_do_not_change_the_sequence():
+    small = negotiation_random.NegotiationRandom(42, batchSize=1)
+    large = negotiation_random.NegotiationRandom(42, batchSize=64)
+    values = []
+    for i in range(200):
+        values.append(small.random())
+        if i % 3 == 0:
+            small.prefill()
+    assert values == [large.random() for _ in range(200)]
+    assert small.position == large.position == 200
+
+
+def test_lookahead_then_advance_matches_drawing_directly():
+    drawn = negotiation_random.NegotiationRandom(5, batchSize=2)
+    looked = negotiation_random.NegotiationRandom(5, batchSize=2)
+    expected = [drawn.random() for _ in range(8)]
+    assert looked.random() == expected[0]
+    lookahead = looked.lookahead()
+    assert [lookahead.random() for _ in range(5)] == expected[1:6]
+    assert looked.position == 1
+    looked.advance(lookahead.draws)
+    assert looked.position == 6
+    assert [looked.random(), looked.random()] == expected[6:8]
+
+
+def test_unused_lookahead_leaves_the_sequence_alone():
+    drawn = negotiation_random.NegotiationRandom(5, batchSize=2)
+    looked = negotiation_random.NegotiationRandom(5, batchSize=2)
+    lookahead = looked.lookahead()
+    for _ in range(10):
+        lookahead.random()
+    assert [looked.random() for _ in range(4)] == [drawn.random() for _ in range(4)]
+
+
+def test_random_source_uses_the_settings_seed_outside_a_seeded_round():
+    source = negotiation_random.RandomSource({'seed': 11, 'batchSize': 4})
+    rng = source.forNegotiation(None, 1, 'env', 'Buyer1')
+    assert rng.seed == negotiation_random.negotiationSeed(11, 1, 'env', 'Buyer1')
+    assert rng.batchSize == 4
+    assert source.forNegotiation(3, 1, 'env', 'Buyer1').seed == negotiation_random.negotiationSeed(3, 1, 'env', 'Buyer1')
+
+
+def runRound(seed, messages):
+    appSettings, assistantParams = simulate.agentSettings(9, 'local', False)
+    agent = agent_py.createAgents(appSettings, assistantParams)[0]
+    sent = []
+    agent.sendMessage = sent.append
+    client = agent.createApp().test_client()
+    client.post('/setUtility', json={'currencyUnit': 'USD', 'utility': utility, 'name': 'Agent007'})
+    client.post('/startRound', json={'roundDuration': 600, 'roundNumber': 1, 'seed': seed})
+    for buyer, text in messages:
+        client.post('/receiveMessage', json={'text': "Agent007, " + text, 'speaker': buyer, 'addressee': 'Agent007',
+                                             'role': 'buyer', 'environmentUUID': 'abcdefg'})
+    return [(reply['addressee'], reply['text'], reply['bid']) for reply in sent]
+
+
+def test_same_round_seed_gives_the_same_replies():
+    messages = [('Buyer1', text) for text in offers]
+    replies = runRound(7, messages)
+    assert len(replies) == len(offers)
+    assert runRound(7, messages) == replies
+    assert runRound(8, messages) != replies
+
+
+def test_each_negotiation_is_independent_of_interleaving():
+    together = runRound(7, [(buyer, text) for text in offers for buyer in ('Buyer1', 'Buyer2')])
+    alone = runRound(7, [('Buyer1', text) for text in offers])
+    assert [reply for reply in together if reply[0] == 'Buyer1'] == alone
@@ -0,0 +1,80 @@
+# Imports
+import importlib
+import pytest
+offer_parser = importlib.import_module('offer-parser')
+local_classifier = importlib.import_module('local-classifier')
+conversation = importlib.import_module('conversation')
+extract_bid = importlib.import_module('extract-bid')
+
+parser = offer_parser.OfferParser.fromSkillFile(extraAvatarNames=['Agent007'])
+classifier = local_classifier.LocalClassifier.fromSkillFile(extraAvatarNames=['Agent007'])
+
+
+def interpret(output, text):
+    input_ = {'text': text, 'speaker': 'Buyer1', 'addressee': 'Celia', 'role': 'buyer', 'environmentUUID': 'env'}
+    interpretation = extract_bid.interpretMessage(conversation.translateWatsonResponse({'output': output}, input_))
+    del interpretation['metadata']['timeStamp']
+    return interpretation
+
+
+@pytest.mark.parametrize('text', [
+    "I'll give you $4.50 for 4 cups of milk",
+    "Celia, 2 eggs and 1 cup of sugar for $6?",
+    "$3 for two eggs",
+    "For $10, I'll take 3 eggs, 2 cups of flour and 1 cup of milk.",
+    "Agent007: how about 5 eggs for 8 dollars",
+])
+def test_well_formed_offer_is_parsed_like_the_classifier(text):
+    output = parser.parseOffer(text)
+    assert output is not None
+    assert output['intents'] == [{'intent': 'Offer', 'confidence': 1.0}]
+    assert [e['location'] for e in output['entities']] == sorted(e['location'] for e in output['entities'])
+    assert interpret(output, text) == interpret(classifier.classify(text), text)
+
+
+def test_entities_point_into_the_text():
+    text = "Celia, 2 eggs and 1 cup of sugar for $6"
+    entities = parser.parseOffer(text)['entities']
+    assert [(e['entity'], text[e['location'][0]:e['location'][1]], e['value']) for e in entities] == [
+        ('avatarName', 'Celia', 'Celia'), ('sys-number', '2', '2'), ('good', 'eggs', 'egg'),
+        ('sys-number', '1', '1'), ('good', 'sugar', 'sugar'), ('sys-currency', '$6', '6')]
+
+
+@pytest.mark.parametrize('text', [
+    "I won't give you $4 for 2 eggs",
+    "$1 each for 3 eggs",
+    "$4 for 2 eggs or $5 for 3 eggs",
+    "2 eggs for $3, that's my final offer",
+    "How many eggs do you have?",
+    "",
+])
+def test_anything_else_is_left_to_the_classifier(text):
+    assert parser.parseOffer(text) is None
+
+
+def test_report_counts_hits_and_misses():
+    fresh = offer_parser.OfferParser.fromSkillFile()
+    assert fresh.report() == {'hits': 0, 'misses': 0, 'hitRate': None}
+    fresh.parse("2 eggs for $3")
+    fresh.parse("2 eggs for $3")
+    fresh.parse("No way")
+    fresh.parse(None)
+    assert fresh.report() == {'hits': 2, 'misses': 2, 'hitRate': 0.5}
+
+
+def test_conversation_skips_the_classifier_on_a_hit():
+    classifying = conversation.Conversation({'classifier': 'local', 'cache': {'enabled': False}}, ['Agent007'])
+    calls = []
+    classifying.classifyMessageUncached = lambda input_: calls.append(input_)
+    input_ = {'text': "Agent007, I'll give you $5 for 2 eggs", 'speaker': 'Buyer1', 'addressee': 'Agent007',
+              'role': 'buyer', 'environmentUUID': 'env'}
+    response = classifying.classifyMessage(dict(input_))
+    assert calls == []
+    assert response['intents'][0]['intent'] == 'Offer'
+    classifying.classifyMessage(dict(input_, text="How many eggs do you have?"))
+    assert len(calls) == 1
+
+
+def test_fast_path_can_be_disabled():
+    assert conversation.Conversation({'classifier': 'local', 'fastPath': {'enabled': False},
+                                      'cache': {'enabled': False}}).offerParser is None
@@ -0,0 +1,28 @@
+# Imports
+import importlib
+import threading
+import time
+profiler = importlib.import_module('profiler')
+
+
+def busy(seconds):
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        pass
+
+
+def test_samples_are_counted_in_the_round_their_thread_serves(tmp_path):
+    roundProfiler = profiler.RoundProfiler({'interval': 0.002, 'directory': str(tmp_path)}, [busy])
+    roundProfiler.start('a', 'a')
+    roundProfiler.start('b', 'b')
+    def serve(key):
+        with roundProfiler.serving(key):
+            busy(0.2)
+    thread = threading.Thread(target=serve, args=('a',))
+    thread.start()
+    busy(0.1) # Not serving any round
+    thread.join()
+    samples = {entry['path']: entry['samples'] for entry in roundProfiler.report()['profiling']}
+    assert samples[str(tmp_path / 'a')] > 0 and samples[str(tmp_path / 'b')] == 0
+    assert roundProfiler.stop('a') and roundProfiler.stop('b')
+    assert (tmp_path / 'b.collapsed').read_text() == ''
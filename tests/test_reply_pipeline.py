@@ -0,0 +1,124 @@
+# Imports
+import importlib
+import threading
+import time
+reply_pipeline = importlib.import_module('reply-pipeline')
+simulate = importlib.import_module('simulate')
+agent_py = importlib.import_module('agent-py')
+
+
+def test_drain_of_one_environment_does_not_wait_for_another():
+    release = threading.Event()
+    handled = []
+    def handler(message):
+        if message['environmentUUID'] == 'busy':
+            release.wait(5)
+        handled.append(message['environmentUUID'])
+    pipeline = reply_pipeline.ReplyPipeline(handler, workers=2)
+    pipeline.submit(('busy', 'Buyer1'), {'environmentUUID': 'busy'})
+    pipeline.submit(('ending', 'Buyer1'), {'environmentUUID': 'ending'})
+    startedAt = time.monotonic()
+    assert pipeline.drain(2.0, 'ending')
+    assert time.monotonic() - startedAt < 1.0
+    assert 'ending' in handled
+    assert not pipeline.drain(0.1) # The whole pipeline is still busy
+    release.set()
+    assert pipeline.drain(2.0)
+
+
+def test_priority_is_computed_when_a_message_comes_up_for_its_buyer():
+    release = threading.Event()
+    boosts = {'Buyer1': 0.0}
+    prioritized = []
+    def priority(message):
+        prioritized.append(message['text'])
+        return boosts[message['speaker']]
+    def handler(message):
+        if message['text'] == 'first':
+            release.wait(5)
+            boosts['Buyer1'] = 60.0 # e.g. the first offer brought the buyer close to a deal
+    pipeline = reply_pipeline.ReplyPipeline(handler, workers=1, priority=priority)
+    pipeline.submit(('env', 'Buyer1'), {'text': 'first', 'speaker': 'Buyer1'})
+    pipeline.submit(('env', 'Buyer1'), {'text': 'second', 'speaker': 'Buyer1'})
+    assert prioritized == ['first']
+    release.set()
+    assert pipeline.drain(2.0)
+    assert prioritized == ['first', 'second']
+
+
+def test_messages_of_a_buyer_are_handled_in_order_and_buyers_concurrently():
+    handled = []
+    active = set()
+    overlapped = threading.Event()
+    lock = threading.Lock()
+    def handler(message):
+        with lock:
+            active.add(message['speaker'])
+            if len(active) > 1:
+                overlapped.set()
+        overlapped.wait(0.5)
+        with lock:
+            active.discard(message['speaker'])
+            handled.append((message['speaker'], message['n']))
+    pipeline = reply_pipeline.ReplyPipeline(handler, workers=4)
+    for n in range(5):
+        for speaker in ('Buyer1', 'Buyer2'):
+            pipeline.submit(('env', speaker), {'speaker': speaker, 'n': n})
+    assert pipeline.drain(5.0)
+    assert overlapped.is_set()
+    for speaker in ('Buyer1', 'Buyer2'):
+        assert [n for s, n in handled if s == speaker] == list(range(5))
+    report = pipeline.report()
+    assert (report['enqueued'], report['processed'], report['queueDepth']) == (10, 10, 0)
+
+
+def test_errors_are_counted_and_later_messages_still_handled():
+    handled = []
+    def handler(message):
+        if message == 'bad':
+            raise ValueError(message)
+        handled.append(message)
+    pipeline = reply_pipeline.ReplyPipeline(handler, workers=1)
+    for message in ('bad', 'good'):
+        pipeline.submit(('env', 'Buyer1'), message)
+    assert pipeline.drain(2.0)
+    assert handled == ['good'] and pipeline.report()['errors'] == 1
+
+
+def test_cancel_drops_only_queued_messages_of_matching_keys():
+    release = threading.Event()
+    handled = []
+    def handler(message):
+        release.wait(5)
+        handled.append(message)
+    pipeline = reply_pipeline.ReplyPipeline(handler, workers=1)
+    pipeline.submit(('ending', 'Buyer1'), 'first') # Taken by the worker
+    time.sleep(0.1)
+    pipeline.submit(('ending', 'Buyer1'), 'second')
+    pipeline.submit(('ending', 'Buyer2'), 'third')
+    pipeline.submit(('other', 'Buyer1'), 'fourth')
+    assert sorted(pipeline.cancel(lambda key: key[0] == 'ending')) == ['second', 'third']
+    release.set()
+    assert pipeline.drain(2.0)
+    assert handled == ['first', 'fourth'] and pipeline.report()['cancelled'] == 2
+
+
+def test_receive_message_acknowledges_before_the_reply_is_sent():
+    appSettings, assistantParams = simulate.agentSettings(9, 'local', True)
+    agent = agent_py.createAgents(appSettings, assistantParams)[0]
+    release = threading.Event()
+    sent = []
+    def sendMessage(message):
+        release.wait(5)
+        sent.append(message)
+    agent.sendMessage = sendMessage
+    client = agent.createApp().test_client()
+    client.post('/setUtility', json={'currencyUnit': 'USD', 'name': 'Agent007', 'utility': {
+        'egg': {'type': 'unitcost', 'unit': 'each', 'parameters': {'unitcost': 0.5}}}})
+    client.post('/startRound', json={'roundDuration': 600, 'roundNumber': 1})
+    response = client.post('/receiveMessage', json={'text': "Agent007, I'll give you $3 for 4 eggs", 'speaker': 'Buyer1',
+                                                    'addressee': 'Agent007', 'role': 'buyer', 'environmentUUID': None})
+    assert response.json['status'] == 'Acknowledged' and not sent
+    release.set()
+    assert agent.drainReplies(5.0)
+    assert len(sent) == 1 and sent[0]['addressee'] == 'Buyer1'
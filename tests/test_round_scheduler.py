@@ -0,0 +1,110 @@
+# Imports
+import importlib
+import threading
+import time
+round_scheduler = importlib.import_module('round-scheduler')
+simulate = importlib.import_module('simulate')
+agent_py = importlib.import_module('agent-py')
+
+
+def waitFor(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_timers_fire_in_order_of_due_time():
+    scheduler = round_scheduler.RoundScheduler(time.monotonic)
+    fired = []
+    now = time.monotonic()
+    scheduler.schedule('env', 'end', now + 0.15, fired.append, 'end')
+    scheduler.schedule('env', 'warning', now + 0.05, fired.append, 'warning')
+    scheduler.schedule('env', 'start', now - 1, fired.append, 'start') # Already due
+    assert waitFor(lambda: len(fired) == 3)
+    assert fired == ['start', 'warning', 'end']
+    assert scheduler.report() == {'scheduled': 3, 'fired': 3, 'cancelled': 0, 'errors': 0, 'pending': []}
+    scheduler.close()
+
+
+def test_cancel_only_drops_the_timers_of_one_environment():
+    scheduler = round_scheduler.RoundScheduler(time.monotonic)
+    fired = []
+    now = time.monotonic()
+    scheduler.schedule('ending', 'warning', now + 0.1, fired.append, 'ending warning')
+    scheduler.schedule('ending', 'end', now + 0.2, fired.append, 'ending end')
+    scheduler.schedule('other', 'end', now + 0.2, fired.append, 'other end')
+    assert [(timer['environmentUUID'], timer['kind']) for timer in scheduler.report()['pending']] == \
+           [('ending', 'warning'), ('ending', 'end'), ('other', 'end')]
+    assert scheduler.cancel('ending') == 2
+    assert scheduler.cancel('ending') == 0
+    assert [timer['environmentUUID'] for timer in scheduler.report()['pending']] == ['other']
+    assert waitFor(lambda: fired)
+    time.sleep(0.1)
+    assert fired == ['other end']
+    assert scheduler.report()['cancelled'] == 2
+    scheduler.close()
+
+
+def test_failing_callback_does_not_stop_the_others():
+    scheduler = round_scheduler.RoundScheduler(time.monotonic)
+    fired = threading.Event()
+    def fail():
+        raise RuntimeError("boom")
+    scheduler.schedule('env', 'warning', 0, fail)
+    scheduler.schedule('env', 'end', 0, fired.set)
+    assert fired.wait(2)
+    assert waitFor(lambda: scheduler.report()['errors'] == 1)
+    scheduler.close()
+
+
+def test_close_drops_pending_timers():
+    scheduler = round_scheduler.RoundScheduler(time.monotonic)
+    fired = []
+    scheduler.schedule('env', 'end', time.monotonic() + 0.1, fired.append, 'end')
+    scheduler.close()
+    assert scheduler.schedule('env', 'end', 0, fired.append, 'late') is None
+    scheduler.thread.join(2)
+    assert not scheduler.thread.is_alive()
+    assert fired == []
+
+
+def createAgent():
+    appSettings, assistantParams = simulate.agentSettings(9, 'local', False)
+    agent = agent_py.createAgents(appSettings, assistantParams)[0]
+    agent.sendMessage = lambda message: None
+    return agent, agent.createApp().test_client()
+
+
+def test_round_sets_start_warning_and_end_timers():
+    agent, client = createAgent()
+    startTime = (time.time() + 30) * 1000
+    client.post('/startRound', json={'environmentUUID': 'env', 'roundDuration': 120, 'startTime': startTime})
+    assert not agent.negotiationStore.environment('env').negotiationState['active']
+    pending = client.get('/schedulerStats').get_json()['pending']
+    assert [timer['kind'] for timer in pending] == ['start', 'warning', 'warning', 'end']
+    assert [round(timer['inSeconds']) for timer in pending] == [30, 90, 140, 150]
+    client.post('/endRound', json={'environmentUUID': 'env'})
+    assert client.get('/schedulerStats').get_json()['pending'] == []
+    agent.scheduler.close()
+
+
+def test_round_becomes_inactive_when_its_time_is_up():
+    agent, client = createAgent()
+    client.post('/startRound', json={'environmentUUID': 'env', 'roundDuration': 0.2})
+    negotiationState = agent.negotiationStore.environment('env').negotiationState
+    assert negotiationState['active']
+    assert [timer['kind'] for timer in agent.scheduler.report()['pending']] == ['end'] # Warnings longer than the round are skipped
+    assert waitFor(lambda: not negotiationState['active'])
+    assert negotiationState['endTime'] == negotiationState['stopTime']
+    agent.scheduler.close()
+
+
+def test_new_round_cancels_the_timers_of_the_previous_one():
+    agent, client = createAgent()
+    client.post('/startRound', json={'environmentUUID': 'env', 'roundDuration': 0.2, 'roundNumber': 1})
+    client.post('/startRound', json={'environmentUUID': 'env', 'roundDuration': 600, 'roundNumber': 2})
+    time.sleep(0.4)
+    assert agent.negotiationStore.environment('env').negotiationState['active']
+    assert [timer['kind'] for timer in agent.scheduler.report()['pending']] == ['warning', 'warning', 'end']
+    agent.scheduler.close()
@@ -0,0 +1,42 @@
+# Imports
+import importlib
+import threading
+simulate = importlib.import_module('simulate')
+agent_py = importlib.import_module('agent-py')
+metrics = importlib.import_module('metrics')
+
+utility = {
+    'egg': {'type': 'unitcost', 'unit': 'each', 'parameters': {'unitcost': 0.5}},
+    'milk': {'type': 'unitcost', 'unit': 'cup', 'parameters': {'unitcost': 1.0}}
+}
+offer = {'text': "Agent007, I'll give you $5 for 4 eggs and 2 cups of milk", 'speaker': 'Buyer1', 'addressee': 'Agent007',
+         'role': 'buyer', 'environmentUUID': 'abcdefg'}
+
+
+def bidCount(function):
+    return metrics.histogram('agent_function_duration_seconds', 'Duration of hot-path function calls',
+                             function=function).count
+
+
+def test_speculation_runs_off_the_request_thread_under_its_own_label():
+    appSettings, assistantParams = simulate.agentSettings(9, 'local', False, speculation=True)
+    agent = agent_py.createAgents(appSettings, assistantParams)[0]
+    sent = []
+    agent.sendMessage = sent.append
+    threads = []
+    speculativeBid = agent.speculativeBid
+    def recordingBid(*args):
+        threads.append(threading.current_thread())
+        return speculativeBid(*args)
+    agent.speculativeBid = recordingBid
+    client = agent.createApp().test_client()
+    client.post('/setUtility', json={'currencyUnit': 'USD', 'utility': utility, 'name': 'Agent007'})
+    client.post('/startRound', json={'roundDuration': 600, 'roundNumber': 1, 'seed': 7})
+    generated, speculated = bidCount('generateBid'), bidCount('speculativeBid')
+    client.post('/receiveMessage', json=dict(offer))
+    assert agent.speculator.drain(5.0)
+    assert sent[-1]['bid']['type'] == 'SellOffer'
+    assert threads and all(thread is agent.speculator.thread for thread in threads)
+    assert bidCount('generateBid') == generated + 1
+    assert bidCount('speculativeBid') == speculated + len(threads)
+    assert agent.speculator.report()['speculations'] == 1
@@ -0,0 +1,71 @@
+# Imports
+import argparse
+import glob
+import importlib
+import os
+transcript_log = importlib.import_module('transcript-log')
+simulate = importlib.import_module('simulate')
+agent_py = importlib.import_module('agent-py')
+replay = importlib.import_module('replay')
+
+
+def writeLog(path, events, **settings):
+    log = transcript_log.TranscriptLog(path, clock=lambda: 0.0, **settings)
+    for kind, data in events:
+        log.record(kind, data)
+    return log
+
+
+def test_events_are_read_back_through_the_index(tmp_path):
+    path = str(tmp_path / 'round')
+    events = [('round', {'seed': 7}), ('inbound', {'text': 'é, ünïcode'}), ('outbound', {'text': 'reply'})] * 20
+    writeLog(path, events, bufferSize=8).close()
+    assert os.path.getsize(path + '.idx') == 8 * len(events)
+    with transcript_log.TranscriptReader(path + '.jsonl') as reader:
+        assert len(reader) == len(events)
+        assert reader[31] == {'seq': 31, 'time': 0.0, 'kind': 'inbound', 'data': {'text': 'é, ünïcode'}}
+        assert reader[-1]['seq'] == len(events) - 1
+        assert [event['seq'] for event in reader.events('round')] == list(range(0, len(events), 3))
+
+
+def test_events_are_buffered_until_flushed(tmp_path):
+    path = str(tmp_path / 'round')
+    log = writeLog(path, [('inbound', {'n': n}) for n in range(3)], bufferSize=10, flushInterval=60)
+    assert os.path.getsize(path + '.jsonl') == 0
+    log.flush()
+    with transcript_log.TranscriptReader(path) as reader:
+        assert [event['data']['n'] for event in reader] == [0, 1, 2]
+    log.close()
+    assert log.record('inbound', {}) is None # Closed logs ignore further events
+
+
+def test_lines_missing_from_the_index_are_found_by_scanning(tmp_path):
+    path = str(tmp_path / 'round')
+    writeLog(path, [('inbound', {'n': n}) for n in range(5)]).close()
+    with open(path + '.idx', 'r+b') as f: # As if the agent had died while writing the index
+        f.truncate(8 * 2 + 3)
+    with transcript_log.TranscriptReader(path) as reader:
+        assert [event['data']['n'] for event in reader] == [0, 1, 2, 3, 4]
+    os.remove(path + '.idx')
+    with transcript_log.TranscriptReader(path) as reader:
+        assert len(reader) == 5 and reader[4]['data']['n'] == 4
+
+
+def test_recorded_round_replays_with_the_same_replies(tmp_path):
+    appSettings, assistantParams = simulate.agentSettings(9, 'local', False, str(tmp_path))
+    agent = agent_py.createAgents(appSettings, assistantParams)[0]
+    agent.sendMessage = lambda message: agent.recordEvent(agent.negotiationStore.environment(None), 'outbound', message)
+    client = agent.createApp().test_client()
+    client.post('/setUtility', json={'currencyUnit': 'USD', 'name': 'Agent007', 'utility': {
+        'egg': {'type': 'unitcost', 'unit': 'each', 'parameters': {'unitcost': 0.5}},
+        'milk': {'type': 'unitcost', 'unit': 'cup', 'parameters': {'unitcost': 1.0}}}})
+    client.post('/startRound', json={'roundDuration': 600, 'roundNumber': 1, 'seed': 11})
+    for text in ("Agent007, I'll give you $3 for 4 eggs and 2 cups of milk", "Agent007, how about $4?",
+                 "Agent007, how much for 2 eggs?", "Agent007, I accept"):
+        client.post('/receiveMessage', json={'text': text, 'speaker': 'Buyer1', 'addressee': 'Agent007', 'role': 'buyer',
+                                             'environmentUUID': None})
+    client.post('/endRound', json={})
+    [path] = glob.glob(str(tmp_path / '*.jsonl'))
+    report = replay.replay(argparse.Namespace(transcript=path, repeat=1))
+    assert report['messages'] == 4 and report['replies'] > 0
+    assert report['matched'] == report['messages'] and report['mismatched'] == 0
@@ -0,0 +1,65 @@
+# Imports
+import importlib
+import http.server
+import threading
+import time
+transport = importlib.import_module('transport')
+
+
+class RecordingTransport:
+    def __init__(self):
+        self.sent = []
+
+    def postNow(self, serviceType, path, json):
+        if json == 'unserializable':
+            raise TypeError("Object of type set is not JSON serializable")
+        self.sent.append(json)
+
+
+def test_batcher_keeps_sending_after_an_unexpected_error():
+    recording = RecordingTransport()
+    batcher = transport.Batcher(recording, 'environment-orchestrator', '/relayMessage', {'windowMs': 5})
+    batcher.add('unserializable')
+    batcher.add('first')
+    time.sleep(0.1)
+    batcher.add('second')
+    time.sleep(0.1)
+    assert recording.sent == ['first', 'second']
+    assert batcher.thread.is_alive()
+
+
+class StatusHandler(http.server.BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.server.posts += 1
+        self.send_response(self.server.status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def postWithStatus(status):
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StatusHandler)
+    server.status = status
+    server.posts = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        service = transport.Transport({'environment-orchestrator': 'http://127.0.0.1:%d' % server.server_address[1]},
+                                      {'retries': 2, 'backoffFactor': 0})
+        response = service.post('environment-orchestrator', '/relayMessage', {'text': "I accept"})
+        service.close()
+        return response.status_code, server.posts
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_posts_are_not_replayed_on_gateway_errors():
+    assert postWithStatus(502) == (502, 1)
+    assert postWithStatus(504) == (504, 1)
+
+
+def test_posts_are_retried_when_unavailable():
+    assert postWithStatus(503) == (503, 3)
@@ -0,0 +1,75 @@
+# Imports
+import importlib
+import pytest
+utility_engine = importlib.import_module('utility-engine')
+negotiation_random = importlib.import_module('negotiation-random')
+negotiation_store = importlib.import_module('negotiation-store')
+simulate = importlib.import_module('simulate')
+
+utilityInfo = {'currencyUnit': 'USD', 'utility': {
+    'egg': {'type': 'unitcost', 'unit': 'each', 'parameters': {'unitcost': 0.5}},
+    'milk': {'type': 'unitcost', 'unit': 'cup', 'parameters': {'unitcost': 1.0}}
+}}
+quantity = {'egg': 4, 'milk': 2} # costs 4.0
+
+
+def test_counter_offer_search_finds_a_smaller_bundle_below_the_floor():
+    engine = utility_engine.compileUtility(utilityInfo)
+    bundle = engine.searchCounterOffer(quantity, 3.0, 0.2)
+    assert bundle is not None and bundle != quantity
+    assert engine.bundleCost(bundle) * 1.2 <= 3.0
+
+
+def test_counter_offer_search_leaves_offers_above_the_floor_alone():
+    engine = utility_engine.compileUtility(utilityInfo)
+    assert engine.searchCounterOffer(quantity, 6.0, 0.2) is None
+
+
+def test_counter_offer_search_keeps_the_strategy_price_above_the_floor():
+    agent = simulate.loadAgent(9, 'local', False)
+    environment = agent.negotiationStore.defaultEnvironment
+    environment.utilityEngine = utility_engine.compileUtility(utilityInfo)
+    environment.negotiationState.update({'active': True, 'startTime': 0, 'stopTime': 600000, 'roundDuration': 600})
+    agent.clock = lambda: 0.0
+    offer = {'quantity': quantity, 'price': {'unit': 'USD', 'value': 6.0}} # 50% over cost, above the 20% floor
+    bids = {}
+    for mode in ('off', 'search'):
+        agent.counterOfferMode = mode
+        session = negotiation_store.NegotiationSession(None, 'Buyer')
+        bids[mode] = agent.generateBid(offer, environment, session, negotiation_random.NegotiationRandom(1))
+    assert bids['search']['type'] == 'SellOffer'
+    assert bids['search'] == bids['off']
+    assert bids['search']['price']['value'] > offer['price']['value']
+
+
+def test_utility_is_compiled_once_into_an_immutable_engine():
+    engine = utility_engine.compileUtility(dict(utilityInfo, currencyUnit='$'))
+    assert engine.goods == ('egg', 'milk') and engine.currencyUnit == 'USD'
+    assert engine.bundleCost(quantity) == 4.0
+    assert list(engine.evaluate([[4, 2], [2, 0]], [5.0, 2.0])) == [1.0, 1.0]
+    with pytest.raises(AttributeError):
+        engine.currencyUnit = 'EUR'
+    assert not engine.unitCosts.flags.writeable
+
+
+@pytest.mark.parametrize('utility', [
+    {},
+    {'egg': {'type': 'unitcost', 'unit': 'each', 'parameters': {}}},
+    {'egg': {'type': 'unitcost', 'unit': 'each', 'parameters': {'unitcost': 'cheap'}}},
+    {'egg': {'type': 'unitcost', 'unit': 'each', 'parameters': {'unitcost': -1}}},
+    {'egg': {'type': 'unitcost', 'unit': 'each', 'parameters': {'unitcost': float('inf')}}}
+])
+def test_invalid_utility_is_rejected(utility):
+    with pytest.raises(ValueError):
+        utility_engine.compileUtility({'currencyUnit': 'USD', 'utility': utility})
+
+
+def test_set_utility_keeps_the_previous_engine_on_an_invalid_payload():
+    agent = simulate.loadAgent(9, 'local', False)
+    client = agent.createApp().test_client()
+    assert client.post('/setUtility', json=dict(utilityInfo, name='Agent007')).json['status'] == 'Acknowledged'
+    engine = agent.negotiationStore.defaultEnvironment.utilityEngine
+    response = client.post('/setUtility', json={'currencyUnit': 'USD', 'name': 'Agent007', 'utility': {
+        'egg': {'type': 'unitcost', 'unit': 'each', 'parameters': {'unitcost': 'cheap'}}}})
+    assert response.json['status'] == "Failed; invalid utility: no numeric unitcost for egg"
+    assert agent.negotiationStore.defaultEnvironment.utilityEngine is engine
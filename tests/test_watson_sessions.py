@@ -0,0 +1,77 @@
+# Imports
+import importlib
+import pytest
+import threading
+import time
+watson_sessions = importlib.import_module('watson-sessions')
+
+
+class FakeAssistant:
+    def __init__(self):
+        self.created = 0
+        self.deleted = []
+        self.failing = False
+
+    def createSession(self):
+        if self.failing:
+            raise ConnectionError("Watson is unreachable")
+        self.created += 1
+        return 'session' + str(self.created)
+
+    def deleteSession(self, sessionId):
+        self.deleted.append(sessionId)
+
+
+class ExpiredError(Exception):
+    code = 404
+    message = "Invalid Session"
+
+
+def test_released_sessions_are_reused():
+    assistant = FakeAssistant()
+    pool = watson_sessions.WatsonSessionPool(assistant.createSession, assistant.deleteSession, size=2)
+    first = pool.acquire()
+    pool.release(first)
+    assert pool.acquire() is first and assistant.created == 1
+
+
+def test_callers_wait_when_every_session_is_handed_out():
+    assistant = FakeAssistant()
+    pool = watson_sessions.WatsonSessionPool(assistant.createSession, assistant.deleteSession, size=1)
+    session = pool.acquire()
+    acquired = []
+    waiter = threading.Thread(target=lambda: acquired.append(pool.acquire()))
+    waiter.start()
+    time.sleep(0.1)
+    assert not acquired
+    pool.release(session)
+    waiter.join(2.0)
+    assert acquired == [session] and assistant.created == 1
+
+
+def test_discarded_and_failed_sessions_free_their_place():
+    assistant = FakeAssistant()
+    pool = watson_sessions.WatsonSessionPool(assistant.createSession, assistant.deleteSession, size=1)
+    pool.discard(pool.acquire())
+    assistant.failing = True
+    with pytest.raises(ConnectionError):
+        pool.acquire()
+    assistant.failing = False
+    assert pool.acquire().sessionId == 'session2' and pool.count == 1
+
+
+def test_idle_sessions_are_renewed_before_they_expire():
+    assistant = FakeAssistant()
+    pool = watson_sessions.WatsonSessionPool(assistant.createSession, assistant.deleteSession, size=1,
+                                             sessionTimeout=4, renewMargin=2)
+    session = pool.acquire()
+    pool.release(session)
+    session.lastUsed -= 3 # Idle for longer than sessionTimeout - renewMargin
+    time.sleep(1.3)       # The renewer looks every second
+    assert assistant.deleted == ['session1']
+    assert pool.acquire().sessionId == 'session2' and pool.count == 1
+
+
+def test_only_missing_sessions_count_as_expired():
+    assert watson_sessions.isSessionExpired(ExpiredError())
+    assert not watson_sessions.isSessionExpired(ConnectionError("Invalid Session"))
@@ -0,0 +1,177 @@
+# Imports
+from array import array
+import json
+import mmap
+import os
+import re
+import sys
+import threading
+import time
+
+# Global variables / settings
+defaultBufferSize = 64     # events held in memory before they are written out
+defaultFlushInterval = 1.0 # seconds; older buffered events are written out with the next event
+unsafeNameCharacters = re.compile(r'[^A-Za-z0-9_.-]+')
+
+
+# *** TranscriptLog
+# Append-only log of everything that happens during one round in one environment: inbound messages, classifications,
+# interpretations, generated bids and outbound sends. Events are JSON lines in `<name>.jsonl`; the byte offset of
+# every line is kept in `<name>.idx` (little-endian unsigned 64-bit integers), so that a reader can jump to any event.
+# Events are encoded when they are recorded (later changes to the recorded objects do not show up in the log) and
+# buffered, so that the hot path never waits for the disk.
+class TranscriptLog:
+
+    def __init__(self, path, bufferSize=defaultBufferSize, flushInterval=defaultFlushInterval, clock=time.time):
+        self.path = path
+        self.bufferSize = bufferSize
+        self.flushInterval = flushInterval
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.buffer = []    # encoded lines not yet written
+        self.seq = 0
+        self.flushedAt = clock()
+        self.dataFile = open(path + '.jsonl', 'ab')
+        self.indexFile = open(path + '.idx', 'ab')
+        self.offset = self.dataFile.tell()
+
+
+    # *** record()
+    # Append an event of the given kind. Returns its sequence number within the round.
+    def record(self, kind, data):
+        now = self.clock()
+        with self.lock:
+            if self.dataFile is None:
+                return None
+            seq = self.seq
+            self.seq += 1
+            event = {'seq': seq, 'time': now, 'kind': kind, 'data': data}
+            self.buffer.append((json.dumps(event, default=str) + '\n').encode('utf-8'))
+            if len(self.buffer) >= self.bufferSize or now - self.flushedAt >= self.flushInterval:
+                self.writeBuffer()
+        return seq
+
+
+    # *** flush()
+    # Write out buffered events
+    def flush(self):
+        with self.lock:
+            if self.dataFile is not None:
+                self.writeBuffer()
+
+
+    # *** close()
+    def close(self):
+        with self.lock:
+            if self.dataFile is None:
+                return
+            self.writeBuffer()
+            self.dataFile.close()
+            self.indexFile.close()
+            self.dataFile = None
+            self.indexFile = None
+
+
+    # *** writeBuffer()
+    # Call with the lock held
+    def writeBuffer(self):
+        self.flushedAt = self.clock()
+        if not self.buffer:
+            return
+        offsets = array('Q')
+        for line in self.buffer:
+            offsets.append(self.offset)
+            self.offset += len(line)
+        self.dataFile.write(b''.join(self.buffer))
+        self.dataFile.flush()
+        if sys.byteorder != 'little':
+            offsets.byteswap()
+        self.indexFile.write(offsets.tobytes())
+        self.indexFile.flush()
+        self.buffer = []
+
+
+# *** TranscriptReader
+# Random access to the events of a transcript log, through a memory map of the log. Uses the index where it is
+# complete, and finds the remaining lines (of a log whose index was lost or not fully written) by scanning.
+class TranscriptReader:
+
+    def __init__(self, path):
+        if path.endswith('.jsonl'):
+            path = path[:-len('.jsonl')]
+        self.path = path
+        self.file = open(path + '.jsonl', 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self.offsets = self.readIndex(size)
+        start = self.lineEnd(self.offsets[-1]) + 1 if self.offsets else 0
+        while start < size:
+            self.offsets.append(start)
+            start = self.lineEnd(start) + 1
+
+
+    # *** readIndex()
+    # Offsets from the index file, as far as they point into the log
+    def readIndex(self, size):
+        offsets = array('Q')
+        try:
+            with open(self.path + '.idx', 'rb') as f:
+                raw = f.read()
+        except FileNotFoundError:
+            return offsets
+        offsets.frombytes(raw[:len(raw) - len(raw) % offsets.itemsize])
+        if sys.byteorder != 'little':
+            offsets.byteswap()
+        while offsets and offsets[-1] >= size:
+            offsets.pop()
+        return offsets
+
+
+    # *** lineEnd()
+    def lineEnd(self, start):
+        end = self.data.find(b'\n', start)
+        return end if end >= 0 else len(self.data)
+
+
+    def __len__(self):
+        return len(self.offsets)
+
+
+    def __getitem__(self, i):
+        start = self.offsets[i]
+        return json.loads(self.data[start:self.lineEnd(start)])
+
+
+    def __iter__(self):
+        for i in range(len(self.offsets)):
+            yield self[i]
+
+
+    # *** events()
+    # The events of the given kinds (all events if no kinds are given), in the order in which they were recorded
+    def events(self, *kinds):
+        for event in self:
+            if not kinds or event['kind'] in kinds:
+                yield event
+
+
+    # *** close()
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# *** roundLogPath()
+# Path (without extension) of the transcript log of a round
+def roundLogPath(directory, environmentUUID, roundNumber, startTime):
+    name = unsafeNameCharacters.sub('_', str(environmentUUID or 'default'))
+    return os.path.join(directory, name + '-round' + str(roundNumber) + '-' + str(int(startTime)))
@@ -0,0 +1,147 @@
+# Imports
+import logging
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger('agent-py.transport')
+
+
+# *** Transport
+# Outbound HTTP layer: one persistent, keep-alive requests.Session per service type, with its own connection pool,
+# timeouts and bounded retries with exponential backoff. Base URLs are resolved once, when the transport is built.
+class Transport:
+
+    def __init__(self, baseURLs, settings=None):
+        settings = settings or {}
+        self.baseURLs = dict(baseURLs)
+        self.timeout = (settings.get('connectTimeout', 2.0), settings.get('readTimeout', 5.0))
+        retries = settings.get('retries', 2)
+        # Only failures where the message cannot have been delivered are retried: failed connections and 503 responses
+        # (the service is not accepting requests). A timed-out read, a 502 or a 504 is not, because the service may
+        # already have processed the message behind the gateway, and posting it again would duplicate a bid.
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=0,
+            status=retries,
+            backoff_factor=settings.get('backoffFactor', 0.1),
+            status_forcelist=[503],
+            allowed_methods=frozenset(['GET', 'POST']),
+            raise_on_status=False
+        )
+        self.sessions = {}
+        for serviceType in self.baseURLs:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.get('poolSize', 10), max_retries=retry)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self.sessions[serviceType] = session
+
+        self.batchers = {}
+        batchSettings = settings.get('batch', {})
+        if batchSettings.get('enabled'):
+            key = (batchSettings.get('serviceType', 'environment-orchestrator'), batchSettings.get('path', '/relayMessage'))
+            if key[0] in self.sessions:
+                self.batchers[key] = Batcher(self, key[0], key[1], batchSettings)
+
+
+    # *** post()
+    # POST a json body to the given path of a service type. Returns the response, or None if the service type
+    # is unknown or the body was handed to a micro-batch (in which case it is sent shortly afterwards).
+    def post(self, serviceType, path, json):
+        batcher = self.batchers.get((serviceType, path))
+        if batcher:
+            batcher.add(json)
+            return None
+        return self.postNow(serviceType, path, json)
+
+
+    # *** postNow()
+    # POST immediately, bypassing any micro-batching
+    def postNow(self, serviceType, path, json):
+        session = self.sessions.get(serviceType)
+        if not session:
+            return None
+        return session.post(self.baseURLs[serviceType] + path, json=json, timeout=self.timeout)
+
+
+    # *** flush()
+    # Send everything waiting in micro-batches right away
+    def flush(self):
+        for batcher in self.batchers.values():
+            batcher.flush()
+
+
+    # *** close()
+    # Flush pending batches and release pooled connections
+    def close(self):
+        self.flush()
+        for session in self.sessions.values():
+            session.close()
+
+
+# *** Batcher
+# Collects messages for one service type and path for up to windowMs (or until maxSize messages are waiting),
+# then sends them together: as a single JSON array if asArray is set (the receiving service must accept this),
+# otherwise one after another over the same kept-alive connection.
+class Batcher:
+
+    def __init__(self, transport, serviceType, path, settings):
+        self.transport = transport
+        self.serviceType = serviceType
+        self.path = path
+        self.window = settings.get('windowMs', 20) / 1000.0
+        self.maxSize = settings.get('maxSize', 20)
+        self.asArray = settings.get('asArray', False)
+        self.pending = []
+        self.lock = threading.Condition()
+        self.sendLock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, name='batcher-' + serviceType + path, daemon=True)
+        self.thread.start()
+
+
+    # *** add()
+    # Add a message to the current batch
+    def add(self, json):
+        with self.lock:
+            self.pending.append(json)
+            if len(self.pending) == 1 or len(self.pending) >= self.maxSize:
+                self.lock.notify()
+
+
+    # *** run()
+    # Flusher loop: wait for the first message of a batch, let the window elapse, then send.
+    # An error in one batch is logged and does not stop the loop.
+    def run(self):
+        while True:
+            with self.lock:
+                self.lock.wait_for(lambda: self.pending)
+                deadline = time.time() + self.window
+                while len(self.pending) < self.maxSize and time.time() < deadline:
+                    self.lock.wait(deadline - time.time())
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Error flushing batch to %s%s", self.serviceType, self.path)
+
+
+    # *** flush()
+    # Send the messages collected so far
+    def flush(self):
+        with self.sendLock:
+            with self.lock:
+                batch = self.pending
+                self.pending = []
+            if not batch:
+                return
+            bodies = [batch] if self.asArray else batch
+            for body in bodies:
+                try:
+                    self.transport.postNow(self.serviceType, self.path, body)
+                except requests.RequestException as e:
+                    logger.error("Error sending batched message to %s%s: %s", self.serviceType, self.path, e)
+                except Exception: # e.g. a message that cannot be serialized; the rest of the batch is still sent
+                    logger.exception("Error sending batched message to %s%s", self.serviceType, self.path)
@@ -0,0 +1,163 @@
+# Imports
+from functools import lru_cache
+import math
+import numpy as np
+
+# Global variables / settings
+maxCandidates = 4096 # Largest candidate set built as a full grid; beyond that, goods are varied one at a time
+defaultCurrencyUnit = 'USD'
+currencySymbols = {'$': 'USD', '€': 'EUR', '£': 'GBP'}
+
+
+# *** compileUtility()
+# Validate the utility payload received by /setUtility and compile it into an immutable UtilityEngine.
+# Raises ValueError describing the first problem found.
+def compileUtility(utilityInfo):
+    utilityParams = utilityInfo.get('utility') if isinstance(utilityInfo, dict) else None
+    if not isinstance(utilityParams, dict) or not utilityParams:
+        raise ValueError("no goods in utility")
+    goods = []
+    unitCosts = []
+    for good, params in utilityParams.items():
+        try:
+            unitCost = float(params['parameters']['unitcost'])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError("no numeric unitcost for " + str(good))
+        if not math.isfinite(unitCost) or unitCost < 0:
+            raise ValueError("invalid unitcost for " + str(good))
+        goods.append(good)
+        unitCosts.append(unitCost)
+    return UtilityEngine(goods, unitCosts, normalizeCurrency(utilityInfo.get('currencyUnit')))
+
+
+# *** normalizeCurrency()
+# Canonical form of a currency unit: an upper-case code, with a few symbols mapped to their codes
+def normalizeCurrency(unit):
+    if not unit:
+        return defaultCurrencyUnit
+    unit = str(unit).strip()
+    return currencySymbols.get(unit, unit.upper())
+
+
+# *** UtilityEngine
+# Compiled, immutable form of one utility function (as received by /setUtility), with vectorized utility evaluation.
+# Goods are numbered in the order they were given; unitCosts (a read-only array) and unitCostList are indexed by
+# that number. Bundles are rows of a matrix with one column per good, so the cost and utility of thousands of
+# bundles is one matrix product.
+class UtilityEngine:
+    __slots__ = ('goods', 'goodIndex', 'unitCosts', 'unitCostList', 'currencyUnit')
+
+    def __init__(self, goods, unitCosts, currencyUnit):
+        unitCostArray = np.array(unitCosts, dtype=float)
+        unitCostArray.flags.writeable = False
+        object.__setattr__(self, 'goods', tuple(goods))
+        object.__setattr__(self, 'goodIndex', {good: i for i, good in enumerate(goods)})
+        object.__setattr__(self, 'unitCosts', unitCostArray)
+        object.__setattr__(self, 'unitCostList', tuple(unitCosts))
+        object.__setattr__(self, 'currencyUnit', currencyUnit)
+
+
+    def __setattr__(self, name, value):
+        raise AttributeError("UtilityEngine is immutable")
+
+
+    # *** vectorize()
+    # Turn a {good: amount} bundle into a row vector (raises KeyError for goods not in the utility function)
+    def vectorize(self, quantity):
+        vector = np.zeros(len(self.goods))
+        for good, amount in quantity.items():
+            vector[self.goodIndex[good]] = amount
+        return vector
+
+
+    # *** bundle()
+    # Turn a row vector back into a {good: amount} bundle, leaving out goods with amount zero
+    def bundle(self, vector):
+        return {self.goods[i]: int(amount) if amount % 1 == 0 else float(amount)
+                for i, amount in enumerate(vector) if amount}
+
+
+    # *** bundleCost()
+    # Cost of a single {good: amount} bundle (plain arithmetic; NumPy only pays off for many bundles at once)
+    def bundleCost(self, quantity):
+        goodIndex = self.goodIndex
+        unitCostList = self.unitCostList
+        cost = 0.0
+        for good, amount in quantity.items():
+            cost += unitCostList[goodIndex[good]] * amount
+        return cost
+
+
+    # *** evaluate()
+    # Utility of selling each bundle (rows of an N x goods matrix) at the corresponding price (vector of N)
+    def evaluate(self, bundles, prices):
+        return np.asarray(prices, dtype=float) - np.asarray(bundles, dtype=float) @ self.unitCosts
+
+
+    # *** candidates()
+    # Bundles obtained by changing the amount of each good of the base bundle by an offset in [low, high]
+    # (bounds[i] is the (low, high) pair for good i). Negative amounts are discarded.
+    def candidates(self, base, bounds):
+        bundles = base + offsetGrid(tuple(bounds))
+        return bundles[(bundles >= 0).all(axis=1)]
+
+
+    # *** searchUpsell()
+    # For a request without a price: among the requested bundle plus up to maxExtraUnits more of each good, find the
+    # bundle with the highest utility when priced at the given markup, whose price stays within maxPriceRatio times
+    # the price of the requested bundle. Returns (bundle, price).
+    def searchUpsell(self, quantity, markupRatio, maxExtraUnits, maxPriceRatio):
+        base = self.vectorize(quantity)
+        bundles = self.candidates(base, [(0, maxExtraUnits)] * len(self.goods))
+        costs = bundles @ self.unitCosts
+        prices = (1.0 + markupRatio) * costs
+        feasible = prices <= maxPriceRatio * (1.0 + markupRatio) * (base @ self.unitCosts) + 1e-9
+        utilities = np.where(feasible, self.evaluate(bundles, prices), -np.inf)
+        best = int(np.argmax(utilities))
+        return self.bundle(bundles[best]), float(prices[best])
+
+
+    # *** searchCounterOffer()
+    # For an offer whose price is too low for the requested bundle: find the smaller sub-bundle that the offered price
+    # buys with at least minMarkupRatio markup, keeping as many of the requested units as possible (and, among those,
+    # the one with the highest utility). Returns the bundle, or None if the offered price already buys the requested
+    # bundle with that markup, or if no non-empty smaller sub-bundle qualifies.
+    def searchCounterOffer(self, quantity, price, minMarkupRatio):
+        base = self.vectorize(quantity)
+        if price >= (1.0 + minMarkupRatio) * (base @ self.unitCosts):
+            return None
+        bundles = self.candidates(base, [(-int(amount), 0) for amount in base])
+        bundles = bundles[(bundles != base).any(axis=1)] # Strictly smaller than the requested bundle
+        costs = bundles @ self.unitCosts
+        feasible = (costs > 0) & (price >= (1.0 + minMarkupRatio) * costs)
+        if not feasible.any():
+            return None
+        bundles = bundles[feasible]
+        units = bundles.sum(axis=1)
+        utilities = self.evaluate(bundles, np.full(len(bundles), price))
+        best = np.lexsort((utilities, units))[-1] # Most units first, then highest utility
+        return self.bundle(bundles[best])
+
+
+# *** offsetGrid()
+# Matrix of offset rows for the given per-good (low, high) bounds: the full grid when it has at most maxCandidates
+# rows, and otherwise one good varied at a time. Cached, since the same bounds come up again and again.
+@lru_cache(maxsize=256)
+def offsetGrid(bounds):
+    ranges = [np.arange(low, high + 1, dtype=float) for low, high in bounds]
+    gridSize = 1
+    for r in ranges:
+        gridSize *= len(r)
+    if gridSize <= maxCandidates:
+        grid = np.stack(np.meshgrid(*ranges, indexing='ij'), axis=-1).reshape(-1, len(ranges))
+    else:
+        rows = [np.zeros(len(ranges))]
+        for i, r in enumerate(ranges):
+            for d in r:
+                if d:
+                    row = np.zeros(len(ranges))
+                    row[i] = d
+                    rows.append(row)
+        grid = np.array(rows)
+    grid.flags.writeable = False
+    return grid
@@ -0,0 +1,115 @@
+# Imports
+import importlib
+import logging
+import threading
+import time
+metrics = importlib.import_module('metrics')
+
+logger = logging.getLogger('agent-py.watson-sessions')
+
+
+# *** WatsonSession
+# A Watson Assistant session ID and when it was created and last used
+class WatsonSession:
+    __slots__ = ('sessionId', 'createdAt', 'lastUsed')
+
+    def __init__(self, sessionId):
+        self.sessionId = sessionId
+        self.createdAt = time.time()
+        self.lastUsed = self.createdAt
+
+
+# *** WatsonSessionPool
+# Pool of live Watson Assistant sessions, so that classification does not have to create a session per message.
+# Up to `size` sessions are handed out concurrently, one per caller; further callers wait for one to be released.
+# Watson expires a session after `sessionTimeout` seconds of inactivity, so a background thread replaces idle
+# sessions `renewMargin` seconds before that happens. Session churn is counted in agent_watson_sessions_total.
+class WatsonSessionPool:
+
+    def __init__(self, createSession, deleteSession, size=4, sessionTimeout=300, renewMargin=30):
+        self.createSession = createSession # () -> session ID
+        self.deleteSession = deleteSession # (session ID) -> None
+        self.size = size
+        self.sessionTimeout = sessionTimeout
+        self.renewMargin = renewMargin
+        self.idle = []   # released sessions, most recently used last
+        self.count = 0   # sessions in existence (idle or handed out)
+        self.lock = threading.Condition()
+        self.renewer = None
+
+
+    # *** acquire()
+    # Take a live session for one classification, creating one if the pool is not yet full
+    def acquire(self):
+        with self.lock:
+            if not self.renewer:
+                self.renewer = threading.Thread(target=self.renewLoop, name='watson-session-renewer', daemon=True)
+                self.renewer.start()
+            self.lock.wait_for(lambda: self.idle or self.count < self.size)
+            if self.idle:
+                return self.idle.pop()
+            self.count += 1
+        try:
+            return self.newSession('created')
+        except Exception:
+            with self.lock:
+                self.count -= 1
+                self.lock.notify()
+            raise
+
+
+    # *** release()
+    # Give a session back to the pool after a successful call
+    def release(self, session):
+        session.lastUsed = time.time()
+        with self.lock:
+            self.idle.append(session)
+            self.lock.notify()
+
+
+    # *** discard()
+    # Drop a session that Watson reports as expired
+    def discard(self, session):
+        metrics.counter('agent_watson_sessions_total', 'Watson Assistant session churn', event='expired').inc()
+        with self.lock:
+            self.count -= 1
+            self.lock.notify()
+
+
+    # *** newSession()
+    def newSession(self, event):
+        session = WatsonSession(self.createSession())
+        metrics.counter('agent_watson_sessions_total', 'Watson Assistant session churn', event=event).inc()
+        return session
+
+
+    # *** renewLoop()
+    # Replace idle sessions that are about to expire. Sessions in use are left alone; using them keeps them alive.
+    def renewLoop(self):
+        interval = max(1.0, min(self.renewMargin / 2.0, self.sessionTimeout / 4.0))
+        while True:
+            time.sleep(interval)
+            deadline = time.time() - (self.sessionTimeout - self.renewMargin)
+            with self.lock:
+                stale = [session for session in self.idle if session.lastUsed < deadline]
+                self.idle = [session for session in self.idle if session.lastUsed >= deadline]
+            for session in stale:
+                try:
+                    fresh = self.newSession('renewed')
+                except Exception as e:
+                    logger.warning("Could not renew Watson session: %s", e)
+                    with self.lock:
+                        self.count -= 1
+                        self.lock.notify()
+                else:
+                    self.release(fresh)
+                try:
+                    self.deleteSession(session.sessionId)
+                except Exception:
+                    pass # It is about to expire anyway
+
+
+# *** isSessionExpired()
+# Whether an error from the Watson SDK means that the session no longer exists
+def isSessionExpired(error):
+    return getattr(error, 'code', None) == 404 and 'session' in str(getattr(error, 'message', error)).lower()
@@ -0,0 +1,15 @@
+# WSGI entry point, for serving the agent with a WSGI server other than the one built into agent-py.py, e.g.
+#
+#   gunicorn -c gunicorn.conf.py wsgi:app
+#
+# Several agents listed under `agents` in appSettings.json are served under the path prefix /<name>.
+
+# Imports
+import importlib
+
+agent_py = importlib.import_module('agent-py')
+
+appSettings, assistantParams = agent_py.loadSettings()
+agent_py.configureProcess(appSettings)
+agents = agent_py.createAgents(appSettings, assistantParams)
+app = agent_py.createApp(agents)